@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Compares finding the responsible LLMQ quorum for request ids by sorting
+# all quorums for each request with MNList.calc_responsible_quorum index.
+# Default quorum counts are close to mainnet: 24 LLMQ_50_60 quorums and
+# 4 quorums of each of LLMQ_400_60 and LLMQ_400_85 types.
+#
+# usage: bench_responsible_quorum.py [requests] [repeats]
+
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from struct import pack
+
+from electrum_xazab.crypto import sha256d
+from electrum_xazab.protx_list import MNList
+from electrum_xazab.xazab_msg import LLMQType
+
+
+Quorum = namedtuple('Quorum', 'llmqType quorumHash')
+QUORUM_COUNTS = {
+    LLMQType.LLMQ_50_60: 24,
+    LLMQType.LLMQ_400_60: 4,
+    LLMQType.LLMQ_400_85: 4,
+}
+
+
+def calc_responsible_quorum_by_sort(quorums, llmqType, request_id):
+    res = []
+    for q in quorums.values():
+        if q.llmqType != llmqType:
+            continue
+        prehash = pack('B', q.llmqType) + q.quorumHash + request_id
+        sorthash = sha256d(prehash)
+        res.append((sorthash, q))
+    res = sorted(res, key=lambda x: x[0])
+    return res[0][1] if res else None
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    quorums = {}
+    for llmqType, cnt in QUORUM_COUNTS.items():
+        for i in range(cnt):
+            q = Quorum(int(llmqType), os.urandom(32))
+            quorums[f'{q.quorumHash[::-1].hex()}:{q.llmqType}'] = q
+    mn_list = MNList.__new__(MNList)
+    mn_list._quorums_index_lock = threading.Lock()
+    mn_list._init_quorums_index()
+    mn_list.quorums = quorums
+    request_ids = [os.urandom(32) for i in range(num_requests)]
+    llmqType = int(LLMQType.LLMQ_50_60)
+
+    t0 = time.time()
+    for i in range(repeats):
+        by_sort = [calc_responsible_quorum_by_sort(quorums, llmqType, r)
+                   for r in request_ids]
+    sort_time = time.time() - t0
+    print(f'sort:  {num_requests} requests x {repeats} in {sort_time:.3f}s')
+
+    t0 = time.time()
+    for i in range(repeats):
+        indexed = [mn_list.calc_responsible_quorum(llmqType, r)
+                   for r in request_ids]
+    index_time = time.time() - t0
+    assert indexed == by_sort
+    print(f'index: {num_requests} requests x {repeats} in {index_time:.3f}s '
+          f'(speedup {sort_time / index_time:.2f}x, repeated requests '
+          f'found in cache of size {mn_list._responsible_quorums.maxsize})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Compares computing legacy sighash preimages of a large tx by serializing
+# the whole tx for each input with reusing one LegacySighashCache for all
+# of them, and times PartialTransaction.sign on the same tx, inline and
+# in a thread pool.
+#
+# usage: bench_sign_tx.py [num_inputs] [workers]
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from electrum_xazab.bitcoin import pubkey_to_address
+from electrum_xazab.crypto import sha256d
+from electrum_xazab.ecc import ECPrivkey
+from electrum_xazab.transaction import (PartialTransaction, PartialTxInput,
+                                        PartialTxOutput, TxOutpoint)
+
+
+def make_tx(num_inputs: int):
+    privkey = ECPrivkey(bytes([1] * 32))
+    pubkey = privkey.get_public_key_bytes(compressed=True)
+    inputs = []
+    for i in range(num_inputs):
+        txin = PartialTxInput(prevout=TxOutpoint(txid=(i + 1).to_bytes(32, 'big'), out_idx=i % 4))
+        txin.script_type = 'p2pkh'
+        txin.pubkeys = [pubkey]
+        txin.num_sig = 1
+        txin._trusted_value_sats = 100001
+        inputs.append(txin)
+    addr = pubkey_to_address('p2pkh', pubkey.hex())
+    outputs = [PartialTxOutput.from_address_and_value(addr, 100001)
+               for i in range(num_inputs)]
+    tx = PartialTransaction.from_io(inputs, outputs)
+    keypairs = {pubkey.hex(): (privkey.get_secret_bytes(), True)}
+    return tx, keypairs
+
+
+def main():
+    num_inputs = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    tx, keypairs = make_tx(num_inputs)
+
+    t0 = time.time()
+    uncached = [sha256d(tx.serialize_preimage_bytes(i)) for i in range(num_inputs)]
+    uncached_time = time.time() - t0
+    print(f'preimages, uncached: {num_inputs} inputs in {uncached_time:.3f}s')
+
+    t0 = time.time()
+    sighash_cache = tx.get_sighash_cache()
+    cached = [sha256d(tx.serialize_preimage_bytes(i, sighash_cache=sighash_cache))
+              for i in range(num_inputs)]
+    cached_time = time.time() - t0
+    assert cached == uncached
+    print(f'preimages, cached:   {num_inputs} inputs in {cached_time:.3f}s '
+          f'(speedup {uncached_time / cached_time:.2f}x)')
+
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    t0 = time.time()
+    for txin_index in range(num_inputs):
+        tx.sign_txin(txin_index, keypairs[next(iter(keypairs))][0],
+                     sighash_cache=sighash_cache)
+    inline_time = time.time() - t0
+    print(f'sign, inline:        {num_inputs} inputs in {inline_time:.3f}s')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        t0 = time.time()
+        assert tx.sign(keypairs, executor=executor) == num_inputs
+        pool_time = time.time() - t0
+    print(f'sign, thread pool:   {num_inputs} inputs in {pool_time:.3f}s '
+          f'({workers} workers, speedup {inline_time / pool_time:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
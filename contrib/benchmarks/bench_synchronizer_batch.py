@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Compares fetching histories and txs the way Synchronizer does, with one
+# JSON-RPC request per item and with items coalesced into batch requests
+# by RequestBatcher ('synchronizer_batch_size' config key). Requests go to
+# a local stub ElectrumX server answering after a simulated network delay.
+#
+# usage: bench_synchronizer_batch.py [items] [batch_size] [delay_ms]
+
+import asyncio
+import hashlib
+import sys
+import time
+from types import SimpleNamespace
+
+from aiorpcx import RPCSession, serve_rs, connect_rs
+
+from electrum_xazab.interface import Interface, NotificationSession
+from electrum_xazab.synchronizer import RequestBatcher
+from electrum_xazab.transaction import Transaction
+from electrum_xazab.util import SilentTaskGroup
+
+
+def make_raw_txs(num_txs: int):
+    raw_txs = {}
+    for i in range(num_txs):
+        raw = ('01000000' '01' + (i + 1).to_bytes(32, 'little').hex() + '00000000'
+               '00' 'ffffffff' '01' + (100000 + i).to_bytes(8, 'little').hex()
+               + '19' '76a914' + '11' * 20 + '88ac' '00000000')
+        raw_txs[Transaction(raw).txid()] = raw
+    return raw_txs
+
+
+class StubElectrumXSession(RPCSession):
+
+    delay = 0.02
+    raw_txs = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cost_hard_limit = 0
+
+    async def _send_message(self, message):
+        # simulated network latency, once per response msg (or batch)
+        await asyncio.sleep(self.delay)
+        return await super()._send_message(message)
+
+    async def handle_request(self, request):
+        if request.method == 'blockchain.scripthash.get_history':
+            return []
+        if request.method == 'blockchain.transaction.get':
+            return self.raw_txs[request.args[0]]
+
+
+def make_interface() -> Interface:
+    # just what get_history/get_transaction and NotificationSession use
+    interface = Interface.__new__(Interface)
+    interface.debug = False
+    interface.network = SimpleNamespace(debug=False, config={})
+    return interface
+
+
+async def run_bench(method_name: str, items, interface, batch_size: int):
+    semaphore = asyncio.Semaphore(100)  # as in NetworkJobOnDefaultServer
+    single_method, batch_method = {
+        'history': (interface.get_history_for_scripthash,
+                    interface.get_history_for_scripthashes),
+        'tx': (interface.get_transaction, interface.get_transactions),
+    }[method_name]
+
+    async def request_single(item):
+        async with semaphore:
+            return await single_method(item)
+
+    t0 = time.time()
+    single = await asyncio.gather(*[request_single(item) for item in items])
+    single_time = time.time() - t0
+
+    async def send_batch(batch_items):
+        async with semaphore:
+            return await batch_method(batch_items)
+
+    async with SilentTaskGroup() as group:
+        batcher = RequestBatcher(send_batch, taskgroup=group,
+                                 batch_size=batch_size, flush_interval=0.05)
+        t0 = time.time()
+        batched = await asyncio.gather(*[batcher.request(item) for item in items])
+        batch_time = time.time() - t0
+    assert single == batched
+    print(f'{method_name:7}: {len(items)} requests in {single_time:.3f}s, '
+          f'{batcher.batches_sent} batches in {batch_time:.3f}s '
+          f'(speedup {single_time / batch_time:.2f}x)')
+
+
+async def main():
+    num_items = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    StubElectrumXSession.delay = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+    StubElectrumXSession.raw_txs = raw_txs = make_raw_txs(num_items)
+    scripthashes = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(num_items)]
+
+    server = await serve_rs(StubElectrumXSession, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        interface = make_interface()
+        session_factory = lambda *args, **kwargs: NotificationSession(
+            *args, **kwargs, interface=interface)
+        async with connect_rs('127.0.0.1', port, session_factory=session_factory) as session:
+            interface.session = session
+            await run_bench('history', scripthashes, interface, batch_size)
+            await run_bench('tx', list(raw_txs), interface, batch_size)
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Compares verifying header chunks in a single thread with hashing them
+# in a process pool first (see 'header_verify_workers' config key).
+#
+# usage: bench_verify_chunk.py [workers] [chunks]
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from electrum_xazab import constants
+from electrum_xazab.blockchain import (Blockchain, HEADER_SIZE, serialize_header,
+                                       hash_raw_headers, hash_raw_headers_parallel)
+from electrum_xazab.constants import CHUNK_SIZE
+from electrum_xazab.simple_config import SimpleConfig
+from electrum_xazab.util import bfh
+
+
+def make_chunk(prev_hash: str, start_height: int) -> bytes:
+    headers = []
+    for height in range(start_height, start_height + CHUNK_SIZE):
+        header = {
+            'version': 0x20000000,
+            'prev_block_hash': prev_hash,
+            'merkle_root': '%064x' % height,
+            'timestamp': 1600000000 + 60 * height,
+            'bits': 0x207fffff,
+            'nonce': height,
+        }
+        raw = bfh(serialize_header(header))
+        prev_hash = hash_raw_headers(raw)[0]
+        headers.append(raw)
+    return b''.join(headers)
+
+
+def new_chain(config: SimpleConfig, first_chunk: bytes) -> Blockchain:
+    chain = Blockchain(config=config, forkpoint=0, parent=None,
+                       forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+    open(chain.path(), 'w+').close()
+    # the first chunk is only there to link the verified chunks to
+    chain.write(first_chunk, 0)
+    return chain
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    num_chunks = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    constants.set_regtest()
+    chunks = []
+    prev_hash = '00' * 32
+    for index in range(num_chunks + 1):
+        chunk = make_chunk(prev_hash, index * CHUNK_SIZE)
+        prev_hash = hash_raw_headers(chunk[-HEADER_SIZE:])[0]
+        chunks.append(chunk)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        config = SimpleConfig({'electrum_path': tmp_dir})
+        chain = new_chain(config, chunks[0])
+        t0 = time.time()
+        for index in range(1, num_chunks + 1):
+            hashes = chain.verify_chunk(index, chunks[index])
+            chain.save_chunk(index, chunks[index], hashes)
+        serial = time.time() - t0
+        print(f'serial:   {num_chunks} chunks in {serial:.3f}s')
+
+        chain.delete_hash_index()
+        chain = new_chain(config, chunks[0])
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # warm up the worker processes
+            hash_raw_headers_parallel(chunks[0], executor, workers)
+            t0 = time.time()
+            for index in range(1, num_chunks + 1):
+                hashes = hash_raw_headers_parallel(chunks[index], executor, workers)
+                hashes = chain.verify_chunk(index, chunks[index], hashes)
+                chain.save_chunk(index, chunks[index], hashes)
+            parallel = time.time() - t0
+        print(f'parallel: {num_chunks} chunks in {parallel:.3f}s ({workers} workers, '
+              f'speedup {serial / parallel:.2f}x)')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Compares decoding received P2P msgs fully with checking only their
+# header-level fields, as done for msgs XazabPeer drops (inv entries
+# already seen, dsq not ready for the mixing session, ...).
+#
+# Msgs are read from a capture file, one '<cmd> <payload hex>' per line.
+# The default capture is data/xazab_msgs.capture, write a new one with
+# --write-capture (dsq payload is the testnet msg from test_xazab_msg.py).
+#
+# usage: bench_xazab_msg.py [capture_file] [iterations]
+#        bench_xazab_msg.py --write-capture capture_file
+
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+from electrum_xazab.util import bfh, bh2u
+from electrum_xazab.xazab_msg import (XazabCmd, XazabInvMsg, XazabInventory,
+                                      XazabType)
+from electrum_xazab.xazab_tx import to_compact_size
+
+
+DEFAULT_CAPTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'data', 'xazab_msgs.capture')
+
+TESTNET_DSQ = ('020000005d442d0aab9acf68fe13e2f93f9be9b25d442d0a'
+               'ab9acf68fe13e2f93f9be9b20100000053cd705d00000000'
+               '01605d442d0aab9acf68fe13e2f93f9be9b25d442d0aab9a'
+               'cf68fe13e2f93f9be9b25d442d0aab9acf68fe13e2f93f9b'
+               'e9b25d442d0aab9acf68fe13e2f93f9be9b25d442d0aab9a'
+               'cf68fe13e2f93f9be9b25d442d0aab9acf68fe13e2f93f9b'
+               'e9b2')
+
+HEADER_CHECKS = {
+    'inv': lambda cmd: list(cmd.inv_items()),
+    'islock': lambda cmd: cmd.islock_txid,
+    'dsq': lambda cmd: cmd.dsq_ready,
+}
+
+
+def write_capture(path):
+    # mix of msgs as received by a node: mostly islock invs and islocks
+    rnd = random.Random(0)
+    rand_bytes = lambda n: bytes(rnd.getrandbits(8) for i in range(n))
+    msgs = []
+    for i in range(100):
+        inv_cnt = rnd.choice([1, 1, 2, 3, 8, 50])
+        inv = XazabInvMsg([XazabInventory(XazabType.MSG_ISLOCK, rand_bytes(32))
+                           for j in range(inv_cnt)])
+        msgs.append(('inv', inv.serialize()))
+        in_cnt = rnd.choice([1, 1, 2, 3, 10])
+        islock = (to_compact_size(in_cnt)
+                  + b''.join(rand_bytes(32) + rnd.randrange(4).to_bytes(4, 'little')
+                             for j in range(in_cnt))
+                  + rand_bytes(32)          # txid
+                  + rand_bytes(96))         # sig
+        msgs.append(('islock', islock))
+        if i % 4 == 0:
+            msgs.append(('dsq', bfh(TESTNET_DSQ)))
+    with open(path, 'w') as f:
+        for cmd, payload in msgs:
+            f.write(f'{cmd} {bh2u(payload)}\n')
+    print(f'written {len(msgs)} msgs to {path}')
+
+
+def read_capture(path):
+    msgs = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            cmd, payload = line.split()
+            msgs[cmd].append(bfh(payload))
+    return msgs
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--write-capture':
+        write_capture(sys.argv[2])
+        return
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CAPTURE
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    for cmd_name, payloads in read_capture(path).items():
+        check_header = HEADER_CHECKS.get(cmd_name)
+        if check_header is None:
+            continue
+        t0 = time.time()
+        for i in range(iterations):
+            for payload in payloads:
+                XazabCmd(cmd_name, payload).payload
+        full_time = time.time() - t0
+
+        t0 = time.time()
+        for i in range(iterations):
+            for payload in payloads:
+                check_header(XazabCmd(cmd_name, payload))
+        header_time = time.time() - t0
+        size = sum(len(p) for p in payloads)
+        print(f'{cmd_name:7} {len(payloads):4} msgs, {size:6} bytes x {iterations}: '
+              f'full decode {full_time:.3f}s, header fields {header_time:.3f}s '
+              f'(speedup {full_time / header_time:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
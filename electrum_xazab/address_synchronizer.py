@@ -102,7 +102,21 @@ class AddressSynchronizer(Logger):
         self.psman = PSManager(self)
         self.protx_manager = ProTxManager(self)
 
-        self._get_addr_balance_cache = {}
+        # per address caches, invalidated by _mark_address_history_changed
+        self._get_addr_balance_cache = {}  # type: Dict[str, Tuple[int, int, int]]
+        self._get_addr_io_cache = {}  # type: Dict[str, Tuple[dict, dict]]
+        # balances of these addresses depend on coinbase maturity
+        self._coinbase_addrs = set()  # type: Set[str]
+        self._addr_balance_cache_height = None  # type: Optional[int]
+        # get_history rows of the last requested domain, kept up to date
+        # incrementally, see _update_history_index
+        self._history_index_lock = threading.Lock()  # protects dirty txids set only
+        self._history_index_domain = None  # type: Optional[Set[str]]
+        self._history_index_rows = {}  # type: Dict[str, Tuple[int, Optional[int], tuple]]
+        self._history_index_order = []  # type: List[str]
+        self._history_index_dirty = set()  # type: Set[str]
+        self._history_index_height = 0
+        self._tx_type_cache = {}  # type: Dict[str, int]
 
         self.load_and_cleanup()
 
@@ -209,33 +223,41 @@ class AddressSynchronizer(Logger):
             self.protx_manager.on_network_start(self.network)
             self.psman.on_network_start(self.network)
             util.register_callback(self.on_xazab_islock, ['xazab-islock'])
+            self.network.xazab_net.register_islock_wanted_check(
+                self.is_islock_wanted)
 
     def on_blockchain_updated(self, event, *args):
-        self._get_addr_balance_cache = {}  # invalidate cache
-        self.db.process_and_clear_islocks(self.get_local_height())
+        with self.lock:
+            islocks = set(self.db.islocks.keys())
+            self.db.process_and_clear_islocks(self.get_local_height())
+            for txid in islocks - set(self.db.islocks.keys()):
+                self._invalidate_tx_caches(txid)
+
+    def is_islock_wanted(self, txid):
+        if txid in self.db.islocks:
+            return False
+        return txid in self.unverified_tx or txid in self.db.verified_tx
 
     def on_xazab_islock(self, event, txid):
         if txid in self.db.islocks:
             return
         elif txid in self.unverified_tx or txid in self.db.verified_tx:
             self.logger.info(f'found tx for islock: {txid}')
-            xazab_net = self.network.xazab_net
-            if xazab_net.verify_on_recent_islocks(txid):
-                self.db.add_islock(txid)
-                self._get_addr_balance_cache = {}  # invalidate cache
-                self.save_db()
-                util.trigger_callback('verified-islock', self, txid)
+            self._add_islock_if_verified(txid)
 
     def find_islock_pair(self, txid):
         if txid in self.db.islocks:
             return
         else:
-            xazab_net = self.network.xazab_net
-            if xazab_net.verify_on_recent_islocks(txid):
-                self.db.add_islock(txid)
-                self._get_addr_balance_cache = {}  # invalidate cache
-                self.save_db()
-                util.trigger_callback('verified-islock', self, txid)
+            self._add_islock_if_verified(txid)
+
+    def _add_islock_if_verified(self, txid):
+        xazab_net = self.network.xazab_net
+        if xazab_net.verify_on_recent_islocks(txid):
+            self.db.add_islock(txid)
+            self._invalidate_tx_caches(txid)
+            self.save_db()
+            util.trigger_callback('verified-islock', self, txid)
 
     async def stop(self):
         if self.network:
@@ -251,14 +273,13 @@ class AddressSynchronizer(Logger):
                 util.unregister_callback(self.on_blockchain_updated)
                 self.psman.on_stop_threads()
                 util.unregister_callback(self.on_xazab_islock)
+                self.network.xazab_net.unregister_islock_wanted_check(
+                    self.is_islock_wanted)
                 self.db.put('stored_height', self.get_local_height())
 
     def add_address(self, address, ps_ks=False):
         if not self.db.get_addr_history(address):
-            if ps_ks:
-                self.db.ps_ks_hist[address] = []
-            else:
-                self.db.history[address] = []
+            self.db.set_addr_history(address, [], ps_ks=ps_ks)
             self.set_up_to_date(False)
         if self.synchronizer:
             self.synchronizer.add(address)
@@ -359,7 +380,7 @@ class AddressSynchronizer(Logger):
                         pass
                     else:
                         self.db.add_txi_addr(tx_hash, addr, ser, v)
-                        self._get_addr_balance_cache.pop(addr, None)  # invalidate cache
+                        self._invalidate_addr_caches(addr)
             for txi in tx.inputs():
                 if txi.is_coinbase_input():
                     continue
@@ -377,7 +398,7 @@ class AddressSynchronizer(Logger):
                 addr = self.get_txout_address(txo)
                 if addr and self.is_mine(addr):
                     self.db.add_txo_addr(tx_hash, addr, n, v, is_coinbase)
-                    self._get_addr_balance_cache.pop(addr, None)  # invalidate cache
+                    self._invalidate_addr_caches(addr)
                     # give v to txi that spends me
                     next_tx = self.db.get_spent_outpoint(tx_hash, n)
                     if next_tx is not None:
@@ -386,7 +407,7 @@ class AddressSynchronizer(Logger):
             # add to local history
             self._add_tx_to_local_history(tx_hash)
             # save
-            is_new_tx = (tx_hash not in self.db.transactions)
+            is_new_tx = not self.db.has_transaction(tx_hash)
             self.db.add_transaction(tx_hash, tx)
             self.db.add_num_inputs_to_tx(tx_hash, len(tx.inputs()))
             if is_new_tx and self.psman.enabled:
@@ -434,12 +455,13 @@ class AddressSynchronizer(Logger):
             remove_from_spent_outpoints()
             self._remove_tx_from_local_history(tx_hash)
             for addr in itertools.chain(self.db.get_txi_addresses(tx_hash), self.db.get_txo_addresses(tx_hash)):
-                self._get_addr_balance_cache.pop(addr, None)  # invalidate cache
+                self._invalidate_addr_caches(addr)
             self.db.remove_txi(tx_hash)
             self.db.remove_txo(tx_hash)
             self.db.remove_tx_fee(tx_hash)
             self.db.remove_verified_tx(tx_hash)
             self.unverified_tx.pop(tx_hash, None)
+            self._tx_type_cache.pop(tx_hash, None)
             if tx:
                 for idx, txo in enumerate(tx.outputs()):
                     scripthash = bitcoin.script_to_scripthash(txo.scriptpubkey.hex())
@@ -472,6 +494,7 @@ class AddressSynchronizer(Logger):
                     # make tx local
                     self.unverified_tx.pop(tx_hash, None)
                     self.db.remove_verified_tx(tx_hash)
+                    self._invalidate_tx_caches(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
             self.db.set_addr_history(addr, hist)
@@ -491,6 +514,7 @@ class AddressSynchronizer(Logger):
         # Store fees
         for tx_hash, fee_sat in tx_fees.items():
             self.db.add_tx_fee_from_server(tx_hash, fee_sat)
+            self._invalidate_history_index(tx_hash)
         # unsubscribe from spent ps coins addresses
         if self.psman.enabled:
             self.psman.unsubscribe_spent_addr(addr, hist)
@@ -536,6 +560,10 @@ class AddressSynchronizer(Logger):
                 self.db.clear_history()
                 self._history_local.clear()
                 self._get_addr_balance_cache = {}  # invalidate cache
+                self._get_addr_io_cache = {}
+                self._coinbase_addrs = set()
+                self._invalidate_history_index()
+                self._tx_type_cache.clear()
 
     def get_txpos(self, tx_hash, islock):
         """Returns (height, txpos) tuple, even if the tx is unverified."""
@@ -575,32 +603,14 @@ class AddressSynchronizer(Logger):
             domain = self.get_addresses()
             domain += self.psman.get_addresses()
         domain = set(domain)
-        # 1. Get the history of each address in the domain, maintain the
-        #    delta of a tx as the sum of its deltas on domain addresses
-        tx_deltas = defaultdict(int)  # type: Dict[str, int]
-        tx_islocks = {}
-        for addr in domain:
-            h = self.get_address_history(addr)
-            for tx_hash, height, islock in h:
-                tx_deltas[tx_hash] += self.get_tx_delta(tx_hash, addr)
-                if tx_hash not in tx_islocks:
-                    tx_islocks[tx_hash] = islock
-        # 2. create sorted history
+        # 1. bring the rows of the domain up to date,
+        # 2. the rows are kept sorted by _update_history_index
+        self._update_history_index(domain)
         history = []
-        for tx_hash in tx_deltas:
-            delta = tx_deltas[tx_hash]
-            tx_mined_status = self.get_tx_height(tx_hash)
-            islock = tx_islocks[tx_hash]
-            if islock:
-                islock_sort = tx_hash if not tx_mined_status.conf else ''
-            else:
-                islock_sort = ''
-            fee = self.get_tx_fee(tx_hash)
-            history.append((tx_hash, tx_mined_status, delta, fee,
-                            islock, islock_sort))
-        # tx_hash = x[0], islock = x[4],  islock_sort = x[5]
-        history.sort(key=lambda x: (self.get_txpos(x[0], x[4]), x[5]),
-                     reverse=True)
+        for tx_hash in self._history_index_order:
+            delta, fee, sort_key = self._history_index_rows[tx_hash]
+            history.append((tx_hash, self.get_tx_height(tx_hash), delta, fee,
+                            self.db.get_islock(tx_hash)))
         # 3. add balance
         c, u, x = self.get_balance(domain)
         balance = c + u + x
@@ -618,13 +628,10 @@ class AddressSynchronizer(Logger):
         group_balance = None
         hist_len = len(history)
         for i, (tx_hash, tx_mined_status, delta, fee,
-                islock, islock_sort) in enumerate(history):
+                islock) in enumerate(history):
             tx_type = 0
             if show_dip2:
-                tx = self.db.get_transaction(tx_hash)
-                if tx:
-                    raw_bytes = bfh(tx.serialize())
-                    tx_type = tx_header_to_tx_type(raw_bytes[:4])
+                tx_type = self._get_tx_type(tx_hash)
             if (group_ps or show_dip2) and not tx_type:  # prefer ProTx type
                 tx_type, completed = self.db.get_ps_tx(tx_hash)
 
@@ -689,8 +696,94 @@ class AddressSynchronizer(Logger):
 
         return h2
 
+    def _invalidate_history_index(self, txid: str = None) -> None:
+        """Mark the get_history row of txid as outdated,
+        or the whole history index if txid is None."""
+        with self._history_index_lock:
+            if txid is None:
+                self._history_index_domain = None
+            else:
+                self._history_index_dirty.add(txid)
+
+    def _get_history_row(self, tx_hash: str, domain: Set[str]) -> Optional[Tuple[int, Optional[int], tuple]]:
+        """Returns (delta, fee, sort_key) of tx_hash, or None
+        if tx_hash is not in the history of domain."""
+        addrs = set(itertools.chain(self.db.get_txi_addresses(tx_hash),
+                                    self.db.get_txo_addresses(tx_hash)))
+        addrs = [addr for addr in addrs
+                 if addr in domain and tx_hash in self._history_local.get(addr, ())]
+        if not addrs:
+            return None
+        delta = sum(self.get_tx_delta(tx_hash, addr) for addr in addrs)
+        fee = self.get_tx_fee(tx_hash)
+        islock = self.db.get_islock(tx_hash)
+        if islock and not self.get_tx_height(tx_hash).conf:
+            islock_sort = tx_hash
+        else:
+            islock_sort = ''
+        return delta, fee, (self.get_txpos(tx_hash, islock), islock_sort)
+
+    def _update_history_index(self, domain: Set[str]) -> None:
+        """Recompute the rows of transactions that changed since the
+        last call, or all rows if domain differs from the cached one.
+        Must be called with self.lock and self.transaction_lock."""
+        local_height = self.get_local_height()
+        with self._history_index_lock:
+            dirty, self._history_index_dirty = self._history_index_dirty, set()
+            cached_domain = self._history_index_domain
+        rows = self._history_index_rows
+        if cached_domain != domain:
+            rows.clear()
+            self._history_index_order = []
+            dirty = set()
+            for addr in domain:
+                dirty |= self._history_local.get(addr, set())
+            with self._history_index_lock:
+                self._history_index_domain = set(domain)
+        elif local_height != self._history_index_height:
+            # sort keys of islocked txs depend on their confirmations
+            dirty |= set(self.db.islocks.keys()) & set(rows)
+        self._history_index_height = local_height
+        if not dirty:
+            return
+        for tx_hash in dirty:
+            row = self._get_history_row(tx_hash, domain)
+            if row is None:
+                rows.pop(tx_hash, None)
+            else:
+                rows[tx_hash] = row
+        # start from the previous order so that sorting is close to linear
+        order = [tx_hash for tx_hash in self._history_index_order
+                 if tx_hash in rows and tx_hash not in dirty]
+        order.extend(tx_hash for tx_hash in dirty if tx_hash in rows)
+        order.sort(key=lambda tx_hash: rows[tx_hash][2], reverse=True)
+        self._history_index_order = order
+
+    def _invalidate_tx_caches(self, tx_hash: str) -> None:
+        """Called when the mined status or islock of tx_hash changed."""
+        self._invalidate_history_index(tx_hash)
+        with self.transaction_lock:
+            for addr in itertools.chain(self.db.get_txi_addresses(tx_hash),
+                                        self.db.get_txo_addresses(tx_hash)):
+                self._invalidate_addr_caches(addr)
+
+    def _invalidate_addr_caches(self, addr: str) -> None:
+        self._get_addr_balance_cache.pop(addr, None)
+        self._get_addr_io_cache.pop(addr, None)
+
+    def _get_tx_type(self, tx_hash: str) -> int:
+        tx_type = self._tx_type_cache.get(tx_hash)
+        if tx_type is None:
+            tx = self.db.get_transaction(tx_hash)
+            if not tx:
+                return 0
+            tx_type = tx_header_to_tx_type(bfh(tx.serialize())[:4])
+            self._tx_type_cache[tx_hash] = tx_type
+        return tx_type
+
     def _add_tx_to_local_history(self, txid):
         with self.transaction_lock:
+            self._invalidate_history_index(txid)
             for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
                 cur_hist = self._history_local.get(addr, set())
                 cur_hist.add(txid)
@@ -699,6 +792,7 @@ class AddressSynchronizer(Logger):
 
     def _remove_tx_from_local_history(self, txid):
         with self.transaction_lock:
+            self._invalidate_history_index(txid)
             for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
                 cur_hist = self._history_local.get(addr, set())
                 try:
@@ -707,8 +801,10 @@ class AddressSynchronizer(Logger):
                     pass
                 else:
                     self._history_local[addr] = cur_hist
+                    self._mark_address_history_changed(addr)
 
     def _mark_address_history_changed(self, addr: str) -> None:
+        self._invalidate_addr_caches(addr)
         # history for this address changed, wake up coroutines:
         self._address_history_changed_events[addr].set()
         # clear event immediately so that coroutines can wait() for the next change:
@@ -728,11 +824,14 @@ class AddressSynchronizer(Logger):
             if tx_height in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT):
                 with self.lock:
                     self.db.remove_verified_tx(tx_hash)
+                    self._invalidate_tx_caches(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             with self.lock:
                 # tx will be verified only if height > 0
+                if self.unverified_tx.get(tx_hash) != tx_height:
+                    self._invalidate_tx_caches(tx_hash)
                 self.unverified_tx[tx_hash] = tx_height
 
     def remove_unverified_tx(self, tx_hash, tx_height):
@@ -740,14 +839,22 @@ class AddressSynchronizer(Logger):
             new_height = self.unverified_tx.get(tx_hash)
             if new_height == tx_height:
                 self.unverified_tx.pop(tx_hash, None)
+                self._invalidate_tx_caches(tx_hash)
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
+        self.add_verified_txs({tx_hash: info})
+
+    def add_verified_txs(self, infos: Dict[str, TxMinedInfo]):
         # Remove from the unverified map and add to the verified map
         with self.lock:
-            self.unverified_tx.pop(tx_hash, None)
-            self.db.add_verified_tx(tx_hash, info)
-        tx_mined_status = self.get_tx_height(tx_hash)
-        util.trigger_callback('verified', self, tx_hash, tx_mined_status)
+            for tx_hash in infos:
+                self.unverified_tx.pop(tx_hash, None)
+            self.db.add_verified_txs(infos)
+            for tx_hash in infos:
+                self._invalidate_tx_caches(tx_hash)
+        for tx_hash in infos:
+            tx_mined_status = self.get_tx_height(tx_hash)
+            util.trigger_callback('verified', self, tx_hash, tx_mined_status)
 
     def get_unverified_txs(self):
         '''Returns a map from tx hash to transaction height'''
@@ -775,6 +882,7 @@ class AddressSynchronizer(Logger):
                         # into unverified_tx with the old height, and if we get
                         # a status update, that will overwrite it.
                         self.unverified_tx[tx_hash] = tx_height
+                        self._invalidate_tx_caches(tx_hash)
                         txs.add(tx_hash)
         return txs
 
@@ -910,6 +1018,10 @@ class AddressSynchronizer(Logger):
 
     def get_addr_io(self, address):
         with self.lock, self.transaction_lock:
+            cached_value = self._get_addr_io_cache.get(address)
+            if cached_value is not None:
+                received, sent = cached_value
+                return dict(received), dict(sent)
             h = self.get_address_history(address)
             received = {}
             sent = {}
@@ -921,7 +1033,10 @@ class AddressSynchronizer(Logger):
                 l = self.db.get_txi_addr(tx_hash, address)
                 for txi, v in l:
                     sent[txi] = (height, islock)
-        return received, sent
+            # cache needs to be invalidated if the history of address changes,
+            # or if a tx of it gets (un)verified or islocked
+            self._get_addr_io_cache[address] = (received, sent)
+        return dict(received), dict(sent)
 
 
     def get_addr_outputs(self, address: str) -> Dict[TxOutpoint, PartialTxInput]:
@@ -987,6 +1102,13 @@ class AddressSynchronizer(Logger):
             min_rounds = None
         if ps_denoms is None:
             ps_denoms = {}
+        mempool_height = self.get_local_height() + 1  # height of next block
+        with self.lock:
+            if self._addr_balance_cache_height != mempool_height:
+                # only coinbase outputs depend on the local height (maturity)
+                for addr in self._coinbase_addrs:
+                    self._get_addr_balance_cache.pop(addr, None)
+                self._addr_balance_cache_height = mempool_height
         # cache is only used if there are no excluded_coins or min_rounds
         if not excluded_coins and min_rounds is None:
             cached_value = self._get_addr_balance_cache.get(address)
@@ -997,8 +1119,9 @@ class AddressSynchronizer(Logger):
         assert isinstance(excluded_coins, set), f"excluded_coins should be set, not {type(excluded_coins)}"
         received, sent = self.get_addr_io(address)
         c = u = x = 0
-        mempool_height = self.get_local_height() + 1  # height of next block
         for txo, (tx_height, v, is_cb, islock) in received.items():
+            if is_cb:
+                self._coinbase_addrs.add(address)
             if min_rounds is not None and txo not in ps_denoms:
                 continue
             if txo in excluded_coins:
@@ -96,6 +96,34 @@ def _CKD_pub(parent_pubkey: bytes, parent_chaincode: bytes, child_index: bytes)
     return child_pubkey, child_chaincode
 
 
+def derive_child_keypairs(parent_privkey: bytes, parent_chaincode: bytes,
+                          indices: Iterable[int]) -> List[Tuple[bytes, bytes]]:
+    """Returns (privkey, compressed pubkey) of non-hardened children at indices.
+    Same keys as CKD_priv, but the parent pubkey is computed once, so each
+    child costs a single EC multiplication. Takes and returns only bytes,
+    to be usable in worker processes.
+    """
+    parent_pubkey = ecc.ECPrivkey(parent_privkey).get_public_key_bytes(compressed=True)
+    parent_secexp = ecc.string_to_number(parent_privkey)
+    res = []
+    for child_index in indices:
+        if child_index < 0 or child_index & BIP32_PRIME:
+            raise ValueError(f'not a non-hardened bip32 index: {child_index}')
+        I = hmac_oneshot(parent_chaincode,
+                         parent_pubkey + child_index.to_bytes(4, byteorder='big'),
+                         hashlib.sha512)
+        I_left = ecc.string_to_number(I[0:32])
+        child_secexp = (I_left + parent_secexp) % ecc.CURVE_ORDER
+        if I_left >= ecc.CURVE_ORDER or child_secexp == 0:
+            # CKD_priv skips to the next index
+            child_privkey = CKD_priv(parent_privkey, parent_chaincode, child_index)[0]
+        else:
+            child_privkey = int.to_bytes(child_secexp, length=32, byteorder='big', signed=False)
+        child_pubkey = ecc.ECPrivkey(child_privkey).get_public_key_bytes(compressed=True)
+        res.append((child_privkey, child_pubkey))
+    return res
+
+
 def xprv_header(xtype: str, *, net=None) -> bytes:
     if net is None:
         net = constants.net
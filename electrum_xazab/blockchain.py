@@ -20,17 +20,20 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import asyncio
+import mmap
 import os
 import threading
 import time
-from typing import Optional, Dict, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Mapping, Sequence, List
 
 from . import util
 from .bitcoin import hash_encode, int_to_hex, rev_hex
 from .constants import CHUNK_SIZE
 from .crypto import sha256d
 from . import constants
-from .util import bfh, bh2u
+from .util import bfh, bh2u, LRUCache
 from .simple_config import SimpleConfig
 from .crypto import PoWHash
 from .logging import get_logger, Logger
@@ -39,10 +42,14 @@ from .logging import get_logger, Logger
 _logger = get_logger(__name__)
 
 HEADER_SIZE = 80  # bytes
+HASH_SIZE = 32  # bytes, entry size of the height->hash index
+HASH_INDEX_DIR = 'header_hashes'
 MAX_TARGET = 0x00000FFFFF000000000000000000000000000000000000000000000000000000
 POW_TARGET_SPACING = int(60)  # Xazab: 1 minutes
 POW_DGW3_HEIGHT = 68589
 DGW_PAST_BLOCKS = 24
+HEADER_CACHE_SIZE = 4 * CHUNK_SIZE  # deserialized headers kept per chain
+HASH_CACHE_SIZE = 8 * CHUNK_SIZE  # header hashes kept per chain
 
 
 class MissingHeader(Exception):
@@ -88,6 +95,72 @@ def hash_raw_header(header: str) -> str:
     return hash_encode(PoWHash(bfh(header)))
 
 
+def hash_raw_headers(data: bytes) -> List[str]:
+    """Return the hashes of the concatenated raw headers in data."""
+    return [hash_encode(PoWHash(data[i:i+HEADER_SIZE]))
+            for i in range(0, len(data), HEADER_SIZE)]
+
+
+_chunk_hash_executor = None  # type: Optional[ProcessPoolExecutor]
+_chunk_hash_workers = 0
+_chunk_hash_executor_lock = threading.Lock()
+
+
+def get_chunk_hash_executor(config: 'SimpleConfig') -> Optional[ProcessPoolExecutor]:
+    """Return the process pool used to hash header chunks,
+    or None if chunks are to be hashed in the calling thread."""
+    global _chunk_hash_executor, _chunk_hash_workers
+    workers = config.get_header_verify_workers()
+    if workers <= 1:
+        workers = 0
+    with _chunk_hash_executor_lock:
+        if workers != _chunk_hash_workers:
+            if _chunk_hash_executor is not None:
+                _chunk_hash_executor.shutdown(wait=False)
+                _chunk_hash_executor = None
+            if workers:
+                _chunk_hash_executor = ProcessPoolExecutor(max_workers=workers)
+            _chunk_hash_workers = workers
+        return _chunk_hash_executor
+
+
+def shutdown_chunk_hash_executor() -> None:
+    global _chunk_hash_executor, _chunk_hash_workers
+    with _chunk_hash_executor_lock:
+        if _chunk_hash_executor is not None:
+            _chunk_hash_executor.shutdown(wait=False)
+        _chunk_hash_executor = None
+        _chunk_hash_workers = 0
+
+
+def _split_headers(data: bytes, parts: int) -> List[bytes]:
+    num = len(data) // HEADER_SIZE
+    per_part = max(1, -(-num // max(1, parts)))
+    step = per_part * HEADER_SIZE
+    return [data[i:i+step] for i in range(0, len(data), step)]
+
+
+def hash_raw_headers_parallel(data: bytes, executor: ProcessPoolExecutor,
+                              parts: int) -> List[str]:
+    """Like hash_raw_headers, but hashes parts of data in executor."""
+    hashes = []
+    for part in executor.map(hash_raw_headers, _split_headers(data, parts)):
+        hashes.extend(part)
+    return hashes
+
+
+async def hash_raw_headers_async(data: bytes, executor: ProcessPoolExecutor,
+                                 parts: int) -> List[str]:
+    """Like hash_raw_headers_parallel, without blocking the event loop."""
+    loop = asyncio.get_event_loop()
+    results = await asyncio.gather(*[loop.run_in_executor(executor, hash_raw_headers, part)
+                                     for part in _split_headers(data, parts)])
+    hashes = []
+    for part in results:
+        hashes.extend(part)
+    return hashes
+
+
 # key: blockhash hex at forkpoint
 # the chain at some key is the best chain that includes the given hash
 blockchains = {}  # type: Dict[str, Blockchain]
@@ -106,7 +179,9 @@ def read_blockchains(config: 'SimpleConfig'):
         header_after_cp = best_chain.read_header(constants.net.max_checkpoint()+1)
         if not header_after_cp or not best_chain.can_connect(header_after_cp, check_height=False):
             _logger.info("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
+            best_chain.close_mmap()
             os.unlink(best_chain.path())
+            best_chain.delete_hash_index()
             best_chain.update_size()
     # forks
     fdir = os.path.join(util.get_headers_dir(config), 'forks')
@@ -118,6 +193,9 @@ def read_blockchains(config: 'SimpleConfig'):
     def delete_chain(filename, reason):
         _logger.info(f"[blockchain] deleting chain {filename}: {reason}")
         os.unlink(os.path.join(fdir, filename))
+        index_path = os.path.join(util.get_headers_dir(config), HASH_INDEX_DIR, 'forks', filename)
+        if os.path.exists(index_path):
+            os.unlink(index_path)
 
     def instantiate_chain(filename):
         __, forkpoint, prev_hash, first_hash = filename.split('_')
@@ -142,6 +220,7 @@ def read_blockchains(config: 'SimpleConfig'):
                        prev_hash=prev_hash)
         # consistency checks
         h = b.read_header(b.forkpoint)
+        b.close_mmap()
         if first_hash != hash_header(h):
             delete_chain(filename, "incorrect first hash for chain")
             return
@@ -178,6 +257,7 @@ def init_headers_file_for_best_chain():
                     bin_header = util.bfh(header_data)
                     f.write(bin_header)
         util.ensure_sparse_file(filename)
+        b.delete_hash_index()
     with b.lock:
         b.update_size()
 
@@ -201,6 +281,10 @@ class Blockchain(Logger):
         self._forkpoint_hash = forkpoint_hash  # blockhash at forkpoint. "first hash"
         self._prev_hash = prev_hash  # blockhash immediately before forkpoint
         self.lock = threading.RLock()
+        self._mmap = None  # type: Optional[mmap.mmap]
+        self._index_mmap = None  # type: Optional[mmap.mmap]
+        self._header_cache = LRUCache(HEADER_CACHE_SIZE)  # type: LRUCache[int, dict]
+        self._hash_cache = LRUCache(HASH_CACHE_SIZE)  # type: LRUCache[int, str]
         self.update_size()
 
     def with_lock(func):
@@ -301,12 +385,134 @@ class Blockchain(Logger):
 
     @with_lock
     def update_size(self) -> None:
+        self._update_size()
+        self.clear_header_cache()
+
+    def _update_size(self) -> None:
+        self.close_mmap()
         p = self.path()
         self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
 
+    @with_lock
+    def close_mmap(self) -> None:
+        """Release the mappings of the headers file and of the hash index.
+        They are re-created lazily on the next read."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._index_mmap is not None:
+            self._index_mmap.close()
+            self._index_mmap = None
+
+    @with_lock
+    def clear_header_cache(self) -> None:
+        self._header_cache.clear()
+        self._hash_cache.clear()
+
+    def _invalidate_header_cache_from(self, height: int) -> None:
+        # only heights up to the tip get cached, appending headers at
+        # the tip has nothing to drop
+        tip = self.height()
+        cnt = tip - height + 1
+        if cnt <= 0:
+            return
+        for cache in (self._header_cache, self._hash_cache):
+            if cnt > len(cache):
+                for h in cache.keys():
+                    if h >= height:
+                        cache.pop(h)
+            else:
+                for h in range(height, tip + 1):
+                    cache.pop(h)
+
+    def _get_mmap(self) -> mmap.mmap:
+        if self._mmap is None:
+            name = self.path()
+            self.assert_headers_file_available(name)
+            with open(name, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    @with_lock
+    def index_path(self) -> str:
+        """Path of the height->hash index of this chain. Entries are the
+        32 byte hashes of the headers at the same positions of the headers
+        file, all zeroes marks an entry that is not known yet."""
+        d = util.get_headers_dir(self.config)
+        return os.path.join(d, HASH_INDEX_DIR, os.path.relpath(self.path(), d))
+
+    @with_lock
+    def delete_hash_index(self) -> None:
+        self.close_mmap()
+        p = self.index_path()
+        if os.path.exists(p):
+            os.unlink(p)
+        self.clear_header_cache()
+
+    def _get_index_mmap(self) -> Optional[mmap.mmap]:
+        if self._index_mmap is None:
+            length = self._size * HASH_SIZE
+            if not length:
+                return None
+            p = self.index_path()
+            os.makedirs(os.path.dirname(p), exist_ok=True)
+            with open(p, 'r+b' if os.path.exists(p) else 'w+b') as f:
+                # entries beyond the end of the headers file are stale,
+                # missing ones are filled lazily by get_hash
+                if os.fstat(f.fileno()).st_size != length:
+                    f.truncate(length)
+                self._index_mmap = mmap.mmap(f.fileno(), length)
+        return self._index_mmap
+
+    def _read_hash_from_index(self, height: int) -> Optional[str]:
+        index = self._get_index_mmap()
+        if index is None:
+            return None
+        offset = (height - self.forkpoint) * HASH_SIZE
+        h = index[offset:offset+HASH_SIZE]
+        if len(h) < HASH_SIZE or h == bytes(HASH_SIZE):
+            return None
+        return bh2u(h)
+
+    def _write_hash_to_index(self, height: int, header_hash: str) -> None:
+        index = self._get_index_mmap()
+        if index is None:
+            return
+        offset = (height - self.forkpoint) * HASH_SIZE
+        if offset + HASH_SIZE <= len(index):
+            index[offset:offset+HASH_SIZE] = bfh(header_hash)
+
+    def _invalidate_hash_index(self, offset: int, num: int, truncate: bool) -> None:
+        """Invalidate the index entries of num headers written at offset
+        of the headers file. Called before the headers are written, so that
+        a crash cannot leave stale hashes for new headers behind."""
+        p = self.index_path()
+        if not os.path.exists(p):
+            return
+        pos = offset // HEADER_SIZE * HASH_SIZE
+        with open(p, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            if pos >= size:
+                return
+            if truncate:
+                f.truncate(pos)
+            else:
+                f.seek(pos)
+                f.write(bytes(min(num * HASH_SIZE, size - pos)))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_hashes(self, offset: int, hashes: Sequence[str]) -> None:
+        p = self.index_path()
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, 'r+b' if os.path.exists(p) else 'w+b') as f:
+            f.seek(offset // HEADER_SIZE * HASH_SIZE)
+            f.write(b''.join(bfh(h) for h in hashes))
+
     @classmethod
-    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None) -> None:
-        _hash = hash_header(header)
+    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None,
+                      *, header_hash: str = None) -> None:
+        _hash = header_hash if header_hash is not None else hash_header(header)
         if expected_header_hash and expected_header_hash != _hash:
             raise Exception("hash mismatches with expected: {} vs {}".format(expected_header_hash, _hash))
         if prev_hash != header.get('prev_block_hash'):
@@ -315,11 +521,18 @@ class Blockchain(Logger):
             return
         height = header.get('block_height')
 
-    def verify_chunk(self, index: int, data: bytes) -> None:
+    def verify_chunk(self, index: int, data: bytes,
+                     hashes: Sequence[str] = None) -> Sequence[str]:
+        """Verify chunk and return the hashes of its headers.
+        If given, hashes are the precomputed hashes of the headers in data
+        (see hash_raw_headers), only their linkage is checked here."""
         num = len(data) // HEADER_SIZE
+        if hashes is not None and len(hashes) != num:
+            raise Exception(f'expected {num} header hashes, got {len(hashes)}')
         start_height = index * CHUNK_SIZE
         prev_hash = self.get_hash(start_height - 1)
         chunk_headers = {'empty': True}
+        chunk_hashes = []
         for i in range(num):
             height = start_height + i
             try:
@@ -330,14 +543,18 @@ class Blockchain(Logger):
             height = index * CHUNK_SIZE + i
             header = deserialize_header(raw_header, height)
             target = self.get_target(height, chunk_headers)
-            self.verify_header(header, prev_hash, target, expected_header_hash)
+            header_hash = hashes[i] if hashes is not None else hash_header(header)
+            self.verify_header(header, prev_hash, target, expected_header_hash,
+                               header_hash=header_hash)
 
             chunk_headers[height] = header
             if i == 0:
                 chunk_headers['min_height'] = height
                 chunk_headers['empty'] = False
             chunk_headers['max_height'] = height
-            prev_hash = hash_header(header)
+            prev_hash = header_hash
+            chunk_hashes.append(header_hash)
+        return chunk_hashes
 
     @with_lock
     def path(self):
@@ -353,13 +570,13 @@ class Blockchain(Logger):
         return os.path.join(d, filename)
 
     @with_lock
-    def save_chunk(self, index: int, chunk: bytes):
+    def save_chunk(self, index: int, chunk: bytes, hashes: Sequence[str] = None):
         assert index >= 0, index
         chunk_within_checkpoint_region = index < len(self.checkpoints)
         # chunks in checkpoint region are the responsibility of the 'main chain'
         if chunk_within_checkpoint_region and self.parent is not None:
             main_chain = get_best_chain()
-            main_chain.save_chunk(index, chunk)
+            main_chain.save_chunk(index, chunk, hashes)
             return
 
         delta_height = (index * CHUNK_SIZE - self.forkpoint)
@@ -368,9 +585,11 @@ class Blockchain(Logger):
         # (the part before is the responsibility of the parent)
         if delta_bytes < 0:
             chunk = chunk[-delta_bytes:]
+            if hashes is not None:
+                hashes = hashes[-delta_height:]
             delta_bytes = 0
         truncate = not chunk_within_checkpoint_region
-        self.write(chunk, delta_bytes, truncate)
+        self.write(chunk, delta_bytes, truncate, hashes=hashes)
         self.swap_with_parent()
 
     def swap_with_parent(self) -> None:
@@ -410,6 +629,7 @@ class Blockchain(Logger):
         # parent's new name will be something new (not child's old name)
         self.assert_headers_file_available(self.path())
         child_old_name = self.path()
+        child_old_index = self.index_path()
         with open(self.path(), 'rb') as f:
             my_data = f.read()
         self.assert_headers_file_available(parent.path())
@@ -426,7 +646,13 @@ class Blockchain(Logger):
         self._forkpoint_hash, parent._forkpoint_hash = parent._forkpoint_hash, hash_raw_header(bh2u(parent_data[:HEADER_SIZE]))
         self._prev_hash, parent._prev_hash = parent._prev_hash, self._prev_hash
         # parent's new name
+        self.close_mmap()
+        parent.close_mmap()
         os.replace(child_old_name, parent.path())
+        if os.path.exists(child_old_index):
+            os.replace(child_old_index, parent.index_path())
+        else:
+            parent.delete_hash_index()
         self.update_size()
         parent.update_size()
         # update pointers
@@ -448,9 +674,18 @@ class Blockchain(Logger):
             raise FileNotFoundError('Cannot find headers file but headers_dir is there. Should be at {}'.format(path))
 
     @with_lock
-    def write(self, data: bytes, offset: int, truncate: bool=True) -> None:
+    def write(self, data: bytes, offset: int, truncate: bool=True,
+              *, hashes: Sequence[str] = None) -> None:
+        """Write raw headers at offset. If given, hashes are the header
+        hashes of data and are recorded in the hash index."""
         filename = self.path()
         self.assert_headers_file_available(filename)
+        num = len(data) // HEADER_SIZE
+        assert hashes is None or len(hashes) == num, (len(hashes), num)
+        # the mappings must not outlive a truncation of the files
+        self.close_mmap()
+        self._invalidate_header_cache_from(self.forkpoint + offset // HEADER_SIZE)
+        self._invalidate_hash_index(offset, num, truncate)
         with open(filename, 'rb+') as f:
             if truncate and offset != self._size * HEADER_SIZE:
                 f.seek(offset)
@@ -459,7 +694,9 @@ class Blockchain(Logger):
             f.write(data)
             f.flush()
             os.fsync(f.fileno())
-        self.update_size()
+        if hashes:
+            self._write_hashes(offset, hashes)
+        self._update_size()
 
     @with_lock
     def save_header(self, header: dict) -> None:
@@ -468,7 +705,7 @@ class Blockchain(Logger):
         # headers are only _appended_ to the end:
         assert delta == self.size(), (delta, self.size())
         assert len(data) == HEADER_SIZE
-        self.write(data, delta*HEADER_SIZE)
+        self.write(data, delta*HEADER_SIZE, hashes=[hash_header(header)])
         self.swap_with_parent()
 
     @with_lock
@@ -479,17 +716,19 @@ class Blockchain(Logger):
             return self.parent.read_header(height)
         if height > self.height():
             return
+        header = self._header_cache.get(height)
+        if header is not None:
+            return dict(header)
         delta = height - self.forkpoint
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            if len(h) < HEADER_SIZE:
-                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
+        offset = delta * HEADER_SIZE
+        h = self._get_mmap()[offset:offset+HEADER_SIZE]
+        if len(h) < HEADER_SIZE:
+            raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
         if h == bytes([0])*HEADER_SIZE:
             return None
-        return deserialize_header(h, height)
+        header = deserialize_header(h, height)
+        self._header_cache[height] = header
+        return dict(header)
 
     def header_at_tip(self) -> Optional[dict]:
         """Return latest header."""
@@ -524,11 +763,23 @@ class Blockchain(Logger):
             index = height // CHUNK_SIZE
             h, t, extra_headers = self.checkpoints[index]
             return h
-        else:
-            header = self.read_header(height)
-            if header is None:
+        elif height < self.forkpoint:
+            return self.parent.get_hash(height)
+        with self.lock:
+            if height > self.height():
                 raise MissingHeader(height)
-            return hash_header(header)
+            header_hash = self._hash_cache.get(height)
+            if header_hash is not None:
+                return header_hash
+            header_hash = self._read_hash_from_index(height)
+            if header_hash is None:
+                header = self.read_header(height)
+                if header is None:
+                    raise MissingHeader(height)
+                header_hash = hash_header(header)
+                self._write_hash_to_index(height, header_hash)
+            self._hash_cache[height] = header_hash
+            return header_hash
 
     def get_target(self, height: int, chunk_headers: Optional[dict]=None) -> int:
         if chunk_headers is None:
@@ -615,12 +866,12 @@ class Blockchain(Logger):
             return False
         return True
 
-    def connect_chunk(self, idx: int, hexdata: str) -> bool:
+    def connect_chunk(self, idx: int, hexdata: str, *, hashes: Sequence[str] = None) -> bool:
         assert idx >= 0, idx
         try:
             data = bfh(hexdata)
-            self.verify_chunk(idx, data)
-            self.save_chunk(idx, data)
+            hashes = self.verify_chunk(idx, data, hashes)
+            self.save_chunk(idx, data, hashes)
             return True
         except BaseException as e:
             self.logger.info(f'verify_chunk idx {idx} failed: {repr(e)}')
@@ -425,6 +425,21 @@ class Commands:
         address = bitcoin.hash160_to_p2sh(hash_160(bfh(redeem_script)))
         return {'address':address, 'redeemScript':redeem_script}
 
+    @command('w')
+    async def convert_tx_store(self, backend, wallet: Abstract_Wallet = None):
+        """Move wallet transactions and history to sqlite database, or back
+        to the wallet file. The sqlite database is not encrypted.
+        """
+        wallet.convert_tx_store(backend)
+        return True
+
+    @command('w')
+    async def getpsschedtrace(self, wallet: Abstract_Wallet = None):
+        """PrivateSend scheduler events and decisions counts, wait times
+        of mixing loops and trace of recent scheduling decisions.
+        """
+        return wallet.psman.sched.as_dict()
+
     @command('w')
     async def freeze(self, address: str, wallet: Abstract_Wallet = None):
         """Freeze address. Freeze the funds at one of your wallet\'s addresses"""
@@ -520,6 +535,13 @@ class Commands:
         """Return the list of known servers (candidates for connecting)."""
         return self.network.get_servers()
 
+    @command('n')
+    async def getpsmixstats(self):
+        """PrivateSend mixing stats of all daemon wallets: recent dsq queue,
+        masternodes connections and sessions per hour.
+        """
+        return self.network.xazab_net.get_mix_stats()
+
     @command('')
     async def version(self):
         """Return the version of Xazab Electrum."""
@@ -989,6 +1011,7 @@ param_descriptions = {
     'seed': 'Seed phrase',
     'txid': 'Transaction ID',
     'pos': 'Position',
+    'backend': 'Storage backend: sqlite or json',
     'height': 'Block height',
     'tx': 'Serialized transaction (hexadecimal)',
     'key': 'Variable name',
@@ -44,8 +44,9 @@ from .util import (json_decode, to_bytes, to_string, profiler, standardize_path,
 from .invoices import PR_PAID, PR_EXPIRED
 from .util import log_exceptions, ignore_exceptions, randrange
 from .wallet import Wallet, Abstract_Wallet
-from .storage import WalletStorage
+from .storage import WalletStorage, JOURNAL_SUFFIX
 from .wallet_db import WalletDB
+from .sqlite_db import SQLITE_TX_STORE_SUFFIX
 from .commands import known_commands, Commands
 from .simple_config import SimpleConfig
 from .exchange_rate import FxThread
@@ -458,7 +459,8 @@ class Daemon(Logger):
                 return
             storage.decrypt(password)
         # read data, pass it to db
-        db = WalletDB(storage.read(), manual_upgrades=manual_upgrades)
+        db = WalletDB(storage.read(), manual_upgrades=manual_upgrades,
+                      journal=storage.read_journal())
         if db.upgrade_done:
             storage.backup_old_version()
         if getattr(storage, 'backup_message', None):
@@ -495,6 +497,9 @@ class Daemon(Logger):
         self.stop_wallet(path)
         if os.path.exists(path):
             os.unlink(path)
+            for suffix in [JOURNAL_SUFFIX, SQLITE_TX_STORE_SUFFIX]:
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
             return True
         return False
 
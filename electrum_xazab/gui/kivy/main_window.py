@@ -723,7 +723,8 @@ class ElectrumWindow(App, Logger):
             wizard.run('new')
         else:
             assert storage.is_past_initial_decryption()
-            db = WalletDB(storage.read(), manual_upgrades=False)
+            db = WalletDB(storage.read(), manual_upgrades=False,
+                          journal=storage.read_journal())
             assert not db.requires_upgrade()
             if db.upgrade_done:
                 storage.backup_old_version()
@@ -47,7 +47,8 @@ class ElectrumGui:
             password = getpass.getpass('Password:', stream=None)
             storage.decrypt(password)
 
-        db = WalletDB(storage.read(), manual_upgrades=False)
+        db = WalletDB(storage.read(), manual_upgrades=False,
+                      journal=storage.read_journal())
         if db.upgrade_done:
             storage.backup_old_version()
         if db.check_unfinished_multisig():
@@ -29,13 +29,15 @@ import sys
 import traceback
 import asyncio
 import socket
-from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence
+from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence, Dict
 from collections import defaultdict
+from concurrent.futures.process import BrokenProcessPool
 from ipaddress import IPv4Network, IPv6Network, ip_address, IPv6Address, IPv4Address
 import itertools
 import logging
 import hashlib
 import functools
+import time
 
 import aiorpcx
 from aiorpcx import TaskGroup
@@ -76,6 +78,13 @@ PREFERRED_NETWORK_PROTOCOL = 's'
 assert PREFERRED_NETWORK_PROTOCOL in _KNOWN_NETWORK_PROTOCOLS
 
 
+class HeaderSyncProgress(NamedTuple):
+    height: int  # last connected header
+    target: int
+    headers_per_sec: float
+    servers: int
+
+
 class NetworkTimeout:
     # seconds
     class Generic:
@@ -183,6 +192,51 @@ class NotificationSession(RPCSession):
             self.maybe_log(f"--> {response} (id: {msg_id})")
             return response
 
+    async def send_batch_requests(self, requests: Sequence[Tuple[str, List]],
+                                  *, timeout=None) -> List[Any]:
+        """Send requests as a single JSON-RPC batch. Returns results in
+        the order of requests; failed requests have an RPCError in place
+        of their result.
+        """
+        msg_id = next(self._msg_counter)
+        self.maybe_log(f"<-- batch of {len(requests)}: {requests} (id: {msg_id})")
+        async def send():
+            async with self.send_batch() as batch:
+                for method, params in requests:
+                    batch.add_request(method, params)
+            return list(batch.results)
+        try:
+            results = await asyncio.wait_for(send(), timeout)
+        except (TaskTimeout, asyncio.TimeoutError) as e:
+            raise RequestTimedOut(f'batch request timed out (id: {msg_id})') from e
+        self.maybe_log(f"--> {results} (id: {msg_id})")
+        return results
+
+    async def subscribe_batch(self, method: str, params_list: Sequence[List],
+                              queue: asyncio.Queue) -> List[Optional[Exception]]:
+        """Like subscribe, for several params lists sent in one batch.
+        Returns None for successful subscriptions, or the RPCError.
+        """
+        keys = [self.get_hashable_key_for_rpc_call(method, params)
+                for params in params_list]
+        to_request = [(method, params) for params, key in zip(params_list, keys)
+                      if key not in self.cache]
+        results = iter(await self.send_batch_requests(to_request) if to_request else ())
+        errors = []
+        for params, key in zip(params_list, keys):
+            if key in self.cache:
+                result = self.cache[key]
+            else:
+                result = next(results)
+                if isinstance(result, Exception):
+                    errors.append(result)
+                    continue
+                self.cache[key] = result
+            self.subscriptions[key].append(queue)
+            errors.append(None)
+            await queue.put(params + [result])
+        return errors
+
     def set_default_timeout(self, timeout):
         self.sent_request_timeout = timeout
         self.max_send_delay = timeout
@@ -372,6 +426,7 @@ class Interface(Logger):
         # Failing verification will get the interface closed.
         self.tip_header = None
         self.tip = 0
+        self.header_sync_progress = None  # type: Optional[HeaderSyncProgress]
 
         self.fee_estimates_eta = {}
 
@@ -598,7 +653,15 @@ class Interface(Logger):
         index = height // 2016
         if can_return_early and index in self._requested_chunks:
             return
-        self.logger.info(f"requesting chunk from height {height}")
+        hexdata, count = await self._fetch_chunk(index, tip)
+        conn = await self._connect_fetched_chunk(index, hexdata)
+        if not conn:
+            return conn, 0
+        return conn, count
+
+    async def _fetch_chunk(self, index: int, tip=None) -> Tuple[str, int]:
+        """Download chunk and check the response, without connecting it."""
+        self.logger.info(f"requesting chunk from height {index * 2016}")
         size = 2016
         if tip is not None:
             size = min(size, tip - index * 2016 + 1)
@@ -621,10 +684,97 @@ class Interface(Logger):
             raise RequestCorrupted(f"server uses too low 'max' count for block.headers: {res['max']} < 2016")
         if res['count'] != size:
             raise RequestCorrupted(f"expected {size} headers but only got {res['count']}")
-        conn = self.blockchain.connect_chunk(index, res['hex'])
-        if not conn:
-            return conn, 0
-        return conn, res['count']
+        return res['hex'], res['count']
+
+    async def _connect_fetched_chunk(self, index: int, hexdata: str) -> bool:
+        hashes = None
+        executor = blockchain.get_chunk_hash_executor(self.network.config)
+        if executor is not None:
+            # X11 hashing is CPU bound, spread it over worker processes
+            # and only check the linkage of the headers in connect_chunk
+            try:
+                hashes = await blockchain.hash_raw_headers_async(
+                    bfh(hexdata), executor, self.network.config.get_header_verify_workers())
+            except BrokenProcessPool as e:
+                self.logger.warning(f'header hashing pool failed, hashing in network thread: {repr(e)}')
+                blockchain.shutdown_chunk_hash_executor()
+        return self.blockchain.connect_chunk(index, hexdata, hashes=hashes)
+
+    def _get_chunk_interfaces(self, tip: int) -> List['Interface']:
+        """Interfaces to spread chunk requests over: this one and the ready
+        ones following the same chain up to tip. Chunks from other servers
+        are verified when connected, like our own."""
+        if not self.network.config.get('header_download_spread', False):
+            return [self]
+        return [self] + self.get_peer_interfaces(min_tip=tip)
+
+    def get_peer_interfaces(self, *, min_tip: int = 0) -> List['Interface']:
+        """Other ready interfaces following the same blockchain,
+        with tip at least min_tip."""
+        return [iface for iface in list(self.network.interfaces.values())
+                if (iface is not self and iface.ready.done() and not iface.ready.cancelled()
+                    and iface.blockchain is self.blockchain and iface.tip >= min_tip)]
+
+    async def _sync_chunks_pipelined(self, height: int, next_height: int) -> Tuple[bool, int]:
+        """Download chunks from height to next_height keeping several
+        requests in flight, connect them in order as they arrive.
+        Returns whether the chunks could be connected, and the height
+        following the last connected header.
+        """
+        window = self.network.config.get_header_download_pipeline()
+        ifaces = self._get_chunk_interfaces(next_height)
+        index = height // 2016
+        last_index = next_height // 2016
+        next_request = index
+        tasks = {}  # type: Dict[int, Tuple[Interface, asyncio.Future]]
+        start_time = time.monotonic()
+        num_headers = 0
+        try:
+            while index <= last_index:
+                while next_request <= last_index and next_request - index < window:
+                    iface = ifaces[next_request % len(ifaces)]
+                    task = asyncio.ensure_future(iface._fetch_chunk(next_request, next_height))
+                    tasks[next_request] = (iface, task)
+                    next_request += 1
+                iface, task = tasks.pop(index)
+                if iface is self:
+                    hexdata, count = await task
+                else:
+                    # other server disconnecting cancels its requests, that
+                    # does not mean we got cancelled: any failure of the
+                    # request is handled by fetching the chunk from ours
+                    await asyncio.wait([task])
+                    if task.cancelled() or task.exception():
+                        self.logger.info(f'chunk {index} from {iface} failed:'
+                                         f' {repr(None if task.cancelled() else task.exception())}')
+                        hexdata, count = await self._fetch_chunk(index, next_height)
+                        iface = self
+                    else:
+                        hexdata, count = task.result()
+                could_connect = await self._connect_fetched_chunk(index, hexdata)
+                if not could_connect and iface is not self:
+                    # other server might follow another chain, retry with ours
+                    self.logger.info(f'chunk {index} from {iface} does not connect')
+                    hexdata, count = await self._fetch_chunk(index, next_height)
+                    could_connect = await self._connect_fetched_chunk(index, hexdata)
+                if not could_connect:
+                    return False, height
+                height = index * 2016 + count
+                num_headers += count
+                elapsed = time.monotonic() - start_time
+                self.header_sync_progress = HeaderSyncProgress(
+                    height=height - 1, target=next_height,
+                    headers_per_sec=num_headers / elapsed if elapsed else 0,
+                    servers=len(ifaces))
+                util.trigger_callback('network_updated')
+                index += 1
+        finally:
+            for iface, task in tasks.values():
+                task.cancel()
+            self.header_sync_progress = None
+        self.logger.info(f'downloaded {num_headers} headers in {time.monotonic() - start_time:.1f}s'
+                         f' from {len(ifaces)} servers')
+        return True, height
 
     def is_main_server(self) -> bool:
         return (self.network.interface == self or
@@ -740,7 +890,19 @@ class Interface(Logger):
         last = None
         while last is None or height <= next_height:
             prev_last, prev_height = last, height
-            if next_height > height + 10:
+            # pipeline only when more than one full chunk is ahead,
+            # short tip updates crossing a chunk boundary use step
+            if (next_height - height > 2016
+                    and self.network.config.get_header_download_pipeline() > 1):
+                could_connect, height = await self._sync_chunks_pipelined(height, next_height)
+                if not could_connect:
+                    if height <= constants.net.max_checkpoint():
+                        raise GracefulDisconnect('server chain conflicts with checkpoints or genesis')
+                    last, height = await self.step(height)
+                    continue
+                assert height <= next_height+1, (height, self.tip)
+                last = 'catchup'
+            elif next_height > height + 10:
                 could_connect, num_headers = await self.request_chunk(height, next_height)
                 if not could_connect:
                     if height <= constants.net.max_checkpoint():
@@ -916,7 +1078,24 @@ class Interface(Logger):
             raise Exception(f"{repr(tx_height)} is not a block height")
         # do request
         res = await self.session.send_request('blockchain.transaction.get_merkle', [tx_hash, tx_height])
-        # check response
+        return self._check_merkle(res)
+
+    async def get_merkles_for_transactions(self, txs: Sequence[Tuple[str, int]]) -> List[Union[dict, Exception]]:
+        """Get merkle branches of (tx_hash, tx_height) pairs in one batch
+        request. Txs not found by the server have the RPCError in place
+        of the branch.
+        """
+        for tx_hash, tx_height in txs:
+            if not is_hash256_str(tx_hash):
+                raise Exception(f"{repr(tx_hash)} is not a txid")
+            if not is_non_negative_integer(tx_height):
+                raise Exception(f"{repr(tx_height)} is not a block height")
+        res = await self.session.send_batch_requests(
+            [('blockchain.transaction.get_merkle', [tx_hash, tx_height]) for tx_hash, tx_height in txs])
+        return [merkle if isinstance(merkle, Exception) else self._check_merkle(merkle)
+                for merkle in res]
+
+    def _check_merkle(self, res) -> dict:
         block_height = assert_dict_contains_field(res, field_name='block_height')
         merkle = assert_dict_contains_field(res, field_name='merkle')
         pos = assert_dict_contains_field(res, field_name='pos')
@@ -932,7 +1111,21 @@ class Interface(Logger):
         if not is_hash256_str(tx_hash):
             raise Exception(f"{repr(tx_hash)} is not a txid")
         raw = await self.session.send_request('blockchain.transaction.get', [tx_hash], timeout=timeout)
-        # validate response
+        return self._check_raw_tx(tx_hash, raw)
+
+    async def get_transactions(self, tx_hashes: Sequence[str]) -> List[Union[str, Exception]]:
+        """Get raw txs in one batch request. Txs the server could not
+        find have the RPCError in place of the raw tx.
+        """
+        for tx_hash in tx_hashes:
+            if not is_hash256_str(tx_hash):
+                raise Exception(f"{repr(tx_hash)} is not a txid")
+        res = await self.session.send_batch_requests(
+            [('blockchain.transaction.get', [tx_hash]) for tx_hash in tx_hashes])
+        return [raw if isinstance(raw, Exception) else self._check_raw_tx(tx_hash, raw)
+                for tx_hash, raw in zip(tx_hashes, res)]
+
+    def _check_raw_tx(self, tx_hash: str, raw) -> str:
         if not is_hex_str(raw):
             raise RequestCorrupted(f"received garbage (non-hex) as tx data (txid {tx_hash}): {raw!r}")
         tx = Transaction(raw)
@@ -949,7 +1142,21 @@ class Interface(Logger):
             raise Exception(f"{repr(sh)} is not a scripthash")
         # do request
         res = await self.session.send_request('blockchain.scripthash.get_history', [sh])
-        # check response
+        return self._check_history(sh, res)
+
+    async def get_history_for_scripthashes(self, shs: Sequence[str]) -> List[Union[List[dict], Exception]]:
+        """Get histories in one batch request. Failed requests have the
+        RPCError in place of the history.
+        """
+        for sh in shs:
+            if not is_hash256_str(sh):
+                raise Exception(f"{repr(sh)} is not a scripthash")
+        res = await self.session.send_batch_requests(
+            [('blockchain.scripthash.get_history', [sh]) for sh in shs])
+        return [hist if isinstance(hist, Exception) else self._check_history(sh, hist)
+                for sh, hist in zip(shs, res)]
+
+    def _check_history(self, sh: str, res) -> List[dict]:
         assert_list_or_tuple(res)
         prev_height = 1
         for tx_item in res:
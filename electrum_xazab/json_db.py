@@ -48,14 +48,18 @@ def locked(func):
 class StoredObject:
 
     db = None
+    _db_path = None
 
     def __setattr__(self, key, value):
         if self.db:
             self.db.set_modified(True)
+            if self._db_path is not None:
+                self.db.mark_dirty(self._db_path)
         object.__setattr__(self, key, value)
 
-    def set_db(self, db):
+    def set_db(self, db, path=None):
         self.db = db
+        object.__setattr__(self, '_db_path', path)
 
     def to_json(self):
         d = dict(vars(self))
@@ -111,11 +115,12 @@ class StoredDict(dict):
                 v = self.db._convert_value(self.path, key, v)
         # set parent of StoredObject
         if isinstance(v, StoredObject):
-            v.set_db(self.db)
+            v.set_db(self.db, self.path + [key])
         # set item
         dict.__setitem__(self, key, v)
         if self.db:
             self.db.set_modified(True)
+            self.db.mark_dirty(self.path + [key])
 
     @locked
     def __delitem__(self, key):
@@ -123,6 +128,7 @@ class StoredDict(dict):
         dict.__delitem__(self, key)
         if self.db:
             self.db.set_modified(True)
+            self.db.mark_dirty(self.path + [key])
 
     @locked
     def __getitem__(self, key):
@@ -143,6 +149,7 @@ class StoredDict(dict):
             r = dict.pop(self, key, v)
         if self.db:
             self.db.set_modified(True)
+            self.db.mark_dirty(self.path + [key])
         return r
 
     @locked
@@ -150,7 +157,60 @@ class StoredDict(dict):
         key = self.convert_key(key)
         return dict.get(self, key, default)
 
+    @locked
+    def clear(self):
+        dict.clear(self)
+        if self.db:
+            self.db.set_modified(True)
+            self.db.mark_dirty(self.path)
 
+    @locked
+    def update(self, *args, **kwargs):
+        # note: like dict.update, values are stored as is (not converted)
+        dict.update(self, *args, **kwargs)
+        if self.db:
+            self.db.set_modified(True)
+            self.db.mark_dirty(self.path)
+
+
+def apply_journal_record(data: dict, ops: list) -> None:
+    """Applies a journal record (list of ops, see JsonDB.pop_journal_ops)
+    to the plain json 'data' dict in place.
+
+    All ops overwrite the value at their path, so replaying a record
+    which is already contained in 'data' is a no-op.
+    """
+    for op in ops:
+        name, path = op['op'], op['path']
+        if not path:
+            if name == 'replace':
+                data.clear()
+                data.update(op['value'])
+            continue
+        parent = data
+        for k in path[:-1]:
+            child = parent.get(k)
+            if not isinstance(child, dict):
+                if name == 'remove':
+                    parent = None
+                    break
+                child = parent[k] = {}
+            parent = child
+        if parent is None:
+            continue
+        key = path[-1]
+        if name == 'replace':
+            parent[key] = op['value']
+        elif name == 'remove':
+            parent.pop(key, None)
+        elif name == 'extend':
+            lst = parent.get(key)
+            if not isinstance(lst, list):
+                lst = parent[key] = []
+            start = op['start']
+            lst[start:start + len(op['value'])] = op['value']
+        else:
+            raise Exception(f"unknown journal op: {name!r}")
 
 
 class JsonDB(Logger):
@@ -160,6 +220,11 @@ class JsonDB(Logger):
         self.lock = threading.RLock()
         self.data = data
         self._modified = False
+        # paths changed since the last write, used to append
+        # only the changes to the storage journal
+        self._track_changes = True
+        self._dirty_paths = set()
+        self._list_appends = {}  # path -> start index of appended items
 
     def set_modified(self, b):
         with self.lock:
@@ -168,6 +233,61 @@ class JsonDB(Logger):
     def modified(self):
         return self._modified
 
+    def mark_dirty(self, path):
+        if self._track_changes:
+            with self.lock:
+                self._dirty_paths.add(tuple(path))
+
+    def mark_list_append(self, path, start: int):
+        """Called before items get appended to the list stored at path"""
+        if self._track_changes:
+            with self.lock:
+                self._list_appends.setdefault(tuple(path), start)
+
+    @locked
+    def clear_journal_ops(self) -> None:
+        self._dirty_paths.clear()
+        self._list_appends.clear()
+
+    def _get_value_at_path(self, path):
+        v = self.data
+        for k in path:
+            if not isinstance(v, dict) or k not in v:
+                raise KeyError(path)
+            v = v[k]
+        return v
+
+    @locked
+    def pop_journal_ops(self) -> list:
+        """Returns ops describing changes since the last write
+        and clears tracked changes.
+
+        'replace'/'remove' ops store the current value at the changed path,
+        'extend' ops store items appended to a list since the last write.
+        """
+        ops = []
+        written = set()
+        for path in sorted(self._dirty_paths, key=len):
+            if any(path[:i] in written for i in range(len(path))):
+                continue  # already covered by the parent value
+            written.add(path)
+            try:
+                ops.append({'op': 'replace', 'path': list(path),
+                            'value': self._get_value_at_path(path)})
+            except KeyError:
+                ops.append({'op': 'remove', 'path': list(path)})
+        for path, start in self._list_appends.items():
+            if any(path[:i] in written for i in range(len(path) + 1)):
+                continue
+            try:
+                lst = self._get_value_at_path(path)
+            except KeyError:
+                continue
+            ops.append({'op': 'extend', 'path': list(path),
+                        'start': start, 'value': lst[start:]})
+        self.clear_journal_ops()
+        return ops
+
     @locked
     def get(self, key, default=None):
         v = self.data.get(key)
@@ -183,6 +303,8 @@ class JsonDB(Logger):
         except:
             self.logger.info(f"json error: cannot save {repr(key)} ({repr(value)})")
             return False
+        # value can be mutated in place before put, so always record it
+        self.mark_dirty([key])
         if value is not None:
             if self.data.get(key) != value:
                 self.data[key] = copy.deepcopy(value)
@@ -27,8 +27,8 @@
 from unicodedata import normalize
 import hashlib
 import re
-from typing import Tuple, TYPE_CHECKING, Union, Sequence, Optional, Dict, List, NamedTuple
-from functools import lru_cache
+import threading
+from typing import Tuple, TYPE_CHECKING, Union, Sequence, Optional, Dict, List, NamedTuple, Iterable
 from abc import ABC, abstractmethod
 
 from . import bitcoin, ecc, constants, bip32
@@ -41,7 +41,7 @@ from .ecc import string_to_number
 from .crypto import (pw_decode, pw_encode, sha256, sha256d, PW_HASH_VERSION_LATEST,
                      SUPPORTED_PW_HASH_VERSIONS, UnsupportedPasswordHashVersion, hash_160)
 from .util import (InvalidPassword, WalletFileException,
-                   BitcoinException, bh2u, bfh, inv_dict, is_hex_str)
+                   BitcoinException, bh2u, bfh, inv_dict, is_hex_str, LRUCache)
 from .mnemonic import Mnemonic, Wordlist, seed_type, is_seed
 from .plugin import run_hook
 from .logging import Logger
@@ -195,8 +195,8 @@ class Software_KeyStore(KeyStore):
         self.check_password(password)
         # Add private keys
         keypairs = self._get_tx_derivations(tx)
-        for k, v in keypairs.items():
-            keypairs[k] = self.get_private_key(v, password)
+        privkeys = self.get_private_keys(list(keypairs.values()), password)
+        keypairs = dict(zip(keypairs, privkeys))
         # Sign
         if keypairs:
             tx.sign(keypairs)
@@ -214,6 +214,13 @@ class Software_KeyStore(KeyStore):
         """Returns (privkey, is_compressed)"""
         pass
 
+    def get_private_keys(self, sequences: Sequence['AddressIndexGeneric'],
+                         password) -> List[Tuple[bytes, bool]]:
+        """Returns (privkey, is_compressed) for each of sequences.
+        Subclasses decrypt and parse their secret once for all of them.
+        """
+        return [self.get_private_key(sequence, password) for sequence in sequences]
+
 
 class Imported_KeyStore(Software_KeyStore):
     # keystore for imported private keys
@@ -380,6 +387,12 @@ class MasterPublicKeyMixin(ABC):
         """
         pass
 
+    def derive_pubkeys(self, for_change: int, indices: Iterable[int]) -> List[bytes]:
+        """Returns pubkeys at (for_change, n) for n in indices.
+        May raise CannotDerivePubkey.
+        """
+        return [self.derive_pubkey(for_change, n) for n in indices]
+
     def get_pubkey_derivation(
             self,
             pubkey: bytes,
@@ -437,13 +450,19 @@ class MasterPublicKeyMixin(ABC):
         return der_suffix if only_der_suffix else full_path
 
 
+# max number of derived pubkeys kept by each keystore
+DERIVED_PUBKEYS_CACHE_SIZE = 20000
+
+
 class Xpub(MasterPublicKeyMixin):
 
     def __init__(self, *, derivation_prefix: str = None, root_fingerprint: str = None):
         self.xpub = None
-        self.xpub_receive = None
-        self.xpub_change = None
         self._xpub_bip32_node = None  # type: Optional[BIP32Node]
+        # parsed nodes of the receiving/change branches, by branch index
+        self._branch_nodes = {}  # type: Dict[int, BIP32Node]
+        self._derived_pubkeys = LRUCache(maxsize=DERIVED_PUBKEYS_CACHE_SIZE)  # type: LRUCache[Tuple[int, int], bytes]
+        self._derived_pubkeys_lock = threading.Lock()
 
         # "key origin" info (subclass should persist these):
         self._derivation_prefix = derivation_prefix  # type: Optional[str]
@@ -525,18 +544,40 @@ class Xpub(MasterPublicKeyMixin):
             self._derivation_prefix = derivation_prefix
         self.is_requesting_to_be_rewritten_to_wallet_file = True
 
-    @lru_cache(maxsize=None)
+    def _get_branch_node(self, for_change: int) -> BIP32Node:
+        node = self._branch_nodes.get(for_change)
+        if node is None:
+            rootnode = self.get_bip32_node_for_xpub()
+            node = rootnode.subkey_at_public_derivation((for_change,))
+            self._branch_nodes[for_change] = node
+        return node
+
+    def _reset_derived_pubkeys(self) -> None:
+        self._xpub_bip32_node = None
+        self._branch_nodes = {}
+        with self._derived_pubkeys_lock:
+            self._derived_pubkeys.clear()
+
     def derive_pubkey(self, for_change: int, n: int) -> bytes:
+        return self.derive_pubkeys(for_change, (n,))[0]
+
+    def derive_pubkeys(self, for_change: int, indices: Iterable[int]) -> List[bytes]:
         for_change = int(for_change)
-        xpub = self.xpub_change if for_change % 2 else self.xpub_receive
-        if xpub is None:
-            rootnode = self.get_bip32_node_for_xpub()
-            xpub = rootnode.subkey_at_public_derivation((for_change,)).to_xpub()
-            if for_change % 2:
-                self.xpub_change = xpub
-            else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        res = []
+        branch_node = None
+        for n in indices:
+            key = (for_change, n)
+            with self._derived_pubkeys_lock:
+                pubkey = self._derived_pubkeys.get(key)
+            if pubkey is None:
+                if branch_node is None:
+                    branch_node = self._get_branch_node(for_change)
+                node = branch_node.subkey_at_public_derivation((n,))
+                pubkey = node.eckey.get_public_key_bytes(compressed=True)
+                with self._derived_pubkeys_lock:
+                    self._derived_pubkeys[key] = pubkey
+            res.append(pubkey)
+        return res
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub: str, sequence) -> bytes:
@@ -598,6 +639,7 @@ class BIP32_KeyStore(Xpub, Deterministic_KeyStore):
     def add_xpub(self, xpub):
         assert is_xpub(xpub)
         self.xpub = xpub
+        self._reset_derived_pubkeys()
         root_fingerprint, derivation_prefix = bip32.root_fp_and_der_prefix_from_xkey(xpub)
         self.add_key_origin(derivation_prefix=derivation_prefix, root_fingerprint=root_fingerprint)
 
@@ -613,10 +655,31 @@ class BIP32_KeyStore(Xpub, Deterministic_KeyStore):
         self.add_key_origin_from_root_node(derivation_prefix=derivation, root_node=rootnode)
 
     def get_private_key(self, sequence: Sequence[int], password):
+        return self.get_private_keys([sequence], password)[0]
+
+    def get_private_branch(self, for_change: int, password) -> Tuple[bytes, bytes]:
+        """Returns (privkey, chaincode) of the receiving/change branch node,
+        to derive many keys with bip32.derive_child_keypairs"""
         xprv = self.get_master_private_key(password)
-        node = BIP32Node.from_xkey(xprv).subkey_at_private_derivation(sequence)
-        pk = node.eckey.get_secret_bytes()
-        return pk, True
+        node = BIP32Node.from_xkey(xprv).subkey_at_private_derivation((int(for_change),))
+        return node.eckey.get_secret_bytes(), node.chaincode
+
+    def get_private_keys(self, sequences: Sequence[Sequence[int]], password):
+        xprv = self.get_master_private_key(password)
+        rootnode = BIP32Node.from_xkey(xprv)
+        # private parent nodes are derived once, and only kept for this call
+        parent_nodes = {}  # type: Dict[Tuple[int, ...], BIP32Node]
+        res = []
+        for sequence in sequences:
+            sequence = tuple(sequence)
+            parent_path = sequence[:-1]
+            parent_node = parent_nodes.get(parent_path)
+            if parent_node is None:
+                parent_node = rootnode.subkey_at_private_derivation(parent_path)
+                parent_nodes[parent_path] = parent_node
+            node = parent_node.subkey_at_private_derivation(sequence[-1:])
+            res.append((node.eckey.get_secret_bytes(), True))
+        return res
 
     def get_keypair(self, sequence, password):
         k, _ = self.get_private_key(sequence, password)
@@ -642,14 +705,20 @@ class PS_BIP32_KeyStore(BIP32_KeyStore):
             d['addr_deriv_offset'] = self.addr_deriv_offset
         return d
 
-    def derive_pubkey(self, for_change, n):
+    def derive_pubkeys(self, for_change, indices):
+        derivation = self.addr_deriv_offset*2 + int(for_change)
+        return super().derive_pubkeys(derivation, indices)
+
+    def get_private_branch(self, for_change, password):
         derivation = self.addr_deriv_offset*2 + int(for_change)
-        return super().derive_pubkey(derivation, n)
+        return super().get_private_branch(derivation, password)
 
-    def get_private_key(self, sequence, password):
-        derivation = self.addr_deriv_offset*2 + int(sequence[0] % 2)
-        _sequence = [derivation, *sequence[1:]]
-        return super().get_private_key(_sequence, password)
+    def get_private_keys(self, sequences, password):
+        _sequences = []
+        for sequence in sequences:
+            derivation = self.addr_deriv_offset*2 + int(sequence[0] % 2)
+            _sequences.append([derivation, *sequence[1:]])
+        return super().get_private_keys(_sequences, password)
 
 
 class Old_KeyStore(MasterPublicKeyMixin, Deterministic_KeyStore):
@@ -660,6 +729,8 @@ class Old_KeyStore(MasterPublicKeyMixin, Deterministic_KeyStore):
         Deterministic_KeyStore.__init__(self, d)
         self.mpk = d.get('mpk')
         self._root_fingerprint = None
+        self._derived_pubkeys = LRUCache(maxsize=DERIVED_PUBKEYS_CACHE_SIZE)  # type: LRUCache[Tuple[int, int], bytes]
+        self._derived_pubkeys_lock = threading.Lock()
 
     def get_hex_seed(self, password):
         return pw_decode(self.seed, password, version=self.pw_hash_version).encode('utf8')
@@ -676,6 +747,8 @@ class Old_KeyStore(MasterPublicKeyMixin, Deterministic_KeyStore):
 
     def add_master_public_key(self, mpk):
         self.mpk = mpk
+        with self._derived_pubkeys_lock:
+            self._derived_pubkeys.clear()
 
     def format_seed(self, seed):
         from . import old_mnemonic, mnemonic
@@ -722,12 +795,18 @@ class Old_KeyStore(MasterPublicKeyMixin, Deterministic_KeyStore):
         public_key = master_public_key + z*ecc.GENERATOR
         return public_key.get_public_key_bytes(compressed=False)
 
-    @lru_cache(maxsize=None)
     def derive_pubkey(self, for_change, n) -> bytes:
         for_change = int(for_change)
         if for_change not in (0, 1):
             raise CannotDerivePubkey("forbidden path")
-        return self.get_pubkey_from_mpk(self.mpk, for_change, n)
+        key = (for_change, n)
+        with self._derived_pubkeys_lock:
+            pubkey = self._derived_pubkeys.get(key)
+        if pubkey is None:
+            pubkey = self.get_pubkey_from_mpk(self.mpk, for_change, n)
+            with self._derived_pubkeys_lock:
+                self._derived_pubkeys[key] = pubkey
+        return pubkey
 
     def _get_private_key_from_stretched_exponent(self, for_change, n, secexp):
         secexp = (secexp + self.get_sequence(self.mpk, for_change, n)) % ecc.CURVE_ORDER
@@ -735,12 +814,14 @@ class Old_KeyStore(MasterPublicKeyMixin, Deterministic_KeyStore):
         return pk
 
     def get_private_key(self, sequence: Sequence[int], password):
+        return self.get_private_keys([sequence], password)[0]
+
+    def get_private_keys(self, sequences: Sequence[Sequence[int]], password):
         seed = self.get_hex_seed(password)
         secexp = self.stretch_key(seed)
         self._check_seed(seed, secexp=secexp)
-        for_change, n = sequence
-        pk = self._get_private_key_from_stretched_exponent(for_change, n, secexp)
-        return pk, False
+        return [(self._get_private_key_from_stretched_exponent(for_change, n, secexp), False)
+                for for_change, n in sequences]
 
     def _check_seed(self, seed, *, secexp=None):
         if secexp is None:
@@ -32,7 +32,7 @@ import socket
 import json
 import sys
 import asyncio
-from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple, TYPE_CHECKING, Iterable, Set, Any
+from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple, TYPE_CHECKING, Iterable, Set, Any, Union
 import traceback
 import concurrent
 from concurrent import futures
@@ -57,9 +57,10 @@ from .transaction import Transaction
 from .constants import CHUNK_SIZE
 from .blockchain import Blockchain, HEADER_SIZE
 from .xazab_net import XazabNet
+from .sqlite_db import SharedTxCache, SHARED_TX_CACHE_FILE
 from .interface import (Interface, PREFERRED_NETWORK_PROTOCOL,
                         RequestTimedOut, NetworkTimeout, BUCKET_NAME_OF_ONION_SERVERS,
-                        NetworkException, RequestCorrupted, ServerAddr)
+                        NetworkException, RequestCorrupted, ServerAddr, HeaderSyncProgress)
 from .version import ELECTRUM_VERSION, PROTOCOL_VERSION
 from .simple_config import SimpleConfig
 from .i18n import _
@@ -323,6 +324,13 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
             self.default_server = pick_random_server(allowed_protocols=self._allowed_protocols)
         assert isinstance(self.default_server, ServerAddr), f"invalid type for default_server: {self.default_server!r}"
 
+        # raw txs shared by the wallets of the daemon
+        self.tx_cache = None  # type: Optional[SharedTxCache]
+        tx_cache_size = self.config.get_tx_cache_size()
+        if tx_cache_size:
+            self.tx_cache = SharedTxCache(os.path.join(self.config.path, SHARED_TX_CACHE_FILE),
+                                          tx_cache_size)
+
         self.taskgroup = None
 
         # locks
@@ -884,6 +892,11 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
     async def get_merkle_for_transaction(self, tx_hash: str, tx_height: int) -> dict:
         return await self.interface.get_merkle_for_transaction(tx_hash=tx_hash, tx_height=tx_height)
 
+    @best_effort_reliable
+    @catch_server_exceptions
+    async def get_merkles_for_transactions(self, txs: Sequence[Tuple[str, int]]) -> List[Union[dict, Exception]]:
+        return await self.interface.get_merkles_for_transactions(txs)
+
     @best_effort_reliable
     async def broadcast_transaction(self, tx: 'Transaction', *, timeout=None) -> None:
         if timeout is None:
@@ -1330,6 +1343,12 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         """
         return self.blockchain().height()
 
+    def get_header_sync_progress(self) -> Optional['HeaderSyncProgress']:
+        """Progress of header chunks download by the main interface,
+        None if it is not catching up with chunks."""
+        interface = self.interface
+        return interface.header_sync_progress if interface else None
+
     def export_checkpoints(self, path):
         """Run manually to generate blockchain checkpoints.
         Kept for console use only.
@@ -1395,7 +1414,11 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self.interfaces = {}
         self._connecting_ifaces.clear()
         self._closing_ifaces.clear()
-        if not full_shutdown:
+        if full_shutdown:
+            blockchain.shutdown_chunk_hash_executor()
+            if self.tx_cache:
+                self.tx_cache.commit()
+        else:
             util.trigger_callback('network_updated')
 
     async def _ensure_there_is_a_main_interface(self):
@@ -26,6 +26,7 @@
 import time
 import asyncio
 import gzip
+import hashlib
 import json
 import os
 import random
@@ -51,6 +52,7 @@ DEFAULT_MN_LIST = {'protx_height': 0, 'llmq_height': 0,
                    'quorums': {}, 'llmq_hashes': {}}   # qfcommits and hashes
 RECENT_LIST_FNAME = 'recent_protx_list.gz'
 PROTX_INFO_FNAME = 'protx_info.gz'
+RESPONSIBLE_QUORUMS_CACHE_SIZE = 1000
 
 
 class PartialMerkleTree(namedtuple('PartialMerkleTree', 'total hashes flags')):
@@ -122,6 +124,10 @@ class MNList(Logger):
         self.quorums = recent_list.get('quorums', {})
         self.llmq_hashes = recent_list.get('llmq_hashes', {})
 
+        # Index of quorums by llmqType and request_id -> quorum cache
+        self._quorums_index_lock = threading.Lock()
+        self._init_quorums_index()
+
         if protx_mns:
             self.protx_state = MNList.DIP3_ENABLED
         elif protx_height > 1:
@@ -415,16 +421,47 @@ class MNList(Logger):
         if protx_hash:
             return self.protx_mns.get(protx_hash)
 
+    def _init_quorums_index(self):
+        self._quorums_index_src = None
+        self._quorums_index = {}
+        self._responsible_quorums = util.LRUCache(RESPONSIBLE_QUORUMS_CACHE_SIZE)
+
+    def _get_quorums_index(self):
+        '''Return quorums grouped by llmqType as (sha256 state of sorthash
+        prefix, quorum) lists, rebuilt when quorums set changes'''
+        quorums = self.quorums
+        if quorums is self._quorums_index_src:
+            return self._quorums_index
+        # on_mnlistdiff sets a new dict even if the quorums set is the same,
+        # the same key means the same final commitment, so keep the index
+        if (self._quorums_index_src is None
+                or quorums.keys() != self._quorums_index_src.keys()):
+            index = defaultdict(list)
+            for q in quorums.values():
+                prefix = hashlib.sha256(pack('B', q.llmqType) + q.quorumHash)
+                index[q.llmqType].append((prefix, q))
+            self._quorums_index = dict(index)
+            self._responsible_quorums.clear()
+        self._quorums_index_src = quorums
+        return self._quorums_index
+
     def calc_responsible_quorum(self, llmqType, request_id):
-        res = []
-        for q in self.quorums.values():
-            if q.llmqType != llmqType:
-                continue
-            prehash = pack('B', q.llmqType) + q.quorumHash + request_id
-            sorthash = sha256d(prehash)
-            res.append((sorthash, q))
-        res = sorted(res, key=lambda x: x[0])
-        return res[0][1] if res else None
+        with self._quorums_index_lock:
+            index = self._get_quorums_index()
+            cache_key = (llmqType, request_id)
+            quorum = self._responsible_quorums.get(cache_key)
+            if quorum is not None:
+                return quorum
+            entries = index.get(llmqType)
+            if not entries:
+                return None
+            def sorthash(entry):
+                h = entry[0].copy()  # sha256 state after the prefix
+                h.update(request_id)
+                return hashlib.sha256(h.digest()).digest()
+            prefix, quorum = min(entries, key=sorthash)
+            self._responsible_quorums[cache_key] = quorum
+            return quorum
 
     def calc_merkle_root(self, hashes):
         hashes_len = len(hashes)
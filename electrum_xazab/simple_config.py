@@ -309,6 +309,54 @@ class SimpleConfig(Logger):
     def get_session_timeout(self):
         return self.get('session_timeout', 300)
 
+    def get_header_verify_workers(self) -> int:
+        """Number of processes hashing downloaded header chunks.
+        0 or 1 means chunks are hashed in the network thread."""
+        try:
+            return max(0, int(self.get('header_verify_workers', 0)))
+        except (TypeError, ValueError):
+            return 0
+
+    def get_tx_cache_size(self) -> int:
+        """Max size in bytes of the raw tx cache shared by wallets,
+        from 'tx_cache_size_mb'. 0 disables the cache."""
+        try:
+            return max(0, int(float(self.get('tx_cache_size_mb', 64)) * 1024 * 1024))
+        except (TypeError, ValueError):
+            return 64 * 1024 * 1024
+
+    def get_header_download_pipeline(self) -> int:
+        """Number of header chunk requests kept in flight during catch-up.
+        1 means chunks are requested one at a time."""
+        try:
+            return max(1, int(self.get('header_download_pipeline', 4)))
+        except (TypeError, ValueError):
+            return 4
+
+    def get_synchronizer_batch_size(self) -> int:
+        """Max number of subscriptions, history or tx requests the
+        synchronizer sends in one JSON-RPC batch. 1 disables batching."""
+        try:
+            return max(1, int(self.get('synchronizer_batch_size', 50)))
+        except (TypeError, ValueError):
+            return 50
+
+    def get_synchronizer_batch_interval(self) -> float:
+        """Seconds the synchronizer waits to fill a batch before sending it."""
+        try:
+            return max(0.0, float(self.get('synchronizer_batch_interval', 0.05)))
+        except (TypeError, ValueError):
+            return 0.05
+
+    def get_ps_keypairs_workers(self) -> int:
+        """Number of processes deriving PrivateSend keypairs cache.
+        0 or 1 means keys are derived in the caching thread."""
+        default = min(4, os.cpu_count() or 1)
+        try:
+            return max(0, int(self.get('ps_keypairs_workers', default)))
+        except (TypeError, ValueError):
+            return default
+
     def save_last_wallet(self, wallet):
         if self.get('wallet_path') is None:
             path = wallet.storage.path
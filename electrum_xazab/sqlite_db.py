@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import sqlite3
+import threading
+from typing import Dict, Optional, List, Tuple, Set
+
+from .transaction import Transaction, tx_from_any
+from .util import LRUCache
+from .logging import Logger
+
+
+SQLITE_TX_STORE_SUFFIX = '.sqlite'
+
+# keys of WalletDB.data stored in sqlite tables
+SQLITE_TX_STORE_KEYS = ['txi', 'txo', 'transactions', 'spent_outpoints',
+                        'addr_history', 'ps_ks_addr_hist',
+                        'prevouts_by_scripthash']
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS txi (
+    txid TEXT NOT NULL,
+    addr TEXT NOT NULL,
+    prevout TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (txid, addr, prevout)
+);
+CREATE TABLE IF NOT EXISTS txo (
+    txid TEXT NOT NULL,
+    addr TEXT NOT NULL,
+    n TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    is_coinbase INTEGER NOT NULL,
+    PRIMARY KEY (txid, addr, n)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    txid TEXT PRIMARY KEY,
+    raw TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS spent_outpoints (
+    prevout_hash TEXT NOT NULL,
+    prevout_n TEXT NOT NULL,
+    spending_txid TEXT NOT NULL,
+    PRIMARY KEY (prevout_hash, prevout_n)
+);
+CREATE TABLE IF NOT EXISTS addr_history (
+    addr TEXT PRIMARY KEY,
+    ps_ks INTEGER NOT NULL,
+    hist TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prevouts_by_scripthash (
+    scripthash TEXT NOT NULL,
+    prevout TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (scripthash, prevout, value)
+);
+CREATE INDEX IF NOT EXISTS spent_outpoints_by_txid
+    ON spent_outpoints (spending_txid);
+'''
+
+
+SHARED_TX_CACHE_FILE = 'tx_cache.sqlite'
+
+TX_CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS raw_txs (
+    txid TEXT PRIMARY KEY,
+    raw BLOB NOT NULL,
+    last_used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS raw_txs_by_last_used ON raw_txs (last_used);
+'''
+
+
+class SharedTxCache(Logger):
+    """Raw transactions by txid, shared by the wallets of a daemon.
+
+    Transactions common to several wallets, or parents of their inputs,
+    are downloaded once. Least recently used transactions are evicted
+    when the total size of raw transactions exceeds max_size bytes.
+    Writes are committed in batches, losing some of them on a crash is
+    harmless for a cache.
+    """
+
+    COMMIT_INTERVAL = 100  # writes
+
+    def __init__(self, path: str, max_size: int):
+        Logger.__init__(self)
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(TX_CACHE_SCHEMA)
+        self.conn.commit()
+        self._size, self._last_used = self.conn.execute(
+            'SELECT COALESCE(SUM(LENGTH(raw)), 0), COALESCE(MAX(last_used), 0)'
+            ' FROM raw_txs').fetchone()
+        self._uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, tx_hash: str) -> Optional[str]:
+        """Return raw tx as hex, or None if not cached"""
+        with self.lock:
+            row = self.conn.execute('SELECT raw FROM raw_txs WHERE txid=?',
+                                    (tx_hash,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            raw = row[0].hex()
+            if Transaction(raw).txid() != tx_hash:
+                self.logger.warning(f'removing corrupted tx {tx_hash}')
+                self._remove(tx_hash, len(row[0]))
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE raw_txs SET last_used=? WHERE txid=?',
+                              (self._use(), tx_hash))
+            self._wrote()
+            self.hits += 1
+            return raw
+
+    def add(self, tx_hash: str, raw: str) -> None:
+        raw_bytes = bytes.fromhex(raw)
+        if len(raw_bytes) > self.max_size:
+            return
+        with self.lock:
+            last_used = self._use()
+            cur = self.conn.execute('UPDATE raw_txs SET last_used=? WHERE txid=?',
+                                    (last_used, tx_hash))
+            if not cur.rowcount:
+                self.conn.execute('INSERT INTO raw_txs VALUES (?,?,?)',
+                                  (tx_hash, raw_bytes, last_used))
+                self._size += len(raw_bytes)
+                if self._size > self.max_size:
+                    self._evict()
+            self._wrote()
+
+    def _use(self) -> int:
+        # a counter instead of a timestamp, to have no ties in LRU order
+        self._last_used += 1
+        return self._last_used
+
+    def _remove(self, tx_hash: str, size: int) -> None:
+        self.conn.execute('DELETE FROM raw_txs WHERE txid=?', (tx_hash,))
+        self._size -= size
+        self._wrote()
+
+    def _evict(self) -> None:
+        # evict down to 90% of max_size, not to evict on every add
+        target = self.max_size * 9 // 10
+        to_remove = []
+        for tx_hash, size in self.conn.execute('SELECT txid, LENGTH(raw) FROM raw_txs'
+                                               ' ORDER BY last_used'):
+            if self._size <= target:
+                break
+            to_remove.append((tx_hash,))
+            self._size -= size
+        self.conn.executemany('DELETE FROM raw_txs WHERE txid=?', to_remove)
+        self.evicted += len(to_remove)
+        self.logger.info(f'evicted {len(to_remove)} txs, size {self._size}')
+
+    def _wrote(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM raw_txs').fetchone()[0]
+
+    def get_size(self) -> int:
+        return self._size
+
+    def as_dict(self) -> dict:
+        return {
+            'txs': len(self),
+            'size': self._size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted,
+        }
+
+
+class SqliteTxStore(Logger):
+    """Keeps the transaction related maps of WalletDB in sqlite tables.
+
+    Rows are read on demand, so only the recently used transactions
+    are kept in memory. Locking is done by WalletDB, which calls
+    commit() when the wallet is saved.
+    """
+
+    TX_CACHE_SIZE = 1000
+
+    def __init__(self, path: str):
+        Logger.__init__(self)
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self._tx_cache = LRUCache(self.TX_CACHE_SIZE)  # type: LRUCache[str, Transaction]
+
+    def _query(self, sql, params=()) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()) -> None:
+        with self.lock:
+            self.conn.execute(sql, params)
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    # txi/txo
+    def get_txi_addresses(self, tx_hash: str) -> List[str]:
+        rows = self._query('SELECT DISTINCT addr FROM txi WHERE txid=?', (tx_hash,))
+        return [r[0] for r in rows]
+
+    def get_txo_addresses(self, tx_hash: str) -> List[str]:
+        rows = self._query('SELECT DISTINCT addr FROM txo WHERE txid=?', (tx_hash,))
+        return [r[0] for r in rows]
+
+    def get_txi_addr(self, tx_hash: str, address: str) -> List[Tuple[str, int]]:
+        return self._query('SELECT prevout, value FROM txi'
+                           ' WHERE txid=? AND addr=?', (tx_hash, address))
+
+    def get_txo_addr(self, tx_hash: str, address: str) -> Dict[int, Tuple[int, bool]]:
+        rows = self._query('SELECT n, value, is_coinbase FROM txo'
+                           ' WHERE txid=? AND addr=?', (tx_hash, address))
+        return {int(n): (v, bool(cb)) for (n, v, cb) in rows}
+
+    def add_txi_addr(self, tx_hash: str, addr: str, ser: str, v: int) -> None:
+        self._execute('INSERT OR REPLACE INTO txi VALUES (?,?,?,?)',
+                      (tx_hash, addr, ser, v))
+
+    def add_txo_addr(self, tx_hash: str, addr: str, n: str, v: int, is_coinbase: bool) -> None:
+        self._execute('INSERT OR REPLACE INTO txo VALUES (?,?,?,?,?)',
+                      (tx_hash, addr, n, v, int(is_coinbase)))
+
+    def list_txi(self) -> List[str]:
+        return [r[0] for r in self._query('SELECT DISTINCT txid FROM txi')]
+
+    def list_txo(self) -> List[str]:
+        return [r[0] for r in self._query('SELECT DISTINCT txid FROM txo')]
+
+    def remove_txi(self, tx_hash: str) -> None:
+        self._execute('DELETE FROM txi WHERE txid=?', (tx_hash,))
+
+    def remove_txo(self, tx_hash: str) -> None:
+        self._execute('DELETE FROM txo WHERE txid=?', (tx_hash,))
+
+    def get_num_ismine_inputs_of_tx(self, tx_hash: str) -> int:
+        return self._query('SELECT COUNT(*) FROM txi WHERE txid=?', (tx_hash,))[0][0]
+
+    # spent_outpoints
+    def list_spent_outpoints(self) -> List[Tuple[str, str]]:
+        return self._query('SELECT prevout_hash, prevout_n FROM spent_outpoints')
+
+    def get_spent_outpoints(self, prevout_hash: str) -> List[str]:
+        rows = self._query('SELECT prevout_n FROM spent_outpoints'
+                           ' WHERE prevout_hash=?', (prevout_hash,))
+        return [r[0] for r in rows]
+
+    def get_spent_outpoint(self, prevout_hash: str, prevout_n: str) -> Optional[str]:
+        rows = self._query('SELECT spending_txid FROM spent_outpoints'
+                           ' WHERE prevout_hash=? AND prevout_n=?',
+                           (prevout_hash, prevout_n))
+        return rows[0][0] if rows else None
+
+    def remove_spent_outpoint(self, prevout_hash: str, prevout_n: str) -> None:
+        self._execute('DELETE FROM spent_outpoints'
+                      ' WHERE prevout_hash=? AND prevout_n=?',
+                      (prevout_hash, prevout_n))
+
+    def set_spent_outpoint(self, prevout_hash: str, prevout_n: str, tx_hash: str) -> None:
+        self._execute('INSERT OR REPLACE INTO spent_outpoints VALUES (?,?,?)',
+                      (prevout_hash, prevout_n, tx_hash))
+
+    def remove_unreferenced_spent_outpoints(self) -> int:
+        with self.lock:
+            cur = self.conn.execute('DELETE FROM spent_outpoints WHERE spending_txid'
+                                    ' NOT IN (SELECT txid FROM transactions)')
+            return cur.rowcount
+
+    # prevouts_by_scripthash
+    def add_prevout_by_scripthash(self, scripthash: str, prevout: str, value: int) -> None:
+        self._execute('INSERT OR IGNORE INTO prevouts_by_scripthash VALUES (?,?,?)',
+                      (scripthash, prevout, value))
+
+    def remove_prevout_by_scripthash(self, scripthash: str, prevout: str, value: int) -> None:
+        self._execute('DELETE FROM prevouts_by_scripthash'
+                      ' WHERE scripthash=? AND prevout=? AND value=?',
+                      (scripthash, prevout, value))
+
+    def get_prevouts_by_scripthash(self, scripthash: str) -> Set[Tuple[str, int]]:
+        rows = self._query('SELECT prevout, value FROM prevouts_by_scripthash'
+                           ' WHERE scripthash=?', (scripthash,))
+        return set(rows)
+
+    # transactions
+    def get_transaction(self, tx_hash: str) -> Optional[Transaction]:
+        with self.lock:
+            tx = self._tx_cache.get(tx_hash)
+            if tx is not None:
+                return tx
+            rows = self._query('SELECT raw FROM transactions WHERE txid=?', (tx_hash,))
+            if not rows:
+                return None
+            tx = tx_from_any(rows[0][0], deserialize=False)
+            self._tx_cache[tx_hash] = tx
+            return tx
+
+    def has_transaction(self, tx_hash: str) -> bool:
+        return bool(self._query('SELECT 1 FROM transactions WHERE txid=?', (tx_hash,)))
+
+    def add_transaction(self, tx_hash: str, tx: Transaction) -> None:
+        with self.lock:
+            self._execute('INSERT OR REPLACE INTO transactions VALUES (?,?)',
+                          (tx_hash, tx.serialize()))
+            self._tx_cache[tx_hash] = tx
+
+    def remove_transaction(self, tx_hash: str) -> Optional[Transaction]:
+        with self.lock:
+            tx = self.get_transaction(tx_hash)
+            self._execute('DELETE FROM transactions WHERE txid=?', (tx_hash,))
+            self._tx_cache.pop(tx_hash)
+            return tx
+
+    def list_transactions(self) -> List[str]:
+        return [r[0] for r in self._query('SELECT txid FROM transactions')]
+
+    def remove_unreferenced_transactions(self) -> List[str]:
+        rows = self._query('SELECT txid FROM transactions WHERE'
+                           ' txid NOT IN (SELECT txid FROM txi) AND'
+                           ' txid NOT IN (SELECT txid FROM txo)')
+        txids = [r[0] for r in rows]
+        for tx_hash in txids:
+            self.remove_transaction(tx_hash)
+        return txids
+
+    # addr_history
+    def list_history_addresses(self) -> List[str]:
+        return [r[0] for r in self._query('SELECT addr FROM addr_history')]
+
+    def is_addr_in_history(self, addr: str) -> bool:
+        return bool(self._query('SELECT 1 FROM addr_history WHERE addr=?', (addr,)))
+
+    def get_addr_history(self, addr: str, ps_ks: bool) -> List[Tuple[str, int]]:
+        rows = self._query('SELECT hist FROM addr_history WHERE addr=? AND ps_ks=?',
+                           (addr, int(ps_ks)))
+        return [tuple(h) for h in json.loads(rows[0][0])] if rows else []
+
+    def set_addr_history(self, addr: str, hist, ps_ks: bool) -> None:
+        self._execute('INSERT OR REPLACE INTO addr_history VALUES (?,?,?)',
+                      (addr, int(ps_ks), json.dumps(list(hist))))
+
+    def remove_addr_history(self, addr: str, ps_ks: bool) -> None:
+        self._execute('DELETE FROM addr_history WHERE addr=? AND ps_ks=?',
+                      (addr, int(ps_ks)))
+
+    def clear(self) -> None:
+        with self.lock:
+            for table in ['txi', 'txo', 'transactions', 'spent_outpoints',
+                          'addr_history', 'prevouts_by_scripthash']:
+                self.conn.execute(f'DELETE FROM {table}')
+            self._tx_cache.clear()
+
+    # migration from/to json wallet data
+    def import_from_json(self, data: dict) -> None:
+        """Fill tables from WalletDB.data values of SQLITE_TX_STORE_KEYS"""
+        with self.lock:
+            c = self.conn
+            c.executemany('INSERT OR REPLACE INTO txi VALUES (?,?,?,?)',
+                          ((txid, addr, ser, v)
+                           for txid, d in data.get('txi', {}).items()
+                           for addr, d2 in d.items()
+                           for ser, v in d2.items()))
+            c.executemany('INSERT OR REPLACE INTO txo VALUES (?,?,?,?,?)',
+                          ((txid, addr, n, v, int(cb))
+                           for txid, d in data.get('txo', {}).items()
+                           for addr, d2 in d.items()
+                           for n, (v, cb) in d2.items()))
+            c.executemany('INSERT OR REPLACE INTO transactions VALUES (?,?)',
+                          ((txid, tx if isinstance(tx, str) else tx.serialize())
+                           for txid, tx in data.get('transactions', {}).items()))
+            c.executemany('INSERT OR REPLACE INTO spent_outpoints VALUES (?,?,?)',
+                          ((h, n, txid)
+                           for h, d in data.get('spent_outpoints', {}).items()
+                           for n, txid in d.items()))
+            for key, ps_ks in [('addr_history', 0), ('ps_ks_addr_hist', 1)]:
+                c.executemany('INSERT OR REPLACE INTO addr_history VALUES (?,?,?)',
+                              ((addr, ps_ks, json.dumps(list(hist)))
+                               for addr, hist in data.get(key, {}).items()))
+            c.executemany('INSERT OR IGNORE INTO prevouts_by_scripthash VALUES (?,?,?)',
+                          ((sh, prevout, value)
+                           for sh, s in data.get('prevouts_by_scripthash', {}).items()
+                           for prevout, value in s))
+            c.commit()
+
+    def export_to_json(self) -> dict:
+        """Return tables content in the WalletDB.data json format"""
+        res = {k: {} for k in SQLITE_TX_STORE_KEYS}
+        for txid, addr, ser, v in self._query('SELECT * FROM txi'):
+            res['txi'].setdefault(txid, {}).setdefault(addr, {})[ser] = v
+        for txid, addr, n, v, cb in self._query('SELECT * FROM txo'):
+            res['txo'].setdefault(txid, {}).setdefault(addr, {})[n] = (v, bool(cb))
+        for txid, raw in self._query('SELECT * FROM transactions'):
+            res['transactions'][txid] = raw
+        for h, n, txid in self._query('SELECT * FROM spent_outpoints'):
+            res['spent_outpoints'].setdefault(h, {})[n] = txid
+        for addr, ps_ks, hist in self._query('SELECT * FROM addr_history'):
+            key = 'ps_ks_addr_hist' if ps_ks else 'addr_history'
+            res[key][addr] = [tuple(h) for h in json.loads(hist)]
+        for sh, prevout, value in self._query('SELECT * FROM prevouts_by_scripthash'):
+            res['prevouts_by_scripthash'].setdefault(sh, []).append((prevout, value))
+        return res
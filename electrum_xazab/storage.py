@@ -27,17 +27,26 @@ import threading
 import stat
 import hashlib
 import base64
+import json
 import zlib
 from enum import IntEnum
+from typing import List
 
 from . import ecc
 from .util import (profiler, InvalidPassword, WalletFileException, bfh, standardize_path,
                    test_read_write_permissions)
 
 from .wallet_db import WalletDB
+from .json_db import apply_journal_record
 from .logging import Logger
 
 
+JOURNAL_SUFFIX = '.journal'
+# compact journal into the wallet file when it is bigger than
+# JOURNAL_COMPACT_MIN_SIZE and more than a half of the wallet file size
+JOURNAL_COMPACT_MIN_SIZE = 1024 * 1024
+
+
 def get_derivation_used_for_hw_device_encryption():
     return ("m"
             "/4541509'"      # ascii 'ELE'  as decimal ("BIP43 purpose")
@@ -63,6 +72,16 @@ class WalletStorage(Logger):
         self.logger.info(f"wallet path {self.path}")
         self.pubkey = None
         self.decrypted = ''
+        # append only journal of changes made after the wallet file
+        # was written, one (optionally encrypted) record per line
+        self.use_journal = False
+        self.journal_path = self.path + JOURNAL_SUFFIX if self.path else None
+        self._journal_lock = threading.RLock()
+        self._journal_raw = []  # type: List[str]
+        self._journal_decrypted = []  # type: List[str]
+        self._journal_size = 0
+        self._snapshot_gen = 0
+        self._compaction_thread = None
         try:
             test_read_write_permissions(self.path)
         except IOError as e:
@@ -71,34 +90,164 @@ class WalletStorage(Logger):
             with open(self.path, "r", encoding='utf-8') as f:
                 self.raw = f.read()
             self._encryption_version = self._init_encryption_version()
+            self._read_journal_file()
         else:
             self.raw = ''
             self._encryption_version = StorageEncryptionVersion.PLAINTEXT
+        self._snapshot_pubkey = None
+        self._snapshot_enc_version = self._encryption_version
 
     def read(self):
         return self.decrypted if self.is_encrypted() else self.raw
 
-    def write(self, data: str) -> None:
-        s = self.encrypt_before_writing(data)
-        temp_path = "%s.tmp.%s" % (self.path, os.getpid())
+    def read_journal(self) -> List[str]:
+        """Return journal records to be replayed on top of read()"""
+        with self._journal_lock:
+            if self.is_encrypted():
+                return list(self._journal_decrypted)
+            return list(self._journal_raw)
+
+    def _read_journal_file(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        # last line can be partially written if we crashed while appending
+        if lines and lines[-1]:
+            self.logger.warning('dropping incomplete journal record')
+        self._journal_raw = [l for l in lines[:-1] if l]
+        self._journal_size = sum(len(l) + 1 for l in self._journal_raw)
+
+    def _write_file(self, path: str, s: str, mode: int) -> None:
+        temp_path = "%s.tmp.%s" % (path, os.getpid())
         with open(temp_path, "w", encoding='utf-8') as f:
             f.write(s)
             f.flush()
             os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        os.chmod(path, mode)
 
+    def _get_file_mode(self) -> int:
         try:
-            mode = os.stat(self.path).st_mode
+            return os.stat(self.path).st_mode
         except FileNotFoundError:
-            mode = stat.S_IREAD | stat.S_IWRITE
-
-        # assert that wallet file does not exist, to prevent wallet corruption (see issue #5082)
-        if not self.file_exists():
-            assert not os.path.exists(self.path)
-        os.replace(temp_path, self.path)
-        os.chmod(self.path, mode)
-        self._file_exists = True
+            return stat.S_IREAD | stat.S_IWRITE
+
+    def write(self, data: str) -> None:
+        with self._journal_lock:
+            s = self.encrypt_before_writing(data)
+            mode = self._get_file_mode()
+            # assert that wallet file does not exist, to prevent wallet corruption (see issue #5082)
+            if not self.file_exists():
+                assert not os.path.exists(self.path)
+            self._write_file(self.path, s, mode)
+            self._set_snapshot(s, data)
+            # journal records are contained in the new wallet file now
+            self._write_journal([], mode)
+            self._file_exists = True
         self.logger.info(f"saved {self.path}")
 
+    def _set_snapshot(self, raw: str, plaintext: str) -> None:
+        self.raw = raw
+        if self.is_encrypted():
+            self.decrypted = plaintext
+        self._snapshot_pubkey = self.pubkey
+        self._snapshot_enc_version = self._encryption_version
+        self._snapshot_gen += 1
+
+    def _write_journal(self, raw_lines: List[str], mode: int) -> None:
+        if raw_lines:
+            self._write_file(self.journal_path, ''.join(l + '\n' for l in raw_lines), mode)
+        elif os.path.exists(self.journal_path):
+            os.unlink(self.journal_path)
+        self._journal_raw = list(raw_lines)
+        if self.is_encrypted():
+            self._journal_decrypted = self._journal_decrypted[-len(raw_lines):] if raw_lines else []
+        self._journal_size = sum(len(l) + 1 for l in raw_lines)
+
+    def can_append(self) -> bool:
+        """Return if journal records can be appended to the wallet file
+        written last (encryption was not changed since then)"""
+        return (self.file_exists()
+                and self.is_past_initial_decryption()
+                and self._snapshot_enc_version == self._encryption_version
+                and self._snapshot_pubkey == self.pubkey)
+
+    def append(self, data: str) -> None:
+        """Append record to the journal, each record is encrypted separately"""
+        assert self.can_append()
+        s = self.encrypt_before_writing(data)
+        assert '\n' not in s
+        with self._journal_lock:
+            if not os.path.exists(self.journal_path):
+                mode = self._get_file_mode()
+                self._write_file(self.journal_path, '', mode)
+            with open(self.journal_path, "a", encoding='utf-8') as f:
+                f.write(s + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_raw.append(s)
+            if self.is_encrypted():
+                self._journal_decrypted.append(data)
+            self._journal_size += len(s) + 1
+            need_compaction = (self._journal_size > JOURNAL_COMPACT_MIN_SIZE
+                               and self._journal_size > len(self.raw) // 2)
+        if need_compaction:
+            self.compact_journal_in_background()
+
+    def journal_size(self) -> int:
+        return self._journal_size
+
+    def compact_journal_in_background(self) -> None:
+        with self._journal_lock:
+            t = self._compaction_thread
+            if t and t.is_alive():
+                return
+            t = threading.Thread(target=self.compact_journal,
+                                 name='WalletJournalCompaction')
+            self._compaction_thread = t
+            t.start()
+
+    def wait_for_compaction(self) -> None:
+        t = self._compaction_thread
+        if t and t.is_alive():
+            t.join()
+
+    @profiler
+    def compact_journal(self) -> None:
+        """Replay journal on top of the wallet file contents and write
+        the result as a new wallet file. Does not use WalletDB, so it can
+        run in a separate thread while the wallet keeps appending records.
+        """
+        with self._journal_lock:
+            snapshot_gen = self._snapshot_gen
+            snapshot = self.read()
+            records = self.read_journal()
+        if not records:
+            return
+        try:
+            data = json.loads(snapshot)
+            for record in records:
+                apply_journal_record(data, json.loads(record))
+            human_readable = not self.is_encrypted()
+            s = json.dumps(data,
+                           indent=4 if human_readable else None,
+                           sort_keys=human_readable)
+        except Exception as e:
+            self.logger.exception(f'journal compaction failed: {repr(e)}')
+            return
+        del data
+        with self._journal_lock:
+            if snapshot_gen != self._snapshot_gen or not self.can_append():
+                return  # wallet file rewritten meanwhile
+            raw = self.encrypt_before_writing(s)
+            mode = self._get_file_mode()
+            self._write_file(self.path, raw, mode)
+            self._set_snapshot(raw, s)
+            # keep records appended while compacting
+            self._write_journal(self._journal_raw[len(records):], mode)
+        self.logger.info(f'compacted {len(records)} journal records into {self.path}')
+
     def file_exists(self) -> bool:
         return self._file_exists
 
@@ -167,10 +316,15 @@ class WalletStorage(Logger):
             enc_magic = self._get_encryption_magic()
             s = zlib.decompress(ec_key.decrypt_message(self.raw, enc_magic))
             s = s.decode('utf8')
+            journal = [zlib.decompress(ec_key.decrypt_message(r, enc_magic)).decode('utf8')
+                       for r in self._journal_raw]
         else:
             s = ''
+            journal = []
         self.pubkey = ec_key.get_public_key_hex()
         self.decrypted = s
+        self._journal_decrypted = journal
+        self._snapshot_pubkey = self.pubkey
 
     def encrypt_before_writing(self, plaintext: str) -> str:
         s = plaintext
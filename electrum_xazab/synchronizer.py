@@ -24,7 +24,7 @@
 # SOFTWARE.
 import asyncio
 import hashlib
-from typing import Dict, List, TYPE_CHECKING, Tuple, Set
+from typing import Dict, List, TYPE_CHECKING, Tuple, Set, Any, Callable, Awaitable, Optional
 from collections import defaultdict
 import logging
 
@@ -35,7 +35,7 @@ from .transaction import Transaction, PartialTransaction
 from .util import bh2u, make_aiohttp_session, NetworkJobOnDefaultServer, random_shuffled_copy
 from .bitcoin import address_to_scripthash, is_address
 from .logging import Logger
-from .interface import GracefulDisconnect, NetworkTimeout
+from .interface import GracefulDisconnect, NetworkTimeout, Interface
 
 if TYPE_CHECKING:
     from .network import Network
@@ -54,6 +54,67 @@ def history_status(h):
     return bh2u(hashlib.sha256(status.encode('ascii')).digest())
 
 
+class RequestBatcher:
+    """Coalesce requests into batches sent with send_batch(items), which
+    returns the results in the order of items. Requests made within
+    flush_interval of each other are sent together, at most batch_size
+    at once. Results which are exceptions are raised to the requester.
+    """
+
+    def __init__(self, send_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+                 *, taskgroup: TaskGroup, batch_size: int, flush_interval: float):
+        self._send_batch = send_batch
+        self._taskgroup = taskgroup
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []  # type: List[Tuple[Any, asyncio.Future]]
+        self._flush_task = None  # type: Optional[asyncio.Task]
+        self.batches_sent = 0
+        self.items_sent = 0
+
+    async def request(self, item):
+        fut = asyncio.get_event_loop().create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.batch_size:
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = await self._taskgroup.spawn(self._flush_later())
+        res = await fut
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        while self._pending:
+            await self._flush()
+
+    async def _flush(self):
+        batch = self._pending[:self.batch_size]
+        self._pending = self._pending[self.batch_size:]
+        if batch:
+            await self._taskgroup.spawn(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            results = await self._send_batch([item for item, fut in batch])
+        except asyncio.CancelledError:
+            for item, fut in batch:
+                fut.cancel()
+            raise
+        except Exception as e:
+            for item, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.batches_sent += 1
+        self.items_sent += len(batch)
+        for (item, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
+
+
 class SynchronizerBase(NetworkJobOnDefaultServer):
     """Subscribe over the network to a set of addresses, and monitor their statuses.
     Every time a status changes, run a coroutine provided by the subclass.
@@ -73,6 +134,20 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         # Queues
         self.add_queue = asyncio.Queue()
         self.status_queue = asyncio.Queue()
+        self._subscribe_batcher = self._new_batcher(self._send_subscribe_batch)
+
+    def _new_batcher(self, send_batch) -> Optional[RequestBatcher]:
+        config = self.network.config
+        batch_size = config.get_synchronizer_batch_size()
+        if batch_size <= 1:
+            return None
+        return RequestBatcher(send_batch, taskgroup=self.taskgroup, batch_size=batch_size,
+                              flush_interval=config.get_synchronizer_batch_interval())
+
+    async def _send_subscribe_batch(self, hashes: List[str]) -> List[Optional[Exception]]:
+        async with self._network_request_semaphore:
+            return await self.session.subscribe_batch(
+                'blockchain.scripthash.subscribe', [[h] for h in hashes], self.status_queue)
 
     async def _run_tasks(self, *, taskgroup):
         await super()._run_tasks(taskgroup=taskgroup)
@@ -121,8 +196,11 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
             self.scripthash_to_address[h] = addr
             self._requests_sent += 1
             try:
-                async with self._network_request_semaphore:
-                    await self.session.subscribe('blockchain.scripthash.subscribe', [h], self.status_queue)
+                if self._subscribe_batcher:
+                    await self._subscribe_batcher.request(h)
+                else:
+                    async with self._network_request_semaphore:
+                        await self.session.subscribe('blockchain.scripthash.subscribe', [h], self.status_queue)
             except RPCError as e:
                 if e.message == 'history too large':  # no unique error code
                     raise GracefulDisconnect(e, log_level=logging.ERROR) from e
@@ -165,6 +243,73 @@ class Synchronizer(SynchronizerBase):
         self.requested_tx = {}
         self.requested_histories = set()
         self._stale_histories = dict()  # type: Dict[str, asyncio.Task]
+        self._history_batcher = self._new_batcher(self._send_history_batch)
+        self._tx_batcher = self._new_batcher(self._send_tx_batch)
+        self._parallel_restore = self.network.config.get('parallel_restore', False)
+        self._fetch_counter = 0
+        self._items_fetched = 0
+        self._items_from_peers = 0
+
+    async def _send_history_batch(self, items: List[Tuple[str, str]]) -> List[Any]:
+        def get_batch(interface, items):
+            return interface.get_history_for_scripthashes([h for h, status in items])
+        def matches_status(item, result):
+            h, status = item
+            hist = [(tx_item['tx_hash'], tx_item['height']) for tx_item in result]
+            return history_status(hist) == status
+        return await self._fetch_batch(get_batch, items, matches_status)
+
+    async def _send_tx_batch(self, tx_hashes: List[str]) -> List[Any]:
+        def get_batch(interface, tx_hashes):
+            # txids of received txs are checked by the interface
+            return interface.get_transactions(tx_hashes)
+        return await self._fetch_batch(get_batch, tx_hashes, lambda item, result: True)
+
+    def _next_fetch_interface(self) -> Interface:
+        """With 'parallel_restore' set, rotate batches over the main interface
+        and the other interfaces on its chain.
+        """
+        if not self._parallel_restore:
+            return self.interface
+        interfaces = [self.interface] + self.interface.get_peer_interfaces(min_tip=self.interface.tip)
+        self._fetch_counter += 1
+        return interfaces[self._fetch_counter % len(interfaces)]
+
+    async def _fetch_batch(self, get_batch, items: List[Any], is_valid) -> List[Any]:
+        interface = self._next_fetch_interface()
+        self._items_fetched += len(items)
+        if interface is self.interface:
+            async with self._network_request_semaphore:
+                return await get_batch(interface, items)
+        # Results of other servers are only used if they agree with what
+        # the main server announced, the rest is fetched from it again.
+        async with self._network_request_semaphore:
+            results = await self._fetch_batch_from_peer(interface, get_batch, items)
+        retry = [i for i, (item, res) in enumerate(zip(items, results))
+                 if res is None or isinstance(res, Exception) or not is_valid(item, res)]
+        if retry:
+            self.logger.info(f'refetching {len(retry)} of {len(items)} items from main server'
+                             f' instead of {interface.diagnostic_name()}')
+            async with self._network_request_semaphore:
+                retried = await get_batch(self.interface, [items[i] for i in retry])
+            for i, res in zip(retry, retried):
+                results[i] = res
+        self._items_from_peers += len(items) - len(retry)
+        return results
+
+    async def _fetch_batch_from_peer(self, interface, get_batch, items) -> List[Any]:
+        # the request runs in its own task, so that the peer disconnecting
+        # (cancelling its requests) does not look like we got cancelled
+        task = asyncio.ensure_future(get_batch(interface, items))
+        try:
+            await asyncio.wait([task])
+        finally:
+            task.cancel()
+        if task.cancelled() or task.exception():
+            self.logger.info(f'batch from {interface.diagnostic_name()} failed:'
+                             f' {repr(None if task.cancelled() else task.exception())}')
+            return [None] * len(items)
+        return list(task.result())
 
     def diagnostic_name(self):
         return self.wallet.diagnostic_name()
@@ -188,8 +333,11 @@ class Synchronizer(SynchronizerBase):
         self._stale_histories.pop(addr, asyncio.Future()).cancel()
         h = address_to_scripthash(addr)
         self._requests_sent += 1
-        async with self._network_request_semaphore:
-            result = await self.interface.get_history_for_scripthash(h)
+        if self._history_batcher:
+            result = await self._history_batcher.request((h, status))
+        else:
+            async with self._network_request_semaphore:
+                result = await self.interface.get_history_for_scripthash(h)
         self._requests_answered += 1
         self.logger.info(f"receiving history {addr} {len(result)}")
         hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
@@ -235,25 +383,45 @@ class Synchronizer(SynchronizerBase):
                 await group.spawn(self._get_transaction(tx_hash, allow_server_not_finding_tx=allow_server_not_finding_tx))
 
     async def _get_transaction(self, tx_hash, *, allow_server_not_finding_tx=False):
+        tx_cache = self.network.tx_cache
+        loop = asyncio.get_event_loop()
+        raw_tx = None
+        if tx_cache:
+            # sqlite reads and commits of the cache are kept off the network loop
+            raw_tx = await loop.run_in_executor(None, tx_cache.get, tx_hash)
+        from_cache = raw_tx is not None
+        if not from_cache:
+            raw_tx = await self._request_transaction(
+                tx_hash, allow_server_not_finding_tx=allow_server_not_finding_tx)
+            if raw_tx is None:
+                return
+        tx = Transaction(raw_tx)
+        if tx_hash != tx.txid():
+            raise SynchronizerFailure(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
+        if tx_cache and not from_cache:
+            await loop.run_in_executor(None, tx_cache.add, tx_hash, raw_tx)
+        tx_height = self.requested_tx.pop(tx_hash)
+        self.wallet.receive_tx_callback(tx_hash, tx, tx_height)
+        self.logger.info(f"received tx {tx_hash} height: {tx_height} bytes: {len(raw_tx)}")
+
+    async def _request_transaction(self, tx_hash, *, allow_server_not_finding_tx=False) -> Optional[str]:
         self._requests_sent += 1
         try:
-            async with self._network_request_semaphore:
-                raw_tx = await self.interface.get_transaction(tx_hash)
+            if self._tx_batcher:
+                raw_tx = await self._tx_batcher.request(tx_hash)
+            else:
+                async with self._network_request_semaphore:
+                    raw_tx = await self.interface.get_transaction(tx_hash)
         except RPCError as e:
             # most likely, "No such mempool or blockchain transaction"
             if allow_server_not_finding_tx:
                 self.requested_tx.pop(tx_hash)
-                return
+                return None
             else:
                 raise
         finally:
             self._requests_answered += 1
-        tx = Transaction(raw_tx)
-        if tx_hash != tx.txid():
-            raise SynchronizerFailure(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
-        tx_height = self.requested_tx.pop(tx_hash)
-        self.wallet.receive_tx_callback(tx_hash, tx, tx_height)
-        self.logger.info(f"received tx {tx_hash} height: {tx_height} bytes: {len(raw_tx)}")
+        return raw_tx
 
     async def main(self):
         self.wallet.set_up_to_date(False)
@@ -284,6 +452,10 @@ class Synchronizer(SynchronizerBase):
                 self._processed_some_notifications = False
                 if up_to_date:
                     self._reset_request_counters()
+                    if self._items_from_peers:
+                        self.logger.info(f'parallel restore: {self._items_from_peers} of'
+                                         f' {self._items_fetched} items fetched from other servers')
+                        self._items_fetched = self._items_from_peers = 0
                 self.wallet.set_up_to_date(up_to_date)
                 util.trigger_callback('wallet_updated', self.wallet)
 
@@ -488,6 +488,18 @@ class Test_xprv_xpub(ElectrumTestCase):
         self.assertEqual("xpub6BJA1jSqiukeaesWfxe6sNK9CCGaujFFSJLomWHprUL9DePQ4JDkM5d88n49sMGJxrhpjazuXYWdMf17C9T5XnxkopaeS7jGk1GyyVziaMt", xpub)
         self.assertEqual("xprv9xJocDuwtYCMNAo3Zw76WENQeAS6WGXQ55RCy7tDJ8oALr4FWkuVoHJeHVAcAqiZLE7Je3vZJHxspZdFHfnBEjHqU5hG1Jaj32dVoS6XLT1", xprv)
 
+    def test_derive_child_keypairs(self):
+        node = BIP32Node.from_xkey(self.xprv_xpub[0]['xprv'])
+        privkey = node.eckey.get_secret_bytes()
+        indices = [0, 1, 7, 1000, bip32.BIP32_PRIME - 1]
+        keypairs = bip32.derive_child_keypairs(privkey, node.chaincode, indices)
+        for n, (child_privkey, child_pubkey) in zip(indices, keypairs):
+            child = node.subkey_at_private_derivation([n])
+            self.assertEqual(child.eckey.get_secret_bytes(), child_privkey)
+            self.assertEqual(child.eckey.get_public_key_bytes(), child_pubkey)
+        with self.assertRaises(ValueError):
+            bip32.derive_child_keypairs(privkey, node.chaincode, [bip32.BIP32_PRIME])
+
     def test_xpub_from_xprv(self):
         """We can derive the xpub key from a xprv."""
         for xprv_details in self.xprv_xpub:
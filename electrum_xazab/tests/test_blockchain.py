@@ -1,6 +1,8 @@
 import shutil
 import tempfile
 import os
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
 
 from electrum_xazab import constants, blockchain
 from electrum_xazab.simple_config import SimpleConfig
@@ -385,6 +387,115 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual([chain_z, chain_l], self.get_chains_that_contain_header_helper(self.HEADERS['I']))
 
 
+    def test_header_cache_invalidated_on_swap(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        for name in 'ABCDEFOPQR':
+            self._append_header(chain_u, self.HEADERS[name])
+        chain_l = chain_u.fork(self.HEADERS['G'])
+        for name in 'HIJ':
+            self._append_header(chain_l, self.HEADERS[name])
+        # populate caches of both chains
+        for b in (chain_u, chain_l):
+            for i in range(b.height() + 1):
+                b.get_hash(i)
+        self.assertEqual(hash_header(self.HEADERS['O']), chain_u.get_hash(6))
+        self.assertEqual(hash_header(self.HEADERS['G']), chain_l.get_hash(6))
+
+        self._append_header(chain_l, self.HEADERS['K'])
+
+        # chains were swapped
+        self.assertEqual(0, chain_l.forkpoint)
+        for name in 'ABCDEFGHIJK':
+            header = self.HEADERS[name]
+            self.assertEqual(header, chain_l.read_header(header['block_height']))
+            self.assertEqual(hash_header(header), chain_l.get_hash(header['block_height']))
+        for name in 'ABCDEFOPQR':
+            header = self.HEADERS[name]
+            self.assertEqual(header, chain_u.read_header(header['block_height']))
+            self.assertEqual(hash_header(header), chain_u.get_hash(header['block_height']))
+
+    def test_header_cache_invalidated_on_write(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        for name in 'ABCDEFOPQR':
+            self._append_header(chain_u, self.HEADERS[name])
+        for i in range(chain_u.height() + 1):
+            chain_u.get_hash(i)
+        # returned headers are copies, mutating them must not affect the cache
+        chain_u.read_header(6)['nonce'] = 0
+        self.assertEqual(self.HEADERS['O'], chain_u.read_header(6))
+
+        data = b''.join(bfh(blockchain.serialize_header(self.HEADERS[name])) for name in 'GHI')
+        chain_u.write(data, 6 * 80)
+        self.assertEqual(8, chain_u.height())
+        # only truncated heights are dropped from caches
+        self.assertEqual(list(range(1, 6)), sorted(chain_u._hash_cache.keys()))
+        self.assertEqual([], [h for h in chain_u._header_cache.keys() if h >= 6])
+        self.assertEqual(hash_header(self.HEADERS['F']), chain_u.get_hash(5))
+        self.assertEqual(hash_header(self.HEADERS['G']), chain_u.get_hash(6))
+        self.assertEqual(self.HEADERS['I'], chain_u.read_header(8))
+        self.assertIsNone(chain_u.read_header(9))
+
+
+    def test_hash_index_survives_restart_and_is_rebuilt(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        for name in 'ABCDEFOPQR':
+            self._append_header(chain_u, self.HEADERS[name])
+        self.assertEqual(10 * 32, os.stat(chain_u.index_path()).st_size)
+
+        def new_chain():
+            return Blockchain(config=self.config, forkpoint=0, parent=None,
+                              forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+
+        def check_hashes(chain):
+            for name in 'BCDEFOPQR':
+                header = self.HEADERS[name]
+                self.assertEqual(hash_header(header), chain.get_hash(header['block_height']))
+
+        # after a restart, hashes are served from the index without hashing headers
+        with mock.patch.object(blockchain, 'hash_header', side_effect=Exception('no hashing')):
+            check_hashes(new_chain())
+        # a missing index is rebuilt lazily
+        chain_u.delete_hash_index()
+        self.assertFalse(os.path.exists(chain_u.index_path()))
+        check_hashes(new_chain())
+        with mock.patch.object(blockchain, 'hash_header', side_effect=Exception('no hashing')):
+            check_hashes(new_chain())
+
+
+    def test_verify_chunk_with_hashes_from_process_pool(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        names = 'ABCDEFOPQR'
+        data = b''.join(bfh(blockchain.serialize_header(self.HEADERS[name])) for name in names)
+        expected = [hash_header(self.HEADERS[name]) for name in names]
+        self.assertEqual(expected, blockchain.hash_raw_headers(data))
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            hashes = blockchain.hash_raw_headers_parallel(data, executor, 3)
+        self.assertEqual(expected, hashes)
+        self.assertEqual(expected, chain_u.verify_chunk(0, data, hashes))
+        # linkage of the headers is still checked
+        bad_hashes = list(hashes)
+        bad_hashes[4] = '00' * 32
+        with self.assertRaises(Exception):
+            chain_u.verify_chunk(0, data, bad_hashes)
+        with self.assertRaises(Exception):
+            chain_u.verify_chunk(0, data, hashes[:-1])
+        self.assertTrue(chain_u.connect_chunk(0, bh2u(data), hashes=hashes))
+        self.assertEqual(9, chain_u.height())
+        self.assertEqual(expected[-1], chain_u.get_hash(9))
+
+
 class TestVerifyHeader(ElectrumTestCase):
 
     # Data for Bitcoin block header #100.
@@ -1,6 +1,7 @@
 import asyncio
 import tempfile
 import unittest
+from unittest import mock
 
 from electrum_xazab import constants
 from electrum_xazab.simple_config import SimpleConfig
@@ -18,6 +19,7 @@ class MockTaskGroup:
 class MockNetwork:
     taskgroup = MockTaskGroup()
     asyncio_loop = asyncio.get_event_loop()
+    interfaces = {}
 
 class MockInterface(Interface):
     def __init__(self, config):
@@ -116,6 +118,85 @@ class TestNetwork(ElectrumTestCase):
         self.assertEqual(('catchup', 7), asyncio.get_event_loop().run_until_complete(ifa.sync_until(8, next_height=6)))
         self.assertEqual(self.interface.q.qsize(), 0)
 
+    def test_sync_chunks_pipelined(self):
+        blockchain.blockchains = {}
+        ifa = self.interface
+        ifa.tip = 5 * 2016 + 100
+        in_flight = set()
+        max_in_flight = 0
+        connected = []
+        async def fetch_chunk(index, tip=None):
+            nonlocal max_in_flight
+            in_flight.add(index)
+            max_in_flight = max(max_in_flight, len(in_flight))
+            # later chunks arrive first
+            await asyncio.sleep(0.01 * (6 - index))
+            in_flight.discard(index)
+            count = min(2016, tip - index * 2016 + 1)
+            return '', count
+        async def connect_fetched_chunk(index, hexdata):
+            connected.append(index)
+            return True
+        ifa._fetch_chunk = fetch_chunk
+        ifa._connect_fetched_chunk = connect_fetched_chunk
+        self.config.set_key('header_download_pipeline', 3)
+        with mock.patch('electrum_xazab.util.trigger_callback') as trigger_callback:
+            res = asyncio.get_event_loop().run_until_complete(ifa.sync_until(13))
+        self.assertEqual(('catchup', ifa.tip + 1), res)
+        self.assertEqual([0, 1, 2, 3, 4, 5], connected)
+        self.assertEqual(3, max_in_flight)
+        self.assertEqual(6, trigger_callback.call_count)
+        self.assertIsNone(ifa.header_sync_progress)
+
+    def test_no_pipeline_on_chunk_boundary_crossing(self):
+        blockchain.blockchains = {}
+        ifa = self.interface
+        ifa.tip = 2 * 2016 + 1
+        steps = []
+        async def step(height, header=None):
+            steps.append(height)
+            return 'catchup', height + 1
+        ifa.step = step
+        ifa._sync_chunks_pipelined = mock.Mock(side_effect=AssertionError('pipelined'))
+        self.config.set_key('header_download_pipeline', 3)
+        res = asyncio.get_event_loop().run_until_complete(
+            ifa.sync_until(2 * 2016 - 1))
+        self.assertEqual(('catchup', ifa.tip + 1), res)
+        self.assertEqual([4031, 4032, 4033], steps)
+
+    def test_sync_chunks_pipelined_helper_fails(self):
+        blockchain.blockchains = {}
+        ifa = self.interface
+        ifa.tip = 3 * 2016 + 100
+        fetched = []
+        async def fetch_chunk(index, tip=None):
+            fetched.append(index)
+            return '', min(2016, tip - index * 2016 + 1)
+        async def fetch_chunk_cancelled(index, tip=None):
+            raise asyncio.CancelledError()  # helper disconnected
+        async def fetch_chunk_no_session(index, tip=None):
+            raise AttributeError("'NoneType' object has no attribute 'send_request'")
+        async def connect_fetched_chunk(index, hexdata):
+            return True
+        helpers = [mock.Mock(_fetch_chunk=fetch_chunk_cancelled),
+                   mock.Mock(_fetch_chunk=fetch_chunk_no_session)]
+        ifa._fetch_chunk = fetch_chunk
+        ifa._connect_fetched_chunk = connect_fetched_chunk
+        ifa._get_chunk_interfaces = lambda tip: [ifa] + helpers
+        self.config.set_key('header_download_pipeline', 3)
+        with mock.patch('electrum_xazab.util.trigger_callback'):
+            res = asyncio.get_event_loop().run_until_complete(ifa.sync_until(13))
+        self.assertEqual(('catchup', ifa.tip + 1), res)
+        # chunks of failed helpers are fetched from our server
+        self.assertEqual([0, 3, 1, 2], fetched)
+
+    def test_chunk_interfaces_spread_is_opt_in(self):
+        ifa = self.interface
+        self.assertEqual([ifa], ifa._get_chunk_interfaces(ifa.tip))
+        self.config.set_key('header_download_spread', True)
+        with mock.patch.object(ifa, 'get_peer_interfaces', return_value=['peer']):
+            self.assertEqual([ifa, 'peer'], ifa._get_chunk_interfaces(ifa.tip))
+
 
 if __name__=="__main__":
     constants.set_regtest()
@@ -1,10 +1,39 @@
-import unittest
+import os
+from collections import namedtuple
+from struct import pack
+from types import SimpleNamespace
 
+from electrum_xazab.crypto import sha256d
 from electrum_xazab.protx_list import MNList
 from electrum_xazab.constants import CHUNK_SIZE
+from electrum_xazab.simple_config import SimpleConfig
 
+from . import ElectrumTestCase
 
-class ProTxListTestCase(unittest.TestCase):
+
+Quorum = namedtuple('Quorum', 'llmqType quorumHash')
+
+
+def make_quorums(cnt, llmqType):
+    quorums = {}
+    for i in range(cnt):
+        q = Quorum(llmqType, os.urandom(32))
+        quorums[f'{q.quorumHash[::-1].hex()}:{llmqType}'] = q
+    return quorums
+
+
+def calc_responsible_quorum_by_sort(quorums, llmqType, request_id):
+    res = []
+    for q in quorums.values():
+        if q.llmqType != llmqType:
+            continue
+        prehash = pack('B', q.llmqType) + q.quorumHash + request_id
+        res.append((sha256d(prehash), q))
+    res = sorted(res, key=lambda x: x[0])
+    return res[0][1] if res else None
+
+
+class ProTxListTestCase(ElectrumTestCase):
     def test_calc_max_height(self):
         for base_height in [0, 1, 2, 3,
                             CHUNK_SIZE - 3, CHUNK_SIZE - 2,
@@ -29,3 +58,35 @@ class ProTxListTestCase(unittest.TestCase):
                 assert 0 < (calc_height - base_height) <= CHUNK_SIZE
                 if (height - base_height) > CHUNK_SIZE:
                     assert (calc_height + 1) % CHUNK_SIZE == 0
+
+    def test_calc_responsible_quorum(self):
+        config = SimpleConfig({'electrum_path': self.electrum_path})
+        mn_list = MNList(SimpleNamespace(xazab_net=None), config)
+        assert mn_list.quorums == {}
+        request_ids = [os.urandom(32) for i in range(50)]
+        assert mn_list.calc_responsible_quorum(1, request_ids[0]) is None
+
+        quorums = make_quorums(24, 1)
+        quorums.update(make_quorums(4, 2))
+        mn_list.quorums = quorums
+        for llmqType in [1, 2, 3]:
+            for request_id in request_ids + request_ids[:10]:
+                assert (mn_list.calc_responsible_quorum(llmqType, request_id)
+                        == calc_responsible_quorum_by_sort(quorums, llmqType,
+                                                           request_id))
+
+        # same quorums set in a new dict keeps the index
+        index = mn_list._quorums_index
+        mn_list.quorums = quorums.copy()
+        mn_list.calc_responsible_quorum(1, request_ids[0])
+        assert mn_list._quorums_index is index
+
+        # changed quorums set rebuilds the index and drops cached results
+        quorums = quorums.copy()
+        for k in list(quorums.keys())[:12]:
+            del quorums[k]
+        quorums.update(make_quorums(12, 1))
+        mn_list.quorums = quorums
+        for request_id in request_ids:
+            assert (mn_list.calc_responsible_quorum(1, request_id)
+                    == calc_responsible_quorum_by_sort(quorums, 1, request_id))
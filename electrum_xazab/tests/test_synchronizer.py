@@ -0,0 +1,229 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from aiorpcx import RPCError
+
+from electrum_xazab.interface import RequestTimedOut
+from electrum_xazab.simple_config import SimpleConfig
+from electrum_xazab.synchronizer import (RequestBatcher, Synchronizer, SynchronizerFailure,
+                                         history_status)
+from electrum_xazab.transaction import Transaction
+from electrum_xazab.util import SilentTaskGroup
+
+from . import ElectrumTestCase
+
+
+class TestRequestBatcher(ElectrumTestCase):
+
+    def test_requests_coalesced(self):
+        sent = []
+
+        async def send_batch(items):
+            sent.append(list(items))
+            await asyncio.sleep(0.01)
+            return [RPCError(1, 'not found') if item == 'bad' else item.upper()
+                    for item in items]
+
+        async def request(batcher, item):
+            try:
+                return await batcher.request(item)
+            except RPCError as e:
+                return e.message
+
+        async def run():
+            async with SilentTaskGroup() as group:
+                batcher = RequestBatcher(send_batch, taskgroup=group,
+                                         batch_size=3, flush_interval=0.05)
+                items = ['a', 'b', 'bad', 'c', 'd']
+                results = await asyncio.gather(*[request(batcher, item)
+                                                 for item in items])
+                # requested after the interval, sent in the next batch
+                await asyncio.sleep(0.1)
+                results.append(await request(batcher, 'e'))
+            return batcher, results
+
+        batcher, results = asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual(['A', 'B', 'not found', 'C', 'D', 'E'], results)
+        self.assertEqual([['a', 'b', 'bad'], ['c', 'd'], ['e']], sent)
+        self.assertEqual(3, batcher.batches_sent)
+        self.assertEqual(6, batcher.items_sent)
+
+    def test_batch_failure_raised_to_requesters(self):
+        async def send_batch(items):
+            raise ConnectionError('lost')
+
+        async def run():
+            async with SilentTaskGroup() as group:
+                batcher = RequestBatcher(send_batch, taskgroup=group,
+                                         batch_size=10, flush_interval=0.01)
+                return await asyncio.gather(batcher.request(1), batcher.request(2),
+                                            return_exceptions=True)
+
+        results = asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual(2, len(results))
+        for res in results:
+            self.assertIsInstance(res, ConnectionError)
+
+
+class MockTaskGroup:
+
+    async def spawn(self, coro):
+        coro.close()  # synchronizer tasks are not run in tests
+
+
+class FakeNetwork:
+
+    def __init__(self, interface=None, config=None, tx_cache=None):
+        self.asyncio_loop = asyncio.get_event_loop()
+        self.interface = interface
+        self.config = SimpleConfig(config or {})
+        self.tx_cache = tx_cache
+
+
+class FakeInterface:
+
+    def __init__(self, name, histories, peers=(), error=None):
+        self.name = name
+        self.histories = histories
+        self.peers = list(peers)
+        self.error = error
+        self.tip = 100
+        self.requested = []
+        self.taskgroup = MockTaskGroup()
+
+    def diagnostic_name(self):
+        return self.name
+
+    def get_peer_interfaces(self, *, min_tip=0):
+        return [p for p in self.peers if p.tip >= min_tip]
+
+    async def get_history_for_scripthashes(self, shs):
+        self.requested.extend(shs)
+        if self.error:
+            raise self.error
+        return [self.histories[sh] for sh in shs]
+
+
+class TestParallelRestore(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.histories = {f'{i:064x}': [{'tx_hash': f'{i + 100:064x}', 'height': i}]
+                          for i in range(12)}
+        stale = dict(self.histories)
+        stale[f'{4:064x}'] = []
+        self.good_peer = FakeInterface('good', self.histories)
+        self.stale_peer = FakeInterface('stale', stale)
+        self.broken_peer = FakeInterface('broken', self.histories,
+                                         error=RequestTimedOut('timeout'))
+        self.main = FakeInterface('main', self.histories,
+                                  peers=[self.good_peer, self.stale_peer, self.broken_peer])
+
+    def tearDown(self):
+        asyncio.get_event_loop().run_until_complete(self.sync.stop())
+        super().tearDown()
+
+    def start_synchronizer(self, parallel_restore=True):
+        network = FakeNetwork(self.main, {'parallel_restore': parallel_restore})
+        wallet = SimpleNamespace(network=network,
+                                 diagnostic_name=lambda: 'test_wallet')
+        self.sync = sync = Synchronizer(wallet)
+        # wait for the restart on the main interface scheduled in __init__
+        while sync.interface is None:
+            asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
+        return sync
+
+    def test_history_batches_spread_and_checked(self):
+        items = [(sh, history_status([(x['tx_hash'], x['height']) for x in hist]))
+                 for sh, hist in self.histories.items()]
+        batches = [items[i:i + 3] for i in range(0, len(items), 3)]
+
+        sync = self.start_synchronizer()
+
+        async def run():
+            return await asyncio.gather(*[sync._send_history_batch(batch)
+                                          for batch in batches])
+
+        results = asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual([[self.histories[sh] for sh, status in batch] for batch in batches],
+                         results)
+        for iface in (self.main, self.good_peer, self.stale_peer, self.broken_peer):
+            self.assertTrue(iface.requested)
+        # one batch each, the stale history and the batch of the
+        # broken peer are fetched again from the main server
+        self.assertEqual(12 - 3 - 1 - 3, sync._items_from_peers)
+        self.assertEqual(3 + 1 + 3, len(self.main.requested))
+
+    def test_disabled(self):
+        sync = self.start_synchronizer(parallel_restore=False)
+        items = [(sh, None) for sh in self.histories]
+        res = asyncio.get_event_loop().run_until_complete(
+            sync._send_history_batch(items))
+        self.assertEqual(list(self.histories.values()), res)
+        self.assertEqual(12, len(self.main.requested))
+        self.assertEqual(0, sync._items_from_peers)
+
+
+RAW_TX = ('01000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031'
+          '000000006c493046022100a82bbc57a0136751e5433f41cf000b3f1a99c6744775e76ec764'
+          'fb78c54ee100022100f9e80b7de89de861dc6fb0c1429d5da72c2b6b2ee2406bc9bfb1beed'
+          'd729d985012102e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84'
+          'd2f6ffffffff0140420f00000000001976a914230ac37834073a42146f11ef8414ae929fea'
+          'afc388ac00000000')
+
+
+class FakeTxCache:
+
+    def __init__(self, txs=None):
+        self.txs = dict(txs or {})
+        self.threads = set()
+
+    def get(self, tx_hash):
+        self.threads.add(threading.current_thread())
+        return self.txs.get(tx_hash)
+
+    def add(self, tx_hash, raw):
+        self.threads.add(threading.current_thread())
+        self.txs[tx_hash] = raw
+
+
+class TestGetTransaction(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.txid = Transaction(RAW_TX).txid()
+        self.tx_cache = FakeTxCache()
+        self.received = []
+        wallet = SimpleNamespace(
+            network=FakeNetwork(tx_cache=self.tx_cache),
+            diagnostic_name=lambda: 'test_wallet',
+            receive_tx_callback=lambda *args: self.received.append(args))
+        self.sync = Synchronizer(wallet)
+
+    def tearDown(self):
+        asyncio.get_event_loop().run_until_complete(self.sync.stop())
+        super().tearDown()
+
+    def get_transaction(self, tx_hash, raw_tx):
+        async def request_transaction(tx_hash, **kwargs):
+            return raw_tx
+        self.sync._request_transaction = request_transaction
+        self.sync.requested_tx[tx_hash] = 10
+        asyncio.get_event_loop().run_until_complete(
+            self.sync._get_transaction(tx_hash))
+
+    def test_tx_cached_off_loop(self):
+        self.get_transaction(self.txid, RAW_TX)
+        self.assertEqual({self.txid: RAW_TX}, self.tx_cache.txs)
+        self.assertEqual(1, len(self.received))
+        self.assertNotIn(threading.current_thread(), self.tx_cache.threads)
+        # next time tx is got from the cache
+        self.get_transaction(self.txid, None)
+        self.assertEqual(2, len(self.received))
+
+    def test_mismatched_tx_not_cached(self):
+        with self.assertRaises(SynchronizerFailure):
+            self.get_transaction('00' * 32, RAW_TX)
+        self.assertEqual({}, self.tx_cache.txs)
+        self.assertEqual([], self.received)
@@ -1,6 +1,7 @@
 from typing import NamedTuple, Union
+from concurrent.futures import ThreadPoolExecutor
 
-from electrum_xazab import transaction, bitcoin
+from electrum_xazab import transaction, bitcoin, ecc
 from electrum_xazab.transaction import (convert_raw_tx_to_hex, tx_from_any, Transaction,
                                        PartialTransaction, TxOutpoint, PartialTxInput,
                                        PartialTxOutput)
@@ -85,6 +86,71 @@ class TestTransaction(ElectrumTestCase):
         tx.update_signatures(signed_blob_signatures)
         self.assertEqual(tx.serialize(), signed_blob)
 
+    def test_serialize_preimage_with_sighash_cache(self):
+        privkey = ECPrivkey(bytes([1] * 32))
+        pubkey = privkey.get_public_key_bytes(compressed=True)
+        inputs = []
+        for i in range(3):
+            txin = PartialTxInput(prevout=TxOutpoint(txid=bytes([i + 1] * 32), out_idx=i),
+                                  nsequence=0xffffffff - i)
+            txin.script_type = 'p2pkh'
+            txin.pubkeys = [pubkey]
+            txin.num_sig = 1
+            txin._trusted_value_sats = 100000
+            inputs.append(txin)
+        outputs = [PartialTxOutput.from_address_and_value('Xr58KiC2RvNN83LZExCoszE6mpAudBqQwK', 250000)]
+        tx = PartialTransaction.from_io(inputs, outputs, locktime=12345)
+        sighash_cache = tx.get_sighash_cache()
+        for i in range(3):
+            script = tx.get_preimage_script(tx.inputs()[i])
+            expected = (bitcoin.int_to_hex(tx.version, 4)
+                        + bitcoin.var_int(3)
+                        + ''.join(tx.serialize_input(txin, script if i == k else '')
+                                  for k, txin in enumerate(tx.inputs()))
+                        + bitcoin.var_int(1) + outputs[0].serialize_to_network().hex()
+                        + bitcoin.int_to_hex(12345, 4)
+                        + bitcoin.int_to_hex(1, 4))
+            self.assertEqual(expected, tx.serialize_preimage(i))
+            self.assertEqual(expected, tx.serialize_preimage(i, sighash_cache=sighash_cache))
+        self.assertEqual(3, tx.sign({pubkey.hex(): (privkey.get_secret_bytes(), True)}))
+        self.assertTrue(tx.is_complete())
+        for i, txin in enumerate(tx.inputs()):
+            pre_hash = bitcoin.sha256d(bfh(tx.serialize_preimage(i)))
+            sig = ecc.sig_string_from_der_sig(txin.part_sigs[pubkey][:-1])
+            self.assertTrue(ecc.ECPubkey(pubkey).verify_message_hash(sig, pre_hash) is None)
+
+    def test_sign_batch_in_executor(self):
+        privkeys = [ECPrivkey(bytes([i + 1] * 32)) for i in range(3)]
+        pubkeys = sorted(pk.get_public_key_bytes(compressed=True) for pk in privkeys)
+        keypairs = {pk.get_public_key_hex(compressed=True): (pk.get_secret_bytes(), True)
+                    for pk in privkeys}
+
+        def make_tx():
+            inputs = []
+            for i in range(40):
+                txin = PartialTxInput(prevout=TxOutpoint(txid=bytes([i + 1] * 32), out_idx=0))
+                txin.script_type = 'p2sh'
+                txin.pubkeys = pubkeys
+                txin.num_sig = 2
+                txin._trusted_value_sats = 100000
+                inputs.append(txin)
+            outputs = [PartialTxOutput.from_address_and_value('Xr58KiC2RvNN83LZExCoszE6mpAudBqQwK',
+                                                              3900000)]
+            return PartialTransaction.from_io(inputs, outputs)
+
+        tx1 = make_tx()
+        self.assertEqual(80, tx1.sign(keypairs))  # 2 of 3 keys per input
+        self.assertTrue(tx1.is_complete())
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            tx2 = make_tx()
+            first_pubkey = pubkeys[0].hex()
+            self.assertEqual(40, tx2.sign({first_pubkey: keypairs[first_pubkey]},
+                                          executor=executor))
+            self.assertFalse(tx2.is_complete())
+            self.assertEqual(40, tx2.sign(keypairs, executor=executor))
+        self.assertTrue(tx2.is_complete())
+        self.assertEqual(tx1.serialize(), tx2.serialize())
+
     def test_tx_setting_locktime_invalidates_ser_cache(self):
         tx = tx_from_any("cHNidP8BAHcCAAAAAWyCzM99I/2SycDZnPPayWZS+ZozSpSrJLBX4FyCL49fAAAAAAD9////AqCGAQAAAAAAGXapFAxqYK54d8H5ibtBejF2OcSVH+EdiKyMtg0AAAAAABl2qRT0diWoHck1vHoqzAb0wHM3lyaxqIis+m0cAAABAL8CAAAAAYiMLT9lasuCkktD+2wEV1saKygxkn/ADsANcDCOzva0AAAAAGpHMEQCIHmgjA6hnSE0uVVV2TaoECm+8lgsBBZ/5njPUSRnfkvlAiBTaJmXZV4OlDFv7kV41LYbo9EuSxcue27lUywe5IzMhgEhAjE9gvq9Vd1AIrfvDHDNSzGRcaH1wvRbD3Yo3zGr9Oez/v///wGHPQ8AAAAAABl2qRR3pG7tV/kiyeMvMTa1XuSA8BNvd4isirIYAAEHakcwRAIgENgIS8aA0P62J/6/Ckff0MIj3N/0BX7rthg/kOhCCLoCIFs0n4a6X0nYFHPh1s+PNEk1RUFt1hFJn9mdZaD/mxwzASECMT2C+r1V3UAit+8McM1LMZFxofXC9FsPdijfMav057MBCAEAACICAsoTK7g0VRAI452fKagixHpIJbRhm74S3qtRydyY44JADJxdDAAAAAAAAQAAAAAiAgL11TJWAb6PAWSoqtvVweiqhqrrWHUxIB3WHdzO78cL/QycXQwAAQAAAAAAAAAA")
         self.assertEqual("3e2e70b3e49c70b79784145ba83cbd0d699e6c92ebcc646329151614251351a0", tx.txid())
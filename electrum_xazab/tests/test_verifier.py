@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+import asyncio
+from types import SimpleNamespace
+
+from aiorpcx import RPCError
 
 from electrum_xazab.bitcoin import hash_encode
+from electrum_xazab.crypto import sha256d
 from electrum_xazab.transaction import Transaction
 from electrum_xazab.util import bfh
-from electrum_xazab.verifier import SPV, InnerNodeOfSpvProofIsValidTx
+from electrum_xazab.verifier import (SPV, InnerNodeOfSpvProofIsValidTx, BlockMerkleCache,
+                                     MerkleRootMismatch, verify_tx_is_in_block)
 
 from . import TestCaseForTestnet
 
@@ -48,3 +54,81 @@ class VerifierTestCase(TestCaseForTestnet):
         f_tx_hash = hash_encode(bfh(VALID_64_BYTE_TX[:64]))
         with self.assertRaises(InnerNodeOfSpvProofIsValidTx):
             SPV.hash_merkle_root(fake_mbranch, f_tx_hash, 6)
+
+
+def make_merkle_tree(txids):
+    """Return merkle root and branches of txids (as hex)"""
+    level = [bfh(txid)[::-1] for txid in txids]
+    branches = [[] for txid in txids]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        for i in range(len(txids)):
+            index = i >> len(branches[i])
+            branches[i].append(hash_encode(level[index ^ 1]))
+        level = [sha256d(level[i] + level[i+1]) for i in range(0, len(level), 2)]
+    return hash_encode(level[0]), branches
+
+
+class BlockMerkleCacheTestCase(TestCaseForTestnet):
+
+    def setUp(self):
+        super().setUp()
+        self.txids = [hash_encode(sha256d(bytes([i]))) for i in range(7)]
+        self.merkle_root, self.branches = make_merkle_tree(self.txids)
+        self.header = {'version': 0x20000000, 'prev_block_hash': '00' * 32,
+                       'merkle_root': self.merkle_root, 'timestamp': 1600000000,
+                       'bits': 0x207fffff, 'nonce': 0}
+
+    def test_verify_with_block_cache(self):
+        block_cache = BlockMerkleCache(self.merkle_root)
+        for pos, txid in enumerate(self.txids):
+            self.assertEqual(self.merkle_root,
+                             SPV.hash_merkle_root(self.branches[pos], txid, pos))
+            verify_tx_is_in_block(txid, self.branches[pos], pos, self.header, 10,
+                                  block_cache=block_cache)
+        # 4 + 2 + 1 inner nodes of a tree with 8 leaves
+        self.assertEqual(7, len(block_cache.nodes))
+        # bad proofs still fail, verified nodes are not replaced
+        nodes = dict(block_cache.nodes)
+        bad_branch = [self.branches[1][0]] + self.branches[2][1:]
+        with self.assertRaises(MerkleRootMismatch):
+            verify_tx_is_in_block(self.txids[2], bad_branch, 2, self.header, 10,
+                                  block_cache=block_cache)
+        self.assertEqual(nodes, block_cache.nodes)
+
+    def test_request_and_verify_proofs(self):
+        missing_txid = '00' * 32
+        merkles = [{'block_height': 10, 'pos': pos, 'merkle': self.branches[pos]}
+                   for pos in range(len(self.txids))]
+        txs = [(txid, 10) for txid in self.txids] + [(missing_txid, 10)]
+        verified = []
+        removed = []
+
+        async def get_merkles_for_transactions(requested):
+            self.assertEqual(txs, requested)
+            return merkles + [RPCError(1, 'not found')]
+        chain = SimpleNamespace(read_header=lambda height: self.header)
+        network = SimpleNamespace(asyncio_loop=asyncio.get_event_loop(),
+                                  interface=None,
+                                  get_merkles_for_transactions=get_merkles_for_transactions,
+                                  bhi_lock=asyncio.Lock(),
+                                  blockchain=lambda: chain,
+                                  config={})
+        wallet = SimpleNamespace(diagnostic_name=lambda: 'test_wallet',
+                                 add_verified_txs=verified.append,
+                                 remove_unverified_tx=lambda *args: removed.append(args))
+        spv = SPV(network, wallet)
+        spv.requested_merkle.update(txid for txid, height in txs)
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(spv._request_and_verify_proofs(txs))
+        finally:
+            loop.run_until_complete(spv.stop())
+
+        self.assertEqual(1, len(verified))
+        self.assertEqual(self.txids, list(verified[0]))
+        self.assertEqual(list(range(7)), [info.txpos for info in verified[0].values()])
+        self.assertEqual([(missing_txid, 10)], removed)
+        self.assertEqual(set(), spv.requested_merkle)
+        self.assertEqual(1, len(spv.block_merkle_caches))
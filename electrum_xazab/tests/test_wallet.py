@@ -7,8 +7,9 @@ from decimal import Decimal
 import time
 from io import StringIO
 import asyncio
+from unittest import mock
 
-from electrum_xazab.storage import WalletStorage
+from electrum_xazab.storage import WalletStorage, StorageEncryptionVersion
 from electrum_xazab.wallet_db import FINAL_SEED_VERSION
 from electrum_xazab.wallet import (Abstract_Wallet, Standard_Wallet, create_new_wallet,
                              restore_wallet_from_text, Imported_Wallet, Wallet)
@@ -17,7 +18,9 @@ from electrum_xazab.util import TxMinedInfo, InvalidPassword
 from electrum_xazab.bitcoin import COIN
 from electrum_xazab.wallet_db import WalletDB
 from electrum_xazab.simple_config import SimpleConfig
-from electrum_xazab import util
+from electrum_xazab import util, keystore
+from electrum_xazab.bip32 import BIP32Node
+from electrum_xazab.transaction import TxOutpoint
 
 from . import ElectrumTestCase
 
@@ -85,6 +88,97 @@ class TestWalletStorage(WalletTestCase):
         for key, value in some_dict.items():
             self.assertEqual(d[key], value)
 
+    def _create_db_with_journal(self, password=None):
+        storage = WalletStorage(self.wallet_path)
+        if password:
+            storage.set_password(password, StorageEncryptionVersion.USER_PASSWORD)
+        db = WalletDB('', manual_upgrades=True)
+        db.put('a', {'x': 1, 'y': 2})
+        db.write(storage)
+        storage.use_journal = True
+        return storage, db
+
+    def _load_db(self, password=None):
+        storage = WalletStorage(self.wallet_path)
+        if password:
+            storage.decrypt(password)
+        return storage, WalletDB(storage.read(), manual_upgrades=True,
+                                 journal=storage.read_journal())
+
+    def test_journal_append_and_replay(self):
+        storage, db = self._create_db_with_journal()
+        with open(self.wallet_path, "r") as f:
+            snapshot = f.read()
+        db.get('a')['x'] = 3
+        db.get('a').pop('y')
+        db.put('b', 'c')
+        db.write(storage)
+        db.get_dict('addresses')['receiving'] = ['addr1']
+        db.write(storage)
+        db.load_addresses('standard')
+        db.add_receiving_address('addr2')
+        db.write(storage)
+        with open(self.wallet_path, "r") as f:
+            self.assertEqual(snapshot, f.read())
+        self.assertEqual(3, len(storage.read_journal()))
+
+        storage2, db2 = self._load_db()
+        self.assertEqual({'x': 3}, db2.get('a'))
+        self.assertEqual('c', db2.get('b'))
+        self.assertEqual(['addr1', 'addr2'], db2.get('addresses')['receiving'])
+
+    def test_journal_prevouts_by_scripthash(self):
+        storage, db = self._create_db_with_journal()
+        sh = '00' * 32
+        prevout0 = TxOutpoint(bytes(32), 0)
+        prevout1 = TxOutpoint(bytes(32), 1)
+        db.add_prevout_by_scripthash(sh, prevout=prevout0, value=1000)
+        db.write(storage)
+        db.add_prevout_by_scripthash(sh, prevout=prevout1, value=2000)
+        db.write(storage)
+        self.assertEqual(2, len(storage.read_journal()))
+        storage2, db2 = self._load_db()
+        self.assertEqual({(prevout0, 1000), (prevout1, 2000)},
+                         db2.get_prevouts_by_scripthash(sh))
+
+        db.remove_prevout_by_scripthash(sh, prevout=prevout0, value=1000)
+        db.write(storage)
+        storage3, db3 = self._load_db()
+        self.assertEqual({(prevout1, 2000)},
+                         db3.get_prevouts_by_scripthash(sh))
+
+    def test_journal_compaction(self):
+        storage, db = self._create_db_with_journal()
+        db.get('a')['x'] = 3
+        db.write(storage)
+        storage.compact_journal()
+        self.assertFalse(os.path.exists(storage.journal_path))
+        self.assertEqual([], storage.read_journal())
+        with open(self.wallet_path, "r") as f:
+            self.assertEqual({'x': 3, 'y': 2}, json.loads(f.read())['a'])
+        # replaying journal already contained in snapshot is a no-op
+        db.get('a')['z'] = 4
+        db.write(storage)
+        storage2, db2 = self._load_db()
+        self.assertEqual({'x': 3, 'y': 2, 'z': 4}, db2.get('a'))
+
+    def test_journal_encrypted(self):
+        password = 'secret'
+        storage, db = self._create_db_with_journal(password)
+        db.get('a')['x'] = 3
+        db.write(storage)
+        with open(storage.journal_path, "r") as f:
+            self.assertNotIn('"x"', f.read())
+        storage2, db2 = self._load_db(password)
+        self.assertEqual({'x': 3, 'y': 2}, db2.get('a'))
+        # password change writes whole db and removes journal
+        storage.set_password('other', StorageEncryptionVersion.USER_PASSWORD)
+        db.get('a')['x'] = 5
+        db.write(storage)
+        self.assertFalse(os.path.exists(storage.journal_path))
+        storage3, db3 = self._load_db('other')
+        self.assertEqual({'x': 5, 'y': 2}, db3.get('a'))
+
 class FakeExchange(ExchangeBase):
     def __init__(self, rate):
         super().__init__(lambda self: None, lambda self: None)
@@ -296,3 +390,68 @@ class TestWalletPassword(WalletTestCase):
         with self.assertRaises(InvalidPassword):
             wallet.check_password("wrong password")
         wallet.check_password("1234")
+
+
+class TestKeystoreBulkDerivation(ElectrumTestCase):
+
+    xprv = ('xprv9s21ZrQH143K3QTDL4LXw2F7HEK3wJUD2nW2nRk4stbPy6cq3jPP'
+            'qjiChkVvvNKmPGJxWUtg6LnF5kejMRNNU3TGtRBeJgk33yuGBxrMPHi')
+
+    def test_derive_pubkeys(self):
+        ks = keystore.from_xprv(self.xprv)
+        ks2 = keystore.from_xprv(self.xprv)
+        rootnode = BIP32Node.from_xkey(self.xprv)
+        for for_change in (0, 1):
+            pubkeys = ks.derive_pubkeys(for_change, range(5))
+            self.assertEqual([ks2.derive_pubkey(for_change, n) for n in range(5)], pubkeys)
+            self.assertEqual([rootnode.subkey_at_private_derivation((for_change, n))
+                              .eckey.get_public_key_bytes() for n in range(5)], pubkeys)
+        self.assertEqual(10, len(ks._derived_pubkeys))
+        # cached and new pubkeys mixed
+        self.assertEqual([ks2.derive_pubkey(0, 3), ks2.derive_pubkey(0, 7)],
+                         ks.derive_pubkeys(0, [3, 7]))
+
+    def test_derived_pubkeys_cache_bounded(self):
+        ks = keystore.from_xprv(self.xprv)
+        with mock.patch.object(keystore, 'DERIVED_PUBKEYS_CACHE_SIZE', 3):
+            ks_small = keystore.from_xprv(self.xprv)
+        pubkeys = ks_small.derive_pubkeys(0, range(10))
+        self.assertEqual(3, len(ks_small._derived_pubkeys))
+        self.assertEqual(ks.derive_pubkeys(0, range(10)), pubkeys)
+
+    def test_get_private_keys(self):
+        ks = keystore.from_xprv(self.xprv)
+        ks.update_password(None, 'pw')
+        sequences = [(0, 0), (1, 2), (0, 5), (1, 0)]
+        self.assertEqual([ks.get_private_key(seq, 'pw') for seq in sequences],
+                         ks.get_private_keys(sequences, 'pw'))
+        with self.assertRaises(InvalidPassword):
+            ks.get_private_keys(sequences, 'wrong')
+
+    def test_ps_keystore_derivations(self):
+        ks_d = keystore.from_xprv(self.xprv).dump()
+        ks_d['type'] = 'ps_bip32'
+        ks_d['addr_deriv_offset'] = 2
+        ps_ks = keystore.load_keystore({'ps_keystore': ks_d}, 'ps_keystore')
+        ks = keystore.from_xprv(self.xprv)
+        for for_change in (0, 1):
+            self.assertEqual(ks.derive_pubkeys(4 + for_change, range(3)),
+                             ps_ks.derive_pubkeys(for_change, range(3)))
+            self.assertEqual(ks.derive_pubkey(4 + for_change, 2),
+                             ps_ks.derive_pubkey(for_change, 2))
+        sequences = [(0, 1), (1, 1)]
+        self.assertEqual(ks.get_private_keys([(4, 1), (5, 1)], None),
+                         ps_ks.get_private_keys(sequences, None))
+        self.assertEqual(ks.get_private_key((5, 1), None),
+                         ps_ks.get_private_key((1, 1), None))
+
+    def test_old_keystore(self):
+        seed = 'powerful random nobody notice nothing important anyway look away hidden message over'
+        ks = keystore.from_seed(seed, '', False)
+        self.assertIsInstance(ks, keystore.Old_KeyStore)
+        sequences = [(0, 0), (1, 3)]
+        self.assertEqual([ks.get_private_key(seq, None) for seq in sequences],
+                         ks.get_private_keys(sequences, None))
+        self.assertEqual([ks.derive_pubkey(0, n) for n in range(3)],
+                         ks.derive_pubkeys(0, range(3)))
+        self.assertEqual(3, len(ks._derived_pubkeys))
@@ -1,5 +1,10 @@
 import json
+import os
+import shutil
+import tempfile
 
+from electrum_xazab.sqlite_db import SharedTxCache
+from electrum_xazab.transaction import Transaction, TxOutpoint
 from electrum_xazab.wallet_db import WalletDB, FINAL_SEED_VERSION
 
 from . import SequentialTestCase
@@ -40,3 +45,126 @@ class WalletDBTestCase(SequentialTestCase):
         del d['x1/']
         db = WalletDB(json.dumps(d), manual_upgrades=False)
         assert not db.check_unfinished_multisig()  # x2/, x3/ fails
+
+
+class SqliteTxStoreTestCase(SequentialTestCase):
+
+    RAW_TX = ('01000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031000000006c493046022100a82bbc57a0'
+              '136751e5433f41cf000b3f1a99c6744775e76ec764fb78c54ee100022100f9e80b7de89de861dc6fb0c1429d5da72c2b6b2ee2406bc9'
+              'bfb1beedd729d985012102e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84d2f6ffffffff0140420f0000000000'
+              '1976a914230ac37834073a42146f11ef8414ae929feaafc388ac00000000')
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'wallet.sqlite')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def _fill_db(self, db):
+        tx = Transaction(self.RAW_TX)
+        txid = tx.txid()
+        db.load_addresses('standard')
+        db.add_receiving_address('addr1')
+        db.add_txo_addr(txid, 'addr1', 0, 2000000, False)
+        db.add_txi_addr(txid, 'addr1', 'aa' * 32 + ':1', 3000000)
+        db.add_transaction(txid, tx)
+        db.set_spent_outpoint('bb' * 32, 1, txid)
+        db.set_addr_history('addr1', [(txid, 100)])
+        db.add_prevout_by_scripthash('cc' * 32, prevout=TxOutpoint.from_str('aa' * 32 + ':1'),
+                                     value=3000000)
+        return txid
+
+    def _check_db(self, db, txid):
+        self.assertEqual(['addr1'], db.get_txo_addresses(txid))
+        self.assertEqual({0: (2000000, False)}, db.get_txo_addr(txid, 'addr1'))
+        self.assertEqual([('aa' * 32 + ':1', 3000000)], db.get_txi_addr(txid, 'addr1'))
+        self.assertEqual(1, db.get_num_ismine_inputs_of_tx(txid))
+        self.assertEqual(txid, db.get_transaction(txid).txid())
+        self.assertEqual([txid], db.list_transactions())
+        self.assertEqual(txid, db.get_spent_outpoint('bb' * 32, 1))
+        self.assertEqual([(txid, 100)], [tuple(h) for h in db.get_addr_history('addr1')])
+        self.assertEqual({(TxOutpoint.from_str('aa' * 32 + ':1'), 3000000)},
+                         db.get_prevouts_by_scripthash('cc' * 32))
+
+    def test_convert_both_ways(self):
+        db = WalletDB('', manual_upgrades=False)
+        txid = self._fill_db(db)
+        db.convert_tx_store_to_sqlite(self.path)
+        self.assertTrue(db.uses_sqlite_tx_store())
+        self.assertNotIn('txi', db.data)
+        self._check_db(db, txid)
+
+        # reopen from dumped json and sqlite file
+        db._tx_store.commit()
+        db2 = WalletDB(db.dump(), manual_upgrades=False)
+        db2.load_addresses('standard')
+        db2.open_sqlite_tx_store(self.path)
+        self._check_db(db2, txid)
+
+        db2.convert_tx_store_to_json()
+        self.assertFalse(db2.uses_sqlite_tx_store())
+        db3 = WalletDB(db2.dump(), manual_upgrades=False)
+        db3.load_addresses('standard')
+        self._check_db(db3, txid)
+
+
+class SharedTxCacheTestCase(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'tx_cache.sqlite')
+        self.raw_txs = {}
+        for i in range(10):
+            raw = ('01000000' '01' + (i + 1).to_bytes(32, 'little').hex() + '00000000'
+                   '00' 'ffffffff' '01' + (100000 + i).to_bytes(8, 'little').hex()
+                   + '19' '76a914' + '11' * 20 + '88ac' '00000000')
+            self.raw_txs[Transaction(raw).txid()] = raw
+        self.tx_size = len(bytes.fromhex(raw))
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_add(self):
+        cache = SharedTxCache(self.path, 100 * self.tx_size)
+        txids = list(self.raw_txs)
+        self.assertIsNone(cache.get(txids[0]))
+        for txid in txids[:3]:
+            cache.add(txid, self.raw_txs[txid])
+        cache.add(txids[0], self.raw_txs[txids[0]])
+        self.assertEqual(self.raw_txs[txids[1]], cache.get(txids[1]))
+        self.assertEqual(3, len(cache))
+        self.assertEqual(3 * self.tx_size, cache.get_size())
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        cache.close()
+        # persisted
+        cache = SharedTxCache(self.path, 100 * self.tx_size)
+        self.assertEqual(3 * self.tx_size, cache.get_size())
+        self.assertEqual(self.raw_txs[txids[2]], cache.get(txids[2]))
+        # not returned if it does not match txid
+        cache.add(txids[3], self.raw_txs[txids[4]])
+        self.assertIsNone(cache.get(txids[3]))
+        self.assertEqual(3, len(cache))
+        cache.close()
+
+    def test_lru_eviction(self):
+        cache = SharedTxCache(self.path, 5 * self.tx_size)
+        txids = list(self.raw_txs)
+        for txid in txids[:5]:
+            cache.add(txid, self.raw_txs[txid])
+        # used recently, so not evicted
+        self.assertIsNotNone(cache.get(txids[0]))
+        cache.add(txids[5], self.raw_txs[txids[5]])
+        # evicted down to 90% of max size
+        self.assertEqual(4, len(cache))
+        self.assertEqual(2, cache.evicted)
+        self.assertIsNone(cache.get(txids[1]))
+        self.assertIsNone(cache.get(txids[2]))
+        for txid in [txids[0], txids[3], txids[4], txids[5]]:
+            self.assertEqual(self.raw_txs[txid], cache.get(txid))
+        cache.close()
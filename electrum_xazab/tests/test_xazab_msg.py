@@ -2,9 +2,11 @@ from ipaddress import IPv6Address
 
 from electrum_xazab.xazab_msg import (XazabVersionMsg, XazabDsaMsg, XazabDssuMsg,
                                     XazabDsqMsg, XazabDsiMsg, XazabDsfMsg,
-                                    XazabDssMsg, XazabDscMsg)
+                                    XazabDssMsg, XazabDscMsg, XazabCmd,
+                                    XazabInvMsg, XazabInventory, XazabType,
+                                    XazabMsgError)
 from electrum_xazab.xazab_tx import TxOutPoint, CTxIn, CTxOut
-from electrum_xazab.transaction import Transaction
+from electrum_xazab.transaction import Transaction, SerializationError
 from electrum_xazab.util import bfh, bh2u
 
 from . import TestCaseForTestnet
@@ -58,6 +60,46 @@ class TestXazabMsg(TestCaseForTestnet):
         assert len(msg.vchSig) == 96
         assert bh2u(msg.serialize()) == DSQ_MSG
 
+    def test_cmd_lazy_payload(self):
+        cmd = XazabCmd('DSQ', bfh(DSQ_MSG))
+        assert cmd.cmd == 'dsq'
+        assert not cmd._decoded
+        assert cmd.dsq_ready
+        assert not cmd._decoded
+        assert cmd.payload.fReady
+        assert cmd.payload is cmd.payload
+        assert bh2u(cmd.payload.serialize()) == DSQ_MSG
+
+        inventory = [XazabInventory(XazabType.MSG_ISLOCK, bytes([i]) * 32)
+                     for i in range(1, 256)]
+        cmd = XazabCmd('inv', XazabInvMsg(inventory).serialize())
+        assert list(cmd.inv_items()) == [tuple(i) for i in inventory]
+        assert not cmd._decoded
+        assert cmd.payload.inventory == inventory
+
+        islock = (bytes([2]) + bytes([1]) * 36 + bytes([2]) * 36
+                  + bytes([3]) * 32 + bytes([4]) * 96)
+        cmd = XazabCmd('islock', islock)
+        assert cmd.islock_txid == bytes([3]) * 32
+        assert not cmd._decoded
+        assert cmd.payload.txid == cmd.islock_txid
+        assert len(cmd.payload.inputs) == 2
+
+        cmd = XazabCmd('islock', islock[:-97])
+        with self.assertRaises(SerializationError):
+            cmd.islock_txid
+
+        cmd = XazabCmd('headers', b'\x00')
+        assert cmd.payload == b'\x00'
+
+        errors = []
+        cmd = XazabCmd('dsq', bfh(DSQ_MSG)[:-10],
+                       on_decode_error=lambda c, e: errors.append((c, e)))
+        with self.assertRaises(XazabMsgError):
+            cmd.payload
+        assert len(errors) == 1 and errors[0][0] is cmd
+        assert not cmd._decoded
+
     def test_dsi_msg(self):
         msg = XazabDsiMsg.from_hex(DSI_MSG)
         assert len(msg.vecTxDSIn) == 2
@@ -0,0 +1,307 @@
+import asyncio
+import gc
+import time
+import weakref
+from collections import deque, namedtuple
+from types import SimpleNamespace
+from unittest import mock
+
+from bls_py import bls
+
+from electrum_xazab.simple_config import SimpleConfig
+from electrum_xazab.util import bh2u
+from electrum_xazab.xazab_msg import XazabISLockMsg
+from electrum_xazab.xazab_net import XazabNet, XazabRecentISLocks, IS_LLMQ_TYPE
+from electrum_xazab.xazab_ps_net import PSMixCoordinator, PSDenoms
+from electrum_xazab.xazab_tx import TxOutPoint
+
+from . import ElectrumTestCase
+
+
+Quorum = namedtuple('Quorum', 'llmqType quorumHash quorumPublicKey')
+
+
+class FakeMNList:
+
+    def __init__(self, quorums):
+        self.quorums = quorums
+
+    def calc_responsible_quorum(self, llmqType, request_id):
+        return self.quorums[request_id[0] % len(self.quorums)]
+
+
+class FakeNetwork:
+
+    def __init__(self, mn_list, config):
+        self.mn_list = mn_list
+        self.config = config
+        self.asyncio_loop = asyncio.get_event_loop()
+        self._loop_thread = None
+
+
+Dsq = namedtuple('Dsq', 'nDenom masternodeOutPoint nTime')
+SMLEntry = namedtuple('SMLEntry', 'ipAddress port')
+
+
+class FakeSMLMNList:
+
+    def get_mn_by_outpoint(self, outpoint):
+        if outpoint.startswith('mn'):
+            return SMLEntry(f'127.0.0.{outpoint[2:]}', 9999)
+
+
+class FakePeer:
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.mix_session = None
+        self.closed = False
+
+    def is_open(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMixingXazabNet:
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.network = SimpleNamespace(mn_list=FakeSMLMNList())
+        self.opened = []
+
+    async def run_mixing_peer(self, peer, sml_entry, mix_session):
+        xazab_peer = FakePeer(peer)
+        xazab_peer.mix_session = mix_session
+        self.opened.append(xazab_peer)
+        return xazab_peer
+
+
+class FakePSManager:
+
+    def __init__(self, name):
+        self.wallet = SimpleNamespace(diagnostic_name=lambda: name)
+        self.recent_mixes_mns = deque([], 10)
+
+
+class TestXazabNetIslocks(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sks = [bls.PrivateKey.from_seed(bytes([i]) * 32) for i in range(3)]
+        self.quorums = [Quorum(IS_LLMQ_TYPE, bytes([i]) * 32,
+                               sk.get_public_key().serialize())
+                        for i, sk in enumerate(self.sks[:2])]
+        config = SimpleConfig({'electrum_path': self.electrum_path})
+        network = FakeNetwork(FakeMNList(self.quorums), config)
+        self.xazab_net = XazabNet(network, config)
+
+    def make_islock(self, i, sk=None):
+        islock = XazabISLockMsg([TxOutPoint(bytes([i]) * 32, i)],
+                                bytes([i]) * 32, None)
+        request_id = islock.calc_request_id()
+        quorum = self.xazab_net.network.mn_list.calc_responsible_quorum(
+            IS_LLMQ_TYPE, request_id)
+        if sk is None:
+            sk = self.sks[self.quorums.index(quorum)]
+        msg_hash = islock.msg_hash(quorum, request_id)
+        islock.sig = sk.sign_prehashed(msg_hash).serialize()
+        return islock
+
+    def test_verify_islocks_batch(self):
+        xazab_net = self.xazab_net
+        islocks = [self.make_islock(i) for i in range(1, 5)]
+        bad_islock = self.make_islock(5, sk=self.sks[2])
+        bad_txid = bh2u(bad_islock.txid[::-1])
+        islocks.insert(2, bad_islock)
+        txids = [bh2u(islock.txid[::-1]) for islock in islocks]
+
+        verified = xazab_net.verify_islocks_batch(islocks)
+        self.assertEqual(set(txids) - {bad_txid}, set(verified))
+        self.assertEqual(4, len(xazab_net.recent_islocks))
+        self.assertEqual([], xazab_net.recent_islocks.get(bad_txid))
+        for txid in txids:
+            self.assertEqual(txid != bad_txid,
+                             xazab_net.verify_on_recent_islocks(txid))
+
+    def test_verify_only_wanted_islocks_eagerly(self):
+        xazab_net = self.xazab_net
+        islocks = [self.make_islock(i) for i in range(1, 4)]
+        txids = [bh2u(islock.txid[::-1]) for islock in islocks]
+        scheduled = []
+        xazab_net.verify_pending_islocks = lambda: scheduled.append(1)
+        wanted = {txids[0]}
+        xazab_net.register_islock_wanted_check(lambda txid: txid in wanted)
+        with mock.patch('asyncio.run_coroutine_threadsafe'):
+            for islock in islocks:
+                xazab_net.append_to_recent_islocks(islock)
+        # only islock for wallet txid is queued for verification
+        self.assertEqual([islocks[0]], xazab_net.pending_islocks)
+        self.assertEqual(1, len(scheduled))
+        self.assertEqual(2, len(xazab_net.unverified_islocks))
+        self.assertEqual(0, len(xazab_net.recent_islocks))
+        # others verified lazily when wallet gets the tx
+        self.assertTrue(xazab_net.verify_on_recent_islocks(txids[1]))
+        self.assertEqual(1, len(xazab_net.recent_islocks))
+        self.assertTrue(xazab_net.recent_islocks.has_islock(txids[1]))
+        self.assertFalse(xazab_net.recent_islocks.has_islock(txids[2]))
+
+    def test_verify_islocks_aggregated(self):
+        islocks = [self.make_islock(i) for i in range(2, 8, 2)]
+        mn_list = self.xazab_net.network.mn_list
+        entries = []
+        for islock in islocks:
+            request_id = islock.calc_request_id()
+            quorum = mn_list.calc_responsible_quorum(IS_LLMQ_TYPE, request_id)
+            entries.append((None, None, islock, quorum, request_id))
+        self.assertEqual(1, len(set(e[3] for e in entries)))
+        self.assertTrue(XazabNet.verify_islocks_aggregated(entries))
+        # duplicate msgs are not verified by aggregated sig
+        self.assertFalse(XazabNet.verify_islocks_aggregated(entries + entries[:1]))
+        islocks[1].sig = islocks[0].sig
+        self.assertFalse(XazabNet.verify_islocks_aggregated(entries))
+
+    def test_recent_islocks_expiry(self):
+        recent = XazabRecentISLocks(keep_sec=100)
+        recent.add('a', 'islock_a1', None, None, t=1000)
+        recent.add('b', 'islock_b', None, None, t=1010)
+        recent.add('a', 'islock_a2', None, None, t=1050)
+        self.assertEqual(3, len(recent))
+        self.assertEqual(['islock_a1', 'islock_a2'],
+                         [e[1] for e in recent.get('a')])
+        recent.expire(now=1105)
+        self.assertEqual(['islock_a2'], [e[1] for e in recent.get('a')])
+        self.assertEqual(['islock_b'], [e[1] for e in recent.get('b')])
+        recent.expire(now=1115)
+        self.assertEqual([], recent.get('b'))
+        self.assertEqual(1, len(recent))
+        stats = recent.as_dict()
+        self.assertEqual(1, stats['txids'])
+        self.assertEqual(3, stats['added'])
+        self.assertEqual(2, stats['expired'])
+        self.assertFalse(recent.has_islock('a'))  # expired at current time
+        self.assertEqual(1, recent.as_dict()['misses'])
+        recent.add('c', 'islock_c', None, None)
+        self.assertTrue(recent.has_islock('c'))
+        self.assertEqual(1, recent.as_dict()['hits'])
+
+
+class TestPSMixCoordinator(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.get_event_loop()
+        self.xazab_net = FakeMixingXazabNet(self.loop)
+        self.coordinator = PSMixCoordinator(self.xazab_net)
+
+    def test_dsq_assigned_fairly(self):
+        coordinator = self.coordinator
+        now = int(time.time())
+        psman1 = FakePSManager('w1')
+        psman2 = FakePSManager('w2')
+        d1 = int(PSDenoms.D1)
+        d10 = int(PSDenoms.D10)
+        assert coordinator.get_dsq(psman1, {d1}) is None
+        assert coordinator.get_dsq(psman2, {d1, d10}) is None
+        assert len(coordinator.waiting) == 2
+
+        dsq1 = Dsq(d1, 'mn1', now)
+        assert coordinator.add_dsq(dsq1)
+        assert not coordinator.add_dsq(dsq1)  # duplicate
+        assert not coordinator.add_dsq(Dsq(3, 'mn9', now))  # bad nDenom
+        # psman1 waits longer, dsq1 is reserved for it
+        assert coordinator.get_dsq(psman2, {d1, d10}) is None
+        assert coordinator.get_dsq(psman1, {d1}) == dsq1
+        assert psman1 not in coordinator.waiting
+
+        dsq2 = Dsq(d10, 'mn2', now)
+        dsq3 = Dsq(d1, 'mn3', now)
+        coordinator.add_dsq(Dsq(d1, 'mn4', now - 60))  # expired
+        coordinator.add_dsq(Dsq(d1, 'unknown', now))  # unknown masternode
+        coordinator.add_dsq(dsq2)
+        coordinator.add_dsq(dsq3)
+        # psman2 is not served yet, psman1 gets not suitable for psman2 dsq
+        coordinator.waiting[psman2] = (now - 10, psman2.recent_mixes_mns,
+                                       {d10})
+        assert coordinator.get_dsq(psman1, {d1}) == dsq3
+        assert coordinator.get_dsq(psman2, {d1, d10}) == dsq2
+        assert len(coordinator.recent_dsq) == 0
+        assert coordinator.dsq_cnt == {'added': 5, 'assigned': 3,
+                                       'expired': 2}
+
+        # recently used or active masternode are not suitable
+        dsq4 = Dsq(d1, 'mn1', now + 1)
+        coordinator.add_dsq(dsq4)
+        psman1.recent_mixes_mns.append('127.0.0.1:9999')
+        assert coordinator.get_dsq(psman1, {d1}) is None
+        coordinator.active_mns['127.0.0.1:9999'] = psman1
+        assert coordinator.get_dsq(psman2, {d1}) is None
+        del coordinator.active_mns['127.0.0.1:9999']
+        coordinator.stop_waiting(psman1)
+        assert coordinator.get_dsq(psman2, {d1}) == dsq4
+
+    def test_unregister_releases_psman(self):
+        coordinator = self.coordinator
+        now = int(time.time())
+        d1 = int(PSDenoms.D1)
+        psman1 = FakePSManager('w1')
+        psman2 = FakePSManager('w2')
+        coordinator.add_dsq(Dsq(d1, 'mn1', now))
+        assert coordinator.get_dsq(psman1, {d1}) is not None
+        assert coordinator.get_dsq(psman2, {d1}) is None
+        assert psman1 in coordinator.last_served
+        psman1_ref = weakref.ref(psman1)
+        coordinator.unregister(psman1)
+        coordinator.unregister(psman2)
+        assert coordinator.waiting == {}
+        assert coordinator.last_served == {}
+        del psman1
+        gc.collect()
+        assert psman1_ref() is None
+
+    def test_mixing_peers_reuse_and_stats(self):
+        coordinator = self.coordinator
+        psman1 = FakePSManager('w1')
+        psman2 = FakePSManager('w2')
+        peer_str = '127.0.0.1:9999'
+
+        async def run_session(psman, completed):
+            sess = SimpleNamespace(peer_str=peer_str, start_time=time.time(),
+                                   completed=False)
+            coordinator.on_session_started(psman, sess)
+            assert coordinator.is_mn_active(peer_str)
+            xazab_peer = await coordinator.get_mixing_peer(peer_str, None, sess)
+            assert xazab_peer.mix_session is sess
+            sess.completed = completed
+            coordinator.release_mixing_peer(xazab_peer, reuse=sess.completed)
+            coordinator.on_session_finished(psman, sess)
+            return xazab_peer
+
+        async def run():
+            peer1 = await run_session(psman1, True)
+            assert peer1.mix_session is None
+            assert not coordinator.is_mn_active(peer_str)
+            peer2 = await run_session(psman2, False)
+            assert peer2 is peer1  # idle connection reused
+            assert peer2.closed
+            peer3 = await run_session(psman1, True)
+            assert peer3 is not peer1
+            return peer3
+
+        peer3 = self.loop.run_until_complete(run())
+        assert coordinator.peers_cnt == {'opened': 2, 'reused': 1}
+        assert coordinator.idle_peers[peer_str][0] is peer3
+        coordinator.close_idle_peers()
+        assert peer3.closed
+        assert coordinator.idle_peers == {}
+
+        stats = coordinator.as_dict()
+        assert stats['sessions'] == 3
+        assert stats['completed_sessions'] == 2
+        assert stats['active_sessions'] == 0
+        assert stats['wallets'] == {'w1': {'sessions': 2, 'completed': 2},
+                                    'w2': {'sessions': 1, 'completed': 0}}
+        assert stats['sessions_per_hour'] > 0
+        coordinator.sessions[0] = (0, 0, 'w1', True)  # older than hour
+        assert coordinator.as_dict()['sessions'] == 2
@@ -0,0 +1,163 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from electrum_xazab.simple_config import SimpleConfig
+from electrum_xazab.xazab_msg import XazabCmd, XazabMsgError
+from electrum_xazab.xazab_net import XazabMsgStats
+from electrum_xazab.xazab_peer import XazabPeer, MSG_QUEUES
+
+from . import ElectrumTestCase
+
+
+class MockTaskGroup:
+
+    async def spawn(self, coro):
+        coro.close()  # peer connection is not run in tests
+
+
+class TestXazabPeerMsgsDispatch(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.get_event_loop()
+        config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.msg_stats = XazabMsgStats()
+        xazab_net = SimpleNamespace(
+            default_port=9999, start_str=b'\xCE\xE2\xCA\xFF',
+            network=SimpleNamespace(config=config), loop=self.loop,
+            main_taskgroup=MockTaskGroup(), msg_stats=self.msg_stats)
+        self.xazab_peer = xazab_peer = XazabPeer(xazab_net, '127.0.0.1:9999',
+                                                 proxy=None)
+        self.handled = []
+        for cmd in xazab_peer.msg_handlers:
+            xazab_peer.msg_handlers[cmd] = self.on_msg
+        self.read_msgs = asyncio.Queue()
+        xazab_peer.read_next_msg = self.read_msgs.get
+
+    async def on_msg(self, res):
+        if res.cmd == 'spork' and res.payload == 'bad':
+            raise Exception('bad spork')
+        self.handled.append((res.cmd, res.payload))
+
+    def add_queues(self, size=10):
+        queues = {}
+        for queue_name in sorted(set(MSG_QUEUES.values())):
+            queues[queue_name] = asyncio.Queue(size)
+        self.xazab_peer.msg_queues = queues
+        return queues
+
+    def read(self, cmd, payload=None):
+        self.read_msgs.put_nowait(SimpleNamespace(cmd=cmd, payload=payload))
+
+    async def run_for(self, coros, secs=0.05):
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        await asyncio.sleep(secs)
+        for task in tasks:
+            task.cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def test_routing_to_queues(self):
+        queues = self.add_queues()
+        for cmd in ['ping', 'inv', 'islock', 'dsq', 'dssu', 'headers', 'inv']:
+            self.read(cmd)
+        self.loop.run_until_complete(
+            self.run_for([self.xazab_peer.process_msgs()]))
+        self.assertEqual(1, queues['control'].qsize())
+        self.assertEqual(2, queues['inv'].qsize())
+        self.assertEqual(1, queues['islock'].qsize())
+        self.assertEqual(2, queues['ds'].qsize())
+        self.assertEqual(0, queues['spork'].qsize())
+        received_at, res = queues['ds'].get_nowait()
+        self.assertEqual('dsq', res.cmd)
+        stats = self.msg_stats.as_dict()
+        self.assertEqual(2, stats['inv']['received'])
+        self.assertEqual(1, stats['headers']['ignored'])  # no queue for cmd
+        self.assertEqual(0, stats['ping']['handled'])
+
+        # each queue is handled separately, msgs of one queue in order
+        self.read_msgs = asyncio.Queue()
+        handlers = [self.xazab_peer.handle_msgs(q) for q in queues.values()]
+        self.loop.run_until_complete(self.run_for(handlers))
+        self.assertEqual(['dssu', 'inv', 'inv', 'islock', 'ping'],
+                         sorted(cmd for cmd, payload in self.handled))
+        stats = self.msg_stats.as_dict()
+        self.assertEqual(2, stats['inv']['handled'])
+        self.assertEqual(1, stats['ping']['handled'])
+        self.assertEqual(2, sum(stats['inv']['latency_hist_ms'].values()))
+        self.assertIsNotNone(stats['inv']['latency_avg_ms'])
+
+    def test_backpressure_on_full_queue(self):
+        queues = self.add_queues(size=2)
+        for i in range(5):
+            self.read('islock', i)
+        self.read('inv')
+
+        async def run():
+            reader = asyncio.ensure_future(self.xazab_peer.process_msgs())
+            await asyncio.sleep(0.05)
+            # reading blocked on third islock, inv is not read yet
+            self.assertEqual(2, queues['islock'].qsize())
+            self.assertEqual(0, queues['inv'].qsize())
+            self.assertEqual(1, self.msg_stats.as_dict()['islock']['queue_full'])
+            handler = asyncio.ensure_future(
+                self.xazab_peer.handle_msgs(queues['islock']))
+            await asyncio.sleep(0.05)
+            for task in (reader, handler):
+                task.cancel()
+            await asyncio.gather(reader, handler, return_exceptions=True)
+        self.loop.run_until_complete(run())
+        self.assertEqual([('islock', i) for i in range(5)], self.handled)
+        self.assertEqual(1, queues['inv'].qsize())
+        self.assertEqual(5, self.msg_stats.as_dict()['islock']['handled'])
+
+    def test_handler_exception(self):
+        queues = self.add_queues()
+        self.read('spork', 'good')
+        self.read('spork', 'bad')
+        self.read('spork', 'next')
+        self.loop.run_until_complete(
+            self.run_for([self.xazab_peer.process_msgs()]))
+        # handler exception stops msgs handling, it disconnects the peer
+        with self.assertRaises(Exception) as ctx:
+            self.loop.run_until_complete(
+                self.xazab_peer.handle_msgs(queues['spork']))
+        self.assertEqual('bad spork', str(ctx.exception))
+        self.assertEqual([('spork', 'good')], self.handled)
+        stats = self.msg_stats.as_dict()['spork']
+        self.assertEqual(3, stats['received'])
+        self.assertEqual(1, stats['handled'])
+        self.assertEqual(1, queues['spork'].qsize())
+
+    def test_malformed_payload_closes_peer(self):
+        xazab_peer = self.xazab_peer
+        res = XazabCmd('dsq', b'\x01\x02',
+                       on_decode_error=xazab_peer.on_payload_decode_error)
+        with mock.patch.object(xazab_peer, 'close') as close:
+            with self.assertRaises(XazabMsgError):
+                res.payload
+            self.loop.run_until_complete(asyncio.sleep(0))
+        close.assert_called_once_with()
+
+    def test_msg_stats(self):
+        stats = XazabMsgStats()
+        stats.on_msg_received('inv')
+        stats.on_msg_received('inv')
+        stats.on_msg_received('getheaders', ignored=True)
+        stats.on_queue_full('inv')
+        stats.on_msg_handled('inv', 0.0005)
+        stats.on_msg_handled('inv', 7)
+        res = stats.as_dict()
+        inv = res['inv']
+        self.assertEqual(2, inv['received'])
+        self.assertEqual(0, inv['ignored'])
+        self.assertEqual(1, inv['queue_full'])
+        self.assertEqual(2, inv['handled'])
+        self.assertEqual(7000, inv['latency_max_ms'])
+        self.assertAlmostEqual(3500.25, inv['latency_avg_ms'])
+        self.assertEqual(1, inv['latency_hist_ms']['<=1'])
+        self.assertEqual(1, list(inv['latency_hist_ms'].values())[-1])
+        self.assertEqual(1, res['getheaders']['ignored'])
+        self.assertIsNone(res['getheaders']['latency_avg_ms'])
+        stats.clear()
+        self.assertEqual({}, stats.as_dict())
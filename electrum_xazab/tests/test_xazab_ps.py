@@ -5,11 +5,13 @@ import gzip
 import random
 import shutil
 import tempfile
+import threading
 import time
+from unittest import mock
 from collections import defaultdict, Counter
 from pprint import pprint
 
-from electrum_xazab import xazab_ps, ecc
+from electrum_xazab import xazab_ps, xazab_ps_util, ecc
 from electrum_xazab.address_synchronizer import (TX_HEIGHT_LOCAL,
                                                 TX_HEIGHT_UNCONF_PARENT,
                                                 TX_HEIGHT_UNCONFIRMED)
@@ -22,10 +24,12 @@ from electrum_xazab.xazab_ps_util import (COLLATERAL_VAL, CREATE_COLLATERAL_VAL,
                                         PSDenominateWorkflow, filter_log_line,
                                         FILTERED_TXID, FILTERED_ADDR,
                                         PSCoinRounds, ps_coin_rounds_str,
+                                        PSScheduler, PSSchedEvents, PSDenomsPool,
                                         calc_tx_size, calc_tx_fee, to_duffs)
 from electrum_xazab.xazab_ps_wallet import (KPStates, KP_ALL_TYPES, KP_SPENDABLE,
-                                          KP_PS_COINS, KP_PS_CHANGE,
+                                          KP_PS_COINS, KP_PS_CHANGE, KP_FIRST_BATCH_SIZE,
                                           PSKsInternalAddressCorruption)
+from electrum_xazab.xazab_msg import PRIVATESEND_ENTRY_MAX_SIZE
 from electrum_xazab.xazab_tx import PSTxTypes, SPEC_TX_NAMES
 from electrum_xazab import keystore
 from electrum_xazab.simple_config import SimpleConfig
@@ -34,7 +38,7 @@ from electrum_xazab.transaction import (Transaction, PartialTxOutput,
                                        PartialTransaction)
 from electrum_xazab.util import Satoshis, NotEnoughFunds, TxMinedInfo, bh2u
 from electrum_xazab.wallet import Wallet
-from electrum_xazab.wallet_db import WalletDB
+from electrum_xazab.wallet_db import WalletDB, PS_ROLE_DENOM, PS_ROLE_RESERVED
 
 from . import TestCaseForTestnet
 
@@ -484,6 +488,83 @@ class PSWalletTestCase(TestCaseForTestnet):
             if i in range(83, 86):
                 assert txf[i]['group_txid'] == txf[86]['txid']
 
+    def test_history_index_is_updated_incrementally(self):
+        w = self.wallet
+        psman = w.psman
+        coro = psman.find_untracked_ps_txs(log=False)
+        asyncio.get_event_loop().run_until_complete(coro)
+
+        def full_history(**kwargs):
+            w._invalidate_history_index()
+            return w.get_history(**kwargs)
+
+        h = w.get_history(group_ps=True)
+        assert len(h) == 88
+        assert h == full_history(group_ps=True)
+        # no changes, no rows are recomputed
+        with mock.patch.object(w, '_get_history_row') as get_row:
+            assert w.get_history(group_ps=True) == h
+            get_row.assert_not_called()
+
+        # remove last tx and its dependents, then add them back
+        last_txid = h[-1].txid
+        tx = w.db.get_transaction(last_txid)
+        w.remove_transaction(last_txid)
+        h2 = w.get_history(group_ps=True)
+        assert len(h2) == 87
+        assert last_txid not in [item.txid for item in h2]
+        assert h2 == full_history(group_ps=True)
+        w.add_transaction(tx)
+        h2 = w.get_history(group_ps=True)
+        assert len(h2) == 88
+        assert h2[-1].txid == last_txid
+        assert h2 == full_history(group_ps=True)
+
+        # verification changes update the order
+        txid = h[0].txid
+        info = w.db.get_verified_tx(txid)
+        with mock.patch('electrum_xazab.util.trigger_callback'):
+            w.add_verified_tx(txid, info._replace(height=info.height + 10000))
+        h3 = w.get_history()
+        assert h3 == full_history()
+        assert h3[-2].txid == txid  # the last one is local now
+
+    def test_addr_balance_and_utxo_caches(self):
+        w = self.wallet
+
+        def utxos():
+            return sorted((u.prevout.to_str(), u.block_height, u.spent_height)
+                          for u in w.get_utxos())
+
+        def check_against_uncached():
+            balance, coins = w.get_balance(), utxos()
+            w._get_addr_balance_cache.clear()
+            w._get_addr_io_cache.clear()
+            assert balance == w.get_balance()
+            assert coins == utxos()
+            return balance
+
+        balance = check_against_uncached()
+        # served from caches
+        with mock.patch.object(w, 'get_address_history') as get_address_history:
+            assert w.get_balance() == balance
+            utxos()
+            get_address_history.assert_not_called()
+
+        h = w.get_history()
+        txid = h[-1].txid
+        info = w.db.get_verified_tx(txid)
+        tx = w.db.get_transaction(txid)
+        w.remove_transaction(txid)
+        assert check_against_uncached() != balance
+        w.add_transaction(tx)
+        assert sum(check_against_uncached()) == sum(balance)
+        w.add_unverified_tx(txid, 0)
+        check_against_uncached()
+        with mock.patch('electrum_xazab.util.trigger_callback'):
+            w.add_verified_tx(txid, info)
+        assert check_against_uncached() == balance
+
     def test_ps_get_utxos_all(self):
         psman = self.wallet.psman
         coro = psman.find_untracked_ps_txs(log=False)
@@ -1129,6 +1210,63 @@ class PSWalletTestCase(TestCaseForTestnet):
         assert w.db.ps_denoms == {}
         assert psman._ps_denoms_amount_cache == 0
 
+    def test_ps_indexes(self):
+        w = self.wallet
+        db = w.db
+        psman = w.psman
+        coro = psman.find_untracked_ps_txs(log=False)
+        asyncio.get_event_loop().run_until_complete(coro)
+
+        def check_indexes():
+            outpoint_dicts = [db.ps_denoms, db.ps_spent_denoms, db.ps_collaterals,
+                              db.ps_spent_collaterals, db.ps_others, db.ps_spent_others]
+            all_addrs = {v[0] for d in outpoint_dicts for v in d.values()}
+            all_addrs |= set(db.ps_reserved.keys())
+            assert db.get_ps_addresses() == all_addrs
+            unspent = {v[0] for d in [db.ps_denoms, db.ps_collaterals, db.ps_others]
+                       for v in d.values()}
+            unspent |= set(db.ps_reserved.keys())
+            assert db.get_unspent_ps_addresses() == unspent
+            for min_rounds in range(5):
+                denoms = {k: v for k, v in db.ps_denoms.items() if v[2] >= min_rounds}
+                assert db.get_ps_denoms(min_rounds=min_rounds) == denoms
+                assert db.get_ps_denoms(max_rounds=min_rounds) == \
+                    {k: v for k, v in db.ps_denoms.items() if v[2] <= min_rounds}
+                assert db.get_ps_addresses(min_rounds=min_rounds) == \
+                    {v[0] for v in denoms.values()}
+            for data in set(db.ps_reserved.values()) | {None}:
+                for for_change in (False, True):
+                    sub_addrs = (w.get_change_addresses() if for_change
+                                 else w.get_receiving_addresses())
+                    sub_addrs += (db.ps_ks_change_addrs if for_change
+                                  else db.ps_ks_receiving_addrs)
+                    expected = [addr for addr, addr_data in db.ps_reserved.items()
+                                if addr_data == data and addr in sub_addrs]
+                    assert db.select_ps_reserved(for_change=for_change,
+                                                 data=data) == expected
+
+        check_indexes()
+        assert len(db.get_ps_denoms(min_rounds=2)) > 0
+        outpoint, denom = list(db.get_ps_denoms(min_rounds=2).items())[0]
+        assert PS_ROLE_DENOM in db.get_ps_addr_roles(denom[0])
+        psman.pop_ps_denom(outpoint)
+        check_indexes()
+        psman.add_ps_denom(outpoint, (denom[0], denom[1], denom[2] + 1))
+        check_indexes()
+        psman.add_ps_denom(outpoint, denom)
+        check_indexes()
+        psman.reserve_addresses(3, data='uuid')
+        psman.reserve_addresses(2, for_change=True)
+        check_indexes()
+        addr = db.select_ps_reserved(data='uuid')[1]
+        assert db.get_ps_addr_roles(addr) == {PS_ROLE_RESERVED}
+        psman.pop_ps_reserved(addr)
+        assert db.get_ps_addr_roles(addr) == set()
+        check_indexes()
+        db.clear_ps_data()
+        check_indexes()
+        assert db.get_ps_addresses() == set()
+
     def test_ps_origin_addrs(self):
         w = self.wallet
         psman = w.psman
@@ -1414,6 +1552,78 @@ class PSWalletTestCase(TestCaseForTestnet):
         assert psman.pop_ps_spending_denom(outpoint2) == uuid2
         assert w.db.get_ps_spending_denoms() == {}
 
+    def test_failed_denominate_wfl_rearms_mix_denoms(self):
+        w = self.wallet
+        psman = w.psman
+        loop = asyncio.get_event_loop()
+        psman.sched.loop = loop
+        coro = psman.find_untracked_ps_txs(log=False)
+        loop.run_until_complete(coro)
+        # all denoms are spending by completed denominate workflow
+        wfl = PSDenominateWorkflow(uuid='uuid')
+        wfl.completed = time.time() - psman.wait_for_mn_txs_time - 1
+        psman.set_denominate_wfl(wfl)
+        for outpoint in list(psman._denoms_to_mix_cache):
+            psman.add_ps_spending_denom(outpoint, wfl.uuid)
+        assert not psman._denoms_to_mix_cache
+        psman.main_taskgroup = mock.Mock(closed=lambda: False)
+        psman.state = PSStates.Mixing
+        waits = []
+        orig_wait = xazab_ps_util.PSSchedWaiter.wait
+
+        async def wait(waiter, reason, events, timeout=5):
+            waits.append(reason)
+            if reason != 'no denoms to mix':
+                raise asyncio.CancelledError()  # stop on next wait
+            await orig_wait(waiter, reason, events, timeout=timeout)
+
+        async def run():
+            task = loop.create_task(psman._mix_denoms())
+            while not waits:
+                await asyncio.sleep(0.01)
+            # mixing session failed, denoms are returned to the pool
+            await psman.cleanup_denominate_wfl(wfl)
+            await asyncio.gather(task, return_exceptions=True)
+
+        with mock.patch.object(xazab_ps_util.PSSchedWaiter, 'wait', wait):
+            loop.run_until_complete(asyncio.wait_for(run(), timeout=10))
+        assert waits == ['no denoms to mix', 'no pay collateral tx']
+        trace = [t for t in psman.sched.trace if t.loop == 'denominate']
+        assert trace[-1].decision == 'no denoms to mix'
+        assert trace[-1].woken_by == 'PSData'
+        assert psman._denoms_to_mix_cache
+        psman.state = PSStates.Ready
+
+    def test_broadcast_wfls_loop_woken_on_ps_enabled(self):
+        psman = self.wallet.psman
+        loop = asyncio.get_event_loop()
+        psman.sched.loop = loop
+        psman.state = PSStates.Disabled
+        waits = []
+        orig_wait = xazab_ps_util.PSSchedWaiter.wait
+
+        async def wait(waiter, reason, events, timeout=5):
+            waits.append(reason)
+            if reason != 'PrivateSend disabled':
+                raise asyncio.CancelledError()  # stop on next wait
+            await orig_wait(waiter, reason, events, timeout=timeout)
+
+        async def run():
+            task = loop.create_task(
+                psman.broadcast_new_denoms_new_collateral_wfls())
+            while not waits:
+                await asyncio.sleep(0.01)
+            psman.state = PSStates.Ready
+            await asyncio.gather(task, return_exceptions=True)
+
+        with mock.patch.object(xazab_ps_util.PSSchedWaiter, 'wait', wait):
+            loop.run_until_complete(asyncio.wait_for(run(), timeout=10))
+        assert waits == ['PrivateSend disabled', 'no workflow txs to send']
+        trace = [t for t in psman.sched.trace
+                 if t.loop == 'broadcast_new_denoms_collateral']
+        assert trace[-1].decision == 'PrivateSend disabled'
+        assert trace[-1].woken_by == 'State'
+
     def test_prepare_pay_collateral_wfl(self):
         w = self.wallet
         psman = w.psman
@@ -3358,6 +3568,107 @@ class PSWalletTestCase(TestCaseForTestnet):
         assert psman._keypairs_cache == {}
         psman.state = PSStates.Ready
 
+    def test_cache_keypairs_in_worker_processes(self):
+        w = self.wallet
+        psman = w.psman
+        psman.mix_rounds = 4
+        psman.keep_amount = 10
+
+        def make_cache(workers):
+            w.config.set_key('ps_keypairs_workers', workers)
+            psman.state = PSStates.Mixing
+            psman._cache_keypairs(password=None)
+            assert psman.keypairs_state == KPStates.Ready
+            assert psman._kp_executor is None  # pool shut down after caching
+            cache = copy.deepcopy(psman._keypairs_cache)
+            psman._cleanup_all_keypairs_cache()
+            psman.state = PSStates.Ready
+            return cache
+
+        cache = make_cache(0)
+        assert len(cache[KP_PS_COINS]) == 474
+        assert cache == make_cache(2)
+
+    def test_keypairs_usable_on_first_batch(self):
+        w = self.wallet
+        psman = w.psman
+        psman.mix_rounds = 4
+        psman.keep_amount = 10
+        psman.state = PSStates.Mixing
+        usable_on_cached = []
+        set_keypairs_usable = psman._set_keypairs_usable
+
+        def _set_keypairs_usable():
+            assert psman.keypairs_state == KPStates.Caching
+            set_keypairs_usable()
+            assert psman.keypairs_usable
+            usable_on_cached.append(len(psman._keypairs_cache[KP_PS_COINS]))
+
+        psman._set_keypairs_usable = _set_keypairs_usable
+        assert not psman.keypairs_usable
+        psman._cache_keypairs(password=None)
+        assert psman.keypairs_state == KPStates.Ready
+        assert psman.keypairs_usable
+        # first batch of ps coins keys, then the rest in one batch
+        assert usable_on_cached == [KP_FIRST_BATCH_SIZE, 474]
+
+    def test_keep_usable_keypairs_on_stop_mixing(self):
+        w = self.wallet
+        psman = w.psman
+        psman.mix_rounds = 4
+        psman.keep_amount = 10
+        psman.state = PSStates.Mixing
+        set_keypairs_usable = psman._set_keypairs_usable
+
+        def _set_keypairs_usable():
+            set_keypairs_usable()
+            psman.state = PSStates.StopMixing  # stop after first batch
+
+        psman._set_keypairs_usable = _set_keypairs_usable
+        psman._cache_keypairs(password=None)
+        # running sessions still can sign with partial cache
+        assert psman.keypairs_state == KPStates.Ready
+        assert len(psman._keypairs_cache[KP_PS_COINS]) == KP_FIRST_BATCH_SIZE
+        assert psman.get_keypairs()
+
+        # not usable cache is cleaned
+        psman._cleanup_all_keypairs_cache()
+        psman._set_keypairs_usable = set_keypairs_usable
+        psman.state = PSStates.StopMixing
+        psman._cache_keypairs(password=None)
+        assert psman.keypairs_state == KPStates.Empty
+        assert psman._keypairs_cache == {}
+
+    def test_get_keypairs_while_caching(self):
+        w = self.wallet
+        psman = w.psman
+        psman.mix_rounds = 4
+        psman.keep_amount = 10
+        psman.state = PSStates.Mixing
+        errors = []
+        got_keypairs = []
+
+        def cache_keypairs():
+            try:
+                psman._cache_keypairs(password=None)
+            except Exception as e:
+                errors.append(e)
+
+        t = threading.Thread(target=cache_keypairs)
+        t.start()
+        # workflows sign with the cache while it is still filled
+        while t.is_alive():
+            if psman.keypairs_usable:
+                try:
+                    got_keypairs.append(len(psman.get_keypairs()))
+                    psman._find_addrs_not_in_keypairs(['addr'])
+                except RuntimeError as e:
+                    errors.append(e)
+        t.join()
+        assert not errors
+        assert psman.keypairs_state == KPStates.Ready
+        assert len(psman.get_keypairs()) >= max(got_keypairs, default=0)
+
     def test_cache_keypairs_group_origin_by_addr(self):
         w = self.wallet
         psman = w.psman
@@ -4477,3 +4788,147 @@ class PSWalletTestCase(TestCaseForTestnet):
         w = self.wallet
         psman = w.psman
         psman.get_all_known_addresses_beyond_gap_limit()
+
+
+class PSSchedulerTestCase(TestCaseForTestnet):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.get_event_loop()
+        self.sched = PSScheduler(trace_size=5)
+        self.sched.loop = self.loop
+
+    def test_pending_event_wakes_up_at_once(self):
+        sched = self.sched
+        waiter = sched.add_waiter('denoms')
+        sched.notify(PSSchedEvents.PSData)
+        sched.notify(PSSchedEvents.NewDSQ)
+
+        async def run():
+            await asyncio.sleep(0)  # notify is scheduled with call_soon
+            t0 = time.time()
+            await waiter.wait('new denoms', [PSSchedEvents.PSData,
+                                             PSSchedEvents.Funds], timeout=5)
+            return time.time() - t0
+        assert self.loop.run_until_complete(run()) < 1
+        assert waiter.pending == set()  # all pending events cleared
+        item = sched.trace[-1]
+        assert item.loop == 'denoms'
+        assert item.decision == 'new denoms'
+        assert item.woken_by == 'PSData'
+        assert sched.events_cnt == {'PSData': 1, 'NewDSQ': 1}
+
+    def test_wait_woken_by_event_or_timeout(self):
+        sched = self.sched
+        waiter = sched.add_waiter('mix')
+
+        async def notify_later():
+            await asyncio.sleep(0.1)
+            sched.notify(PSSchedEvents.MNList)  # not waited for
+            await asyncio.sleep(0.1)
+            sched.notify(PSSchedEvents.TxVerified)
+
+        async def run():
+            self.loop.create_task(notify_later())
+            await waiter.wait('no mixable denoms', [PSSchedEvents.TxVerified],
+                              timeout=5)
+            await waiter.wait('no mixable denoms', [PSSchedEvents.TxVerified],
+                              timeout=0.1)
+        self.loop.run_until_complete(run())
+        trace = sched.get_trace()
+        assert [t['woken_by'] for t in trace] == ['TxVerified', 'timeout']
+        assert 0.15 < trace[0]['waited'] < 5
+        assert sched.decisions_cnt == {'mix: no mixable denoms': 2}
+
+        with mock.patch.object(xazab_ps_util, 'PS_SCHED_ACTION_INTERVAL', 0):
+            res = self.loop.run_until_complete(
+                waiter.run('start denominate', asyncio.sleep(0, result=1)))
+        assert res == 1
+        assert sched.trace[-1].decision == 'start denominate'
+        assert sched.trace[-1].woken_by is None
+
+        res = sched.as_dict()
+        assert res['loops'] == ['mix']
+        assert res['events'] == {'MNList': 1, 'TxVerified': 1}
+        assert len(res['trace']) == 3
+
+        waiter.close()
+        assert sched.waiters == []
+        sched.notify(PSSchedEvents.MNList)  # no waiters, not counted
+        self.loop.run_until_complete(asyncio.sleep(0))
+        assert sched.events_cnt['MNList'] == 1
+
+
+class PSDenomsPoolTestCase(TestCaseForTestnet):
+
+    def setUp(self):
+        super().setUp()
+        self.denoms = {}
+        for i in range(40):
+            txid = f'{i // 4:064x}'  # 4 outputs in each tx
+            value = PS_DENOMS_VALS[i % 2]
+            self.denoms[f'{txid}:{i % 4}'] = (f'addr{i}', value, i % 3)
+        self.pool = PSDenomsPool(2, self.denoms)
+
+    def test_add_remove(self):
+        pool = self.pool
+        assert len(pool) == 27  # denoms with rounds 0, 1
+        assert dict(pool) == {k: v for k, v in self.denoms.items()
+                              if v[2] < 2}
+        outpoints = list(self.denoms)
+        assert outpoints[14] not in pool  # rounds 2
+        for outpoint in outpoints[:10]:
+            assert pool.remove(outpoint) == self.denoms[outpoint]
+        assert pool.remove(outpoints[0]) is None
+        assert len(pool) == 20
+        for bucket in pool._buckets.values():
+            for pos, outpoint in enumerate(bucket):
+                assert pool._pos[outpoint] == pos
+        pool.add(outpoints[0], self.denoms[outpoints[0]])
+        pool.add(outpoints[0], self.denoms[outpoints[0]])
+        assert len(pool) == 21
+        pool.max_rounds = 3
+        assert len(pool) == 31
+        assert pool[outpoints[14]] == self.denoms[outpoints[14]]
+        pool.clear()
+        assert pool == {}
+
+    def test_select(self):
+        pool = self.pool
+        dval = PS_DENOMS_VALS[1]
+        for i in range(20):
+            inputs, denom_value = pool.select(5)
+            assert len(inputs) == 5
+            assert len(set(o.split(':')[0] for o in inputs)) == 5
+            assert set(pool[o][1] for o in inputs) == {denom_value}
+
+        inputs, denom_value = pool.select(20, dval)
+        assert denom_value == dval
+        assert len(inputs) == 10  # only 10 txids
+        assert all(pool[o][1] == dval for o in inputs)
+
+        checked = []
+
+        def check(txid, denom):
+            checked.append(txid)
+            return int(txid, 16) % 2 == 0
+        inputs, denom_value = pool.select(9, check=check)
+        assert len(inputs) == 5
+        assert all(int(o.split(':')[0], 16) % 2 == 0 for o in inputs)
+
+        assert pool.select(0) == ([], None)
+        assert pool.select(5, check=lambda txid, denom: False) == ([], None)
+        assert pool.select(5, 1000) == ([], 1000)
+        pool.clear()
+        assert pool.select(5) == ([], None)
+
+    def test_draw_mix_inputs_cnt(self):
+        max_size = PRIVATESEND_ENTRY_MAX_SIZE
+        random.seed(0)
+        counts = Counter(xazab_ps.draw_mix_inputs_cnt() for i in range(5000))
+        assert set(counts) <= set(range(1, max_size + 1))
+        p_continue = 1
+        for cnt in range(1, max_size + 1):
+            p = p_continue * cnt / max_size  # stop at cnt
+            p_continue *= (max_size - cnt) / max_size
+            assert abs(counts[cnt] / 5000 - p) < 0.02, cnt
@@ -27,7 +27,9 @@
 
 # Note: The deserialization code originally comes from ABE.
 
+import os
 import struct
+import threading
 import traceback
 import sys
 import io
@@ -39,6 +41,7 @@ from enum import IntEnum
 import itertools
 import binascii
 import copy
+from concurrent.futures import Executor, ThreadPoolExecutor
 
 from . import ecc, bitcoin, constants, bip32
 from .bip32 import BIP32Node
@@ -1242,8 +1245,10 @@ class PartialTxInput(TxInput, PSBTSection):
             return True
         if self.script_sig is not None:
             return True
-        signatures = list(self.part_sigs.values())
-        s = len(signatures)
+        return self.has_enough_sigs(len(self.part_sigs))
+
+    def has_enough_sigs(self, s: int) -> bool:
+        """Whether s signatures are enough to finalize this input."""
         # note: The 'script_type' field is currently only set by the wallet,
         #       for its own addresses. This means we can only finalize inputs
         #       that are related to the wallet.
@@ -1367,6 +1372,71 @@ class PartialTxOutput(TxOutput, PSBTSection):
         self._unknown.update(other_txout._unknown)
 
 
+# signing more inputs than this at once is done in a thread pool
+SIGN_IN_EXECUTOR_MIN_JOBS = 32
+_sign_executor = None  # type: Optional[ThreadPoolExecutor]
+_sign_executor_lock = threading.Lock()
+
+
+def get_sign_executor() -> Optional[ThreadPoolExecutor]:
+    """Returns the thread pool shared for tx signing,
+    or None if there is only one cpu to sign on.
+    """
+    global _sign_executor
+    workers = os.cpu_count() or 1
+    if workers < 2:
+        return None
+    with _sign_executor_lock:
+        if _sign_executor is None:
+            _sign_executor = ThreadPoolExecutor(max_workers=workers,
+                                                thread_name_prefix='tx_sign')
+        return _sign_executor
+
+
+class LegacySighashCache:
+    """Parts of the legacy (pre-segwit) sighash preimage shared by all inputs.
+
+    The preimage of input i is the tx with every scriptSig emptied, except
+    for the one of input i which is replaced by its preimage script.
+    Inputs and outputs are serialized once here, so that signing an
+    N-input tx does not re-serialize the whole tx N times.
+    """
+
+    EMPTY_TXIN_SIZE = 36 + 1 + 4  # outpoint, empty script, nSequence
+
+    def __init__(self, tx: 'PartialTransaction'):
+        inputs = tx.inputs()
+        outputs = tx.outputs()
+        if tx.tx_type:
+            head = bfh(int_to_hex(tx.version, 2) + int_to_hex(tx.tx_type, 2))
+        else:
+            head = bfh(int_to_hex(tx.version, 4))
+        self.head = head + bfh(var_int(len(inputs)))
+        self.txins = b''.join(txin.prevout.serialize_to_network() + b'\x00'
+                              + bfh(int_to_hex(txin.nsequence, 4))
+                              for txin in inputs)
+        tail = (bfh(var_int(len(outputs)))
+                + b''.join(o.serialize_to_network() for o in outputs)
+                + bfh(int_to_hex(tx.locktime, 4)))
+        if tx.tx_type:
+            tail += to_varbytes(serialize_extra_payload(tx))
+        self.tail = tail
+
+    def preimage(self, txin_index: int, preimage_script: bytes, sighash: int) -> bytes:
+        start = txin_index * self.EMPTY_TXIN_SIZE
+        end = start + self.EMPTY_TXIN_SIZE
+        if end > len(self.txins):
+            raise IndexError(f'txin_index out of range: {txin_index}')
+        txins = memoryview(self.txins)
+        return b''.join((self.head,
+                         txins[:start + 36],  # up to and with the outpoint
+                         bfh(var_int(len(preimage_script))),
+                         preimage_script,
+                         txins[end - 4:],  # nSequence and following inputs
+                         self.tail,
+                         bfh(int_to_hex(sighash, 4))))
+
+
 class PartialTransaction(Transaction):
 
     def __init__(self):
@@ -1613,54 +1683,77 @@ class PartialTransaction(Transaction):
         except MissingTxInputAmount:
             return None
 
-    def serialize_preimage(self, txin_index: int) -> str:
-        nVersion = int_to_hex(self.version, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
-        inputs = self.inputs()
-        outputs = self.outputs()
-        txin = inputs[txin_index]
+    def get_sighash_cache(self) -> 'LegacySighashCache':
+        """Returns the preimage parts shared by all inputs.
+        Only valid until the inputs, outputs or tx fields change.
+        """
+        return LegacySighashCache(self)
+
+    def serialize_preimage_bytes(self, txin_index: int, *,
+                                 sighash_cache: 'LegacySighashCache' = None) -> bytes:
+        txin = self.inputs()[txin_index]
         sighash = txin.sighash if txin.sighash is not None else SIGHASH_ALL
         if sighash != SIGHASH_ALL:
             raise Exception("only SIGHASH_ALL signing is supported!")
-        nHashType = int_to_hex(sighash, 4)
-        preimage_script = self.get_preimage_script(txin)
-        txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, preimage_script if txin_index==k else '')
-                                               for k, txin in enumerate(inputs))
-        txouts = var_int(len(outputs)) + ''.join(o.serialize_to_network().hex() for o in outputs)
-        if self.tx_type:
-            uVersion = int_to_hex(self.version, 2)
-            uTxType = int_to_hex(self.tx_type, 2)
-            vExtra = bh2u(to_varbytes(serialize_extra_payload(self)))
-            preimage = uVersion + uTxType + txins + txouts + nLocktime + vExtra + nHashType
-        else:
-            nVersion = int_to_hex(self.version, 4)
-            preimage = nVersion + txins + txouts + nLocktime + nHashType
-        return preimage
+        if sighash_cache is None:
+            sighash_cache = self.get_sighash_cache()
+        preimage_script = bfh(self.get_preimage_script(txin))
+        return sighash_cache.preimage(txin_index, preimage_script, sighash)
 
-    def sign(self, keypairs) -> int:
+    def serialize_preimage(self, txin_index: int, *,
+                           sighash_cache: 'LegacySighashCache' = None) -> str:
+        return bh2u(self.serialize_preimage_bytes(txin_index, sighash_cache=sighash_cache))
+
+    def sign(self, keypairs, *, executor: Executor = None) -> int:
         # keypairs:  pubkey_hex -> (secret_bytes, is_compressed)
-        signed_txins_cnt = 0
+        # Signatures for all inputs are computed in one batch, in executor
+        # if given (libsecp256k1 and hashlib release the GIL), or in the
+        # shared signing pool for large txs, and then added in one pass.
+        jobs = []
         for i, txin in enumerate(self.inputs()):
-            pubkeys = [pk.hex() for pk in txin.pubkeys]
-            for pubkey in pubkeys:
-                if txin.is_complete():
+            if txin.is_complete():
+                continue
+            signing_pubkeys = set(txin.part_sigs)
+            for pk in txin.pubkeys:
+                if txin.has_enough_sigs(len(signing_pubkeys)):
                     break
+                if pk in signing_pubkeys:
+                    continue
+                pubkey = pk.hex()
                 if pubkey not in keypairs:
                     continue
                 _logger.info(f"adding signature for {pubkey}")
                 sec, compressed = keypairs[pubkey]
-                sig = self.sign_txin(i, sec)
-                self.add_signature_to_txin(txin_idx=i, signing_pubkey=pubkey, sig=sig)
-                signed_txins_cnt += 1
+                jobs.append((i, pubkey, sec))
+                signing_pubkeys.add(pk)
+
+        if jobs:
+            sighash_cache = self.get_sighash_cache()
+
+            def sign_job(job):
+                txin_index, pubkey, sec = job
+                return self.sign_txin(txin_index, sec, sighash_cache=sighash_cache)
+
+            if executor is None and len(jobs) >= SIGN_IN_EXECUTOR_MIN_JOBS:
+                executor = get_sign_executor()
+            if executor is not None:
+                sigs = list(executor.map(sign_job, jobs))
+            else:
+                sigs = [sign_job(job) for job in jobs]
+            for (txin_index, pubkey, sec), sig in zip(jobs, sigs):
+                self.add_signature_to_txin(txin_idx=txin_index,
+                                           signing_pubkey=pubkey, sig=sig)
 
         _logger.debug(f"is_complete {self.is_complete()}")
         self.invalidate_ser_cache()
-        return signed_txins_cnt
+        return len(jobs)
 
-    def sign_txin(self, txin_index, privkey_bytes) -> str:
+    def sign_txin(self, txin_index, privkey_bytes, *,
+                  sighash_cache: 'LegacySighashCache' = None) -> str:
         txin = self.inputs()[txin_index]
         txin.validate_data(for_signing=True)
-        pre_hash = sha256d(bfh(self.serialize_preimage(txin_index)))
+        pre_hash = sha256d(self.serialize_preimage_bytes(txin_index,
+                                                         sighash_cache=sighash_cache))
         privkey = ecc.ECPrivkey(privkey_bytes)
         sig = privkey.sign_transaction(pre_hash)
         sig = bh2u(sig) + '01'  # SIGHASH_ALL
@@ -1712,12 +1805,13 @@ class PartialTransaction(Transaction):
             return
         if len(self.inputs()) != len(signatures):
             raise Exception('expected {} signatures; got {}'.format(len(self.inputs()), len(signatures)))
+        sighash_cache = self.get_sighash_cache()
         for i, txin in enumerate(self.inputs()):
             pubkeys = [pk.hex() for pk in txin.pubkeys]
             sig = signatures[i]
             if bfh(sig) in list(txin.part_sigs.values()):
                 continue
-            pre_hash = sha256d(bfh(self.serialize_preimage(i)))
+            pre_hash = sha256d(self.serialize_preimage_bytes(i, sighash_cache=sighash_cache))
             sig_string = ecc.sig_string_from_der_sig(bfh(sig[:-2]))
             for recid in range(4):
                 try:
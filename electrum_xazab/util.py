@@ -1596,3 +1596,48 @@ class IntEnumWithCheck(IntEnum):
     @classmethod
     def has_value(cls, value):
         return any(value == item.value for item in cls)
+
+
+_KT = TypeVar('_KT')
+_VT = TypeVar('_VT')
+
+
+class LRUCache(Generic[_KT, _VT]):
+    """Bounded mapping evicting least recently used items. Not thread safe."""
+
+    def __init__(self, maxsize: int):
+        assert maxsize > 0, maxsize
+        self.maxsize = maxsize
+        self._d = OrderedDict()  # type: OrderedDict[_KT, _VT]
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+    def __contains__(self, key: _KT) -> bool:
+        return key in self._d
+
+    def __getitem__(self, key: _KT) -> _VT:
+        v = self._d[key]
+        self._d.move_to_end(key)
+        return v
+
+    def __setitem__(self, key: _KT, value: _VT) -> None:
+        self._d[key] = value
+        self._d.move_to_end(key)
+        if len(self._d) > self.maxsize:
+            self._d.popitem(last=False)
+
+    def get(self, key: _KT, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key: _KT, default=None):
+        return self._d.pop(key, default)
+
+    def keys(self) -> List[_KT]:
+        return list(self._d)
+
+    def clear(self) -> None:
+        self._d.clear()
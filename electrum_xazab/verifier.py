@@ -22,17 +22,17 @@
 # SOFTWARE.
 
 import asyncio
-from typing import Sequence, Optional, TYPE_CHECKING
+from collections import defaultdict
+from typing import Sequence, Optional, TYPE_CHECKING, Dict, Tuple, List
 
 import aiorpcx
 
-from .util import bh2u, TxMinedInfo, NetworkJobOnDefaultServer
+from .util import bh2u, TxMinedInfo, NetworkJobOnDefaultServer, LRUCache
 from .crypto import sha256d
 from .bitcoin import hash_decode, hash_encode
 from .transaction import Transaction
 from .blockchain import hash_header
 from .interface import GracefulDisconnect
-from .network import UntrustedServerReturnedError
 from . import constants
 
 if TYPE_CHECKING:
@@ -46,6 +46,20 @@ class MerkleRootMismatch(MerkleVerificationFailure): pass
 class InnerNodeOfSpvProofIsValidTx(MerkleVerificationFailure): pass
 
 
+# merkle trees of this many recent blocks are kept by SPV
+BLOCK_MERKLE_CACHE_SIZE = 100
+
+
+class BlockMerkleCache:
+    """Inner nodes of the merkle tree of a block, by (level, index) from
+    the leaves, that verified proofs have shown to lead to merkle_root.
+    """
+
+    def __init__(self, merkle_root: str):
+        self.merkle_root = merkle_root
+        self.nodes = {}  # type: Dict[Tuple[int, int], bytes]
+
+
 class SPV(NetworkJobOnDefaultServer):
     """ Simple Payment Verification """
 
@@ -57,6 +71,7 @@ class SPV(NetworkJobOnDefaultServer):
         super()._reset()
         self.merkle_roots = {}  # txid -> merkle root (once it has been verified)
         self.requested_merkle = set()  # txid set of pending requests
+        self.block_merkle_caches = LRUCache(maxsize=BLOCK_MERKLE_CACHE_SIZE)  # type: LRUCache[str, BlockMerkleCache]
 
     async def _run_tasks(self, *, taskgroup):
         await super()._run_tasks(taskgroup=taskgroup)
@@ -76,6 +91,7 @@ class SPV(NetworkJobOnDefaultServer):
     async def _request_proofs(self):
         local_height = self.blockchain.height()
         unverified = self.wallet.get_unverified_txs()
+        to_request = []  # type: List[Tuple[str, int]]
 
         for tx_hash, tx_height in unverified.items():
             # do not request merkle branch if we already requested it
@@ -93,52 +109,79 @@ class SPV(NetworkJobOnDefaultServer):
             # request now
             self.logger.info(f'requested merkle {tx_hash}')
             self.requested_merkle.add(tx_hash)
-            await self.taskgroup.spawn(self._request_and_verify_single_proof, tx_hash, tx_height)
+            to_request.append((tx_hash, tx_height))
+        # batches of proofs sorted by height, so txs of a block share work
+        to_request.sort(key=lambda x: x[1])
+        batch_size = self.network.config.get_synchronizer_batch_size()
+        for i in range(0, len(to_request), batch_size):
+            await self.taskgroup.spawn(self._request_and_verify_proofs, to_request[i:i+batch_size])
 
-    async def _request_and_verify_single_proof(self, tx_hash, tx_height):
-        try:
-            async with self._network_request_semaphore:
-                merkle = await self.network.get_merkle_for_transaction(tx_hash, tx_height)
-        except UntrustedServerReturnedError as e:
-            if not isinstance(e.original_exception, aiorpcx.jsonrpc.RPCError):
-                raise
-            self.logger.info(f'tx {tx_hash} not at height {tx_height}')
-            self.wallet.remove_unverified_tx(tx_hash, tx_height)
-            self.requested_merkle.discard(tx_hash)
+    async def _request_and_verify_proofs(self, txs: Sequence[Tuple[str, int]]):
+        async with self._network_request_semaphore:
+            merkles = await self.network.get_merkles_for_transactions(txs)
+        proofs = defaultdict(list)  # type: Dict[int, List[Tuple[str, dict]]]
+        for (tx_hash, tx_height), merkle in zip(txs, merkles):
+            if isinstance(merkle, aiorpcx.jsonrpc.RPCError):
+                self.logger.info(f'tx {tx_hash} not at height {tx_height}')
+                self.wallet.remove_unverified_tx(tx_hash, tx_height)
+                self.requested_merkle.discard(tx_hash)
+                continue
+            if tx_height != merkle.get('block_height'):
+                self.logger.info('requested tx_height {} differs from received tx_height {} for txid {}'
+                                 .format(tx_height, merkle.get('block_height'), tx_hash))
+            proofs[merkle.get('block_height')].append((tx_hash, merkle))
+        if not proofs:
             return
-        # Verify the hash of the server-provided merkle branch to a
-        # transaction matches the merkle root of its block
-        if tx_height != merkle.get('block_height'):
-            self.logger.info('requested tx_height {} differs from received tx_height {} for txid {}'
-                             .format(tx_height, merkle.get('block_height'), tx_hash))
-        tx_height = merkle.get('block_height')
-        pos = merkle.get('pos')
-        merkle_branch = merkle.get('merkle')
         # we need to wait if header sync/reorg is still ongoing, hence lock:
         async with self.network.bhi_lock:
-            header = self.network.blockchain().read_header(tx_height)
-        try:
-            verify_tx_is_in_block(tx_hash, merkle_branch, pos, header, tx_height)
-        except MerkleVerificationFailure as e:
-            if self.network.config.get("skipmerklecheck"):
-                self.logger.info(f"skipping merkle proof check {tx_hash}")
-            else:
-                self.logger.info(repr(e))
-                raise GracefulDisconnect(e) from e
-        # we passed all the tests
-        self.merkle_roots[tx_hash] = header.get('merkle_root')
-        self.requested_merkle.discard(tx_hash)
-        self.logger.info(f"verified {tx_hash}")
-        header_hash = hash_header(header)
-        tx_info = TxMinedInfo(height=tx_height,
-                              timestamp=header.get('timestamp'),
-                              txpos=pos,
-                              header_hash=header_hash)
-        self.wallet.add_verified_tx(tx_hash, tx_info)
+            chain = self.network.blockchain()
+            headers = {tx_height: chain.read_header(tx_height) for tx_height in proofs}
+        verified = {}  # type: Dict[str, TxMinedInfo]
+        for tx_height, block_proofs in proofs.items():
+            header = headers[tx_height]
+            header_hash = hash_header(header) if header else None
+            block_cache = self._get_block_merkle_cache(header_hash, header)
+            for tx_hash, merkle in block_proofs:
+                # Verify the hash of the server-provided merkle branch to a
+                # transaction matches the merkle root of its block
+                pos = merkle.get('pos')
+                try:
+                    verify_tx_is_in_block(tx_hash, merkle.get('merkle'), pos, header, tx_height,
+                                          block_cache=block_cache)
+                except MerkleVerificationFailure as e:
+                    if self.network.config.get("skipmerklecheck"):
+                        self.logger.info(f"skipping merkle proof check {tx_hash}")
+                    else:
+                        self.logger.info(repr(e))
+                        raise GracefulDisconnect(e) from e
+                # we passed all the tests
+                self.merkle_roots[tx_hash] = header.get('merkle_root')
+                self.requested_merkle.discard(tx_hash)
+                self.logger.info(f"verified {tx_hash}")
+                verified[tx_hash] = TxMinedInfo(height=tx_height,
+                                                timestamp=header.get('timestamp'),
+                                                txpos=pos,
+                                                header_hash=header_hash)
+        self.wallet.add_verified_txs(verified)
+
+    def _get_block_merkle_cache(self, header_hash: Optional[str],
+                                header: Optional[dict]) -> Optional[BlockMerkleCache]:
+        if not header:
+            return None
+        block_cache = self.block_merkle_caches.get(header_hash)
+        if block_cache is None:
+            block_cache = BlockMerkleCache(header.get('merkle_root'))
+            self.block_merkle_caches[header_hash] = block_cache
+        return block_cache
 
     @classmethod
-    def hash_merkle_root(cls, merkle_branch: Sequence[str], tx_hash: str, leaf_pos_in_tree: int):
-        """Return calculated merkle root."""
+    def hash_merkle_root(cls, merkle_branch: Sequence[str], tx_hash: str, leaf_pos_in_tree: int,
+                         *, block_cache: BlockMerkleCache = None):
+        """Return calculated merkle root.
+        With block_cache, the calculation stops at the first inner node
+        already known to lead to its merkle root, and inner nodes of a
+        branch leading to the merkle root are added to it.
+        """
         try:
             h = hash_decode(tx_hash)
             merkle_branch_bytes = [hash_decode(item) for item in merkle_branch]
@@ -148,16 +191,25 @@ class SPV(NetworkJobOnDefaultServer):
         if leaf_pos_in_tree < 0:
             raise MerkleVerificationFailure('leaf_pos_in_tree must be non-negative')
         index = leaf_pos_in_tree
-        for item in merkle_branch_bytes:
+        nodes = []
+        for level, item in enumerate(merkle_branch_bytes, start=1):
             if len(item) != 32:
                 raise MerkleVerificationFailure('all merkle branch items have to 32 bytes long')
             inner_node = (item + h) if (index & 1) else (h + item)
             cls._raise_if_valid_tx(bh2u(inner_node))
             h = sha256d(inner_node)
             index >>= 1
+            if block_cache is not None:
+                if block_cache.nodes.get((level, index)) == h:
+                    block_cache.nodes.update(nodes)
+                    return block_cache.merkle_root
+                nodes.append(((level, index), h))
         if index != 0:
             raise MerkleVerificationFailure(f'leaf_pos_in_tree too large for branch')
-        return hash_encode(h)
+        merkle_root = hash_encode(h)
+        if block_cache is not None and merkle_root == block_cache.merkle_root:
+            block_cache.nodes.update(nodes)
+        return merkle_root
 
     @classmethod
     def _raise_if_valid_tx(cls, raw_tx: str):
@@ -195,14 +247,15 @@ class SPV(NetworkJobOnDefaultServer):
 
 def verify_tx_is_in_block(tx_hash: str, merkle_branch: Sequence[str],
                           leaf_pos_in_tree: int, block_header: Optional[dict],
-                          block_height: int) -> None:
+                          block_height: int, *, block_cache: BlockMerkleCache = None) -> None:
     """Raise MerkleVerificationFailure if verification fails."""
     if not block_header:
         raise MissingBlockHeader("merkle verification failed for {} (missing header {})"
                                  .format(tx_hash, block_height))
     if len(merkle_branch) > 30:
         raise MerkleVerificationFailure(f"merkle branch too long: {len(merkle_branch)}")
-    calc_merkle_root = SPV.hash_merkle_root(merkle_branch, tx_hash, leaf_pos_in_tree)
+    calc_merkle_root = SPV.hash_merkle_root(merkle_branch, tx_hash, leaf_pos_in_tree,
+                                            block_cache=block_cache)
     if block_header.get('merkle_root') != calc_merkle_root:
         raise MerkleRootMismatch("merkle verification failed for {} ({} != {})".format(
             tx_hash, block_header.get('merkle_root'), calc_merkle_root))
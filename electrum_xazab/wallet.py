@@ -69,6 +69,7 @@ from .keystore import (load_keystore, Hardware_KeyStore, KeyStore, KeyStoreWithM
 from .util import multisig_type
 from .storage import StorageEncryptionVersion, WalletStorage
 from .wallet_db import WalletDB
+from .sqlite_db import SQLITE_TX_STORE_SUFFIX
 from . import transaction, bitcoin, coinchooser, paymentrequest, ecc, bip32
 from .transaction import (Transaction, TxInput, UnknownTxinType, TxOutput,
                           PartialTransaction, PartialTxInput, PartialTxOutput, TxOutpoint)
@@ -257,6 +258,13 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
         assert self.config is not None, "config must not be None"
         self.db = db
         self.storage = storage
+        if storage:
+            # append changes to journal instead of rewriting wallet file
+            storage.use_journal = bool(config.get('wallet_db_journal', False))
+        if db.uses_sqlite_tx_store():
+            if not storage:
+                raise WalletFileException('Transactions database path is unknown')
+            db.open_sqlite_tx_store(storage.path + SQLITE_TX_STORE_SUFFIX)
         # load addresses needs to be called before constructor for sanity checks
         db.load_addresses(self.wallet_type)
         self.keystore = None  # type: Optional[KeyStore]  # will be set by load_keystore
@@ -288,8 +296,28 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
         if self.storage:
             self.db.write(self.storage)
 
+    def convert_tx_store(self, backend: str) -> None:
+        """Move transactions and history to sqlite db ('sqlite' backend)
+        or back to the wallet file ('json' backend)"""
+        if not self.storage:
+            raise Exception('wallet has no storage')
+        path = self.storage.path + SQLITE_TX_STORE_SUFFIX
+        if backend == 'sqlite':
+            # sqlite db is not encrypted
+            if self.storage.is_encrypted():
+                raise UserFacingException(_('Can not use sqlite database'
+                                            ' with encrypted wallet file'))
+            self.db.convert_tx_store_to_sqlite(path)
+            self.save_db()
+        elif backend == 'json':
+            self.db.convert_tx_store_to_json()
+            self.save_db()
+            os.unlink(path)
+        else:
+            raise UserFacingException(f'Unknown backend: {backend}')
+
     def save_backup(self, backup_dir):
-        new_db = WalletDB(self.db.dump(), manual_upgrades=False)
+        new_db = WalletDB(self.db.dump_with_tx_store(), manual_upgrades=False)
         new_path = os.path.join(backup_dir, self.basename() + '.backup')
         new_storage = WalletStorage(new_path)
         new_storage._encryption_version = self.storage._encryption_version
@@ -307,6 +335,8 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
             if any([ks.is_requesting_to_be_rewritten_to_wallet_file for ks in self.get_keystores()]):
                 self.save_keystore()
             self.save_db()
+            if self.storage:
+                self.storage.wait_for_compaction()
 
     def set_up_to_date(self, b):
         super().set_up_to_date(b)
@@ -1574,6 +1604,11 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
         # will likely be.  If co-signing a transaction it may not have
         # all the input txs, in which case we ask the network.
         tx = self.db.get_transaction(tx_hash)
+        tx_cache = self.network.tx_cache if self.network else None
+        if not tx and tx_cache:
+            raw_tx = tx_cache.get(tx_hash)
+            if raw_tx:
+                tx = Transaction(raw_tx)
         if not tx and self.network and self.network.has_internet_connection():
             try:
                 raw_tx = self.network.run_from_another_thread(
@@ -1585,6 +1620,8 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
                     raise e
             else:
                 tx = Transaction(raw_tx)
+                if tx_cache and tx.txid() == tx_hash:
+                    tx_cache.add(tx_hash, raw_tx)
         if not tx and not ignore_network_issues:
             raise NetworkException('failed to get prev tx from network')
         return tx
@@ -1999,6 +2036,9 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
             raise InvalidPassword()
         self.check_password(old_pw)
         if self.storage:
+            if encrypt_storage and new_pw and self.db.uses_sqlite_tx_store():
+                raise UserFacingException(_('Can not encrypt wallet file'
+                                            ' using sqlite database'))
             if encrypt_storage:
                 enc_version = self.get_available_storage_encryption_version()
             else:
@@ -2889,7 +2929,8 @@ def check_password_for_directory(config: SimpleConfig, old_password, new_passwor
             # it is a bit wasteful load the wallet here, but that is fine
             # because we are progressively enforcing storage encryption.
             try:
-                db = WalletDB(storage.read(), manual_upgrades=False)
+                db = WalletDB(storage.read(), manual_upgrades=False,
+                              journal=storage.read_journal())
                 wallet = Wallet(db, storage, config=config)
             except:
                 _logger.exception(f'failed to load {basename}:')
@@ -2916,7 +2957,8 @@ def check_password_for_directory(config: SimpleConfig, old_password, new_passwor
             failed.append(basename)
             continue
         try:
-            db = WalletDB(storage.read(), manual_upgrades=False)
+            db = WalletDB(storage.read(), manual_upgrades=False,
+                          journal=storage.read_journal())
             wallet = Wallet(db, storage, config=config)
         except:
             _logger.exception(f'failed to load {basename}:')
@@ -29,7 +29,7 @@ import copy
 import threading
 import time
 from collections import defaultdict
-from typing import Dict, Optional, List, Tuple, Set, Iterable, NamedTuple, Sequence, TYPE_CHECKING, Union
+from typing import Dict, Optional, List, Tuple, Set, Iterable, NamedTuple, Sequence, TYPE_CHECKING, Union, Any
 import binascii
 
 from . import util, bitcoin
@@ -38,9 +38,10 @@ from .invoices import PR_TYPE_ONCHAIN, Invoice, InvoiceExt
 from .keystore import bip44_derivation
 from .transaction import Transaction, TxOutpoint, tx_from_any, PartialTransaction, PartialTxOutput
 from .logging import Logger
-from .json_db import StoredDict, JsonDB, locked, modifier
+from .json_db import StoredDict, JsonDB, locked, modifier, apply_journal_record, JsonDBJsonEncoder
 from .plugin import run_hook, plugin_loaders
 from .paymentrequest import PaymentRequest
+from .sqlite_db import SqliteTxStore, SQLITE_TX_STORE_KEYS
 
 if TYPE_CHECKING:
     from .storage import WalletStorage
@@ -54,6 +55,18 @@ FINAL_SEED_VERSION = 40     # electrum >= 2.7 will set this to prevent
                             # old versions from overwriting new format
 
 
+# roles of addresses in PS data, see WalletDB.get_ps_addr_roles
+PS_ROLE_DENOM = 'denom'
+PS_ROLE_SPENT_DENOM = 'spent_denom'
+PS_ROLE_COLLATERAL = 'collateral'
+PS_ROLE_SPENT_COLLATERAL = 'spent_collateral'
+PS_ROLE_OTHER = 'other'
+PS_ROLE_SPENT_OTHER = 'spent_other'
+PS_ROLE_RESERVED = 'reserved'
+PS_SPENT_ROLES = frozenset([PS_ROLE_SPENT_DENOM, PS_ROLE_SPENT_COLLATERAL,
+                            PS_ROLE_SPENT_OTHER])
+
+
 class TxFeesValue(NamedTuple):
     fee: Optional[int] = None
     is_calculated_by_us: bool = False
@@ -62,13 +75,17 @@ class TxFeesValue(NamedTuple):
 
 class WalletDB(JsonDB):
 
-    def __init__(self, raw, *, manual_upgrades: bool):
+    def __init__(self, raw, *, manual_upgrades: bool, journal: Sequence[str] = None):
         JsonDB.__init__(self, {})
         self._manual_upgrades = manual_upgrades
         self._called_after_upgrade_tasks = False
         self.upgrade_done = False
+        # journal records can be appended only on top of a wallet file
+        # containing the same data as loaded/written by this db
+        self._journal_needs_snapshot = True
+        self._tx_store = None  # type: Optional[SqliteTxStore]
         if raw:  # loading existing db
-            self.load_data(raw)
+            self.load_data(raw, journal=journal)
             self.load_plugins()
         else:  # creating new db
             self.put('seed_version', FINAL_SEED_VERSION)
@@ -76,7 +93,7 @@ class WalletDB(JsonDB):
         self._addr_to_addr_index = {}  # type: Dict[str, Sequence[int]]  # key: address, value: (is_change, index)
         self._ps_ks_addr_to_addr_index = {}  # type: Dict[str, Sequence[int]]  # key: address, value: (is_change, index)
 
-    def load_data(self, s):
+    def load_data(self, s, *, journal: Sequence[str] = None):
         try:
             self.data = json.loads(s)
         except:
@@ -96,15 +113,29 @@ class WalletDB(JsonDB):
                 self.data[key] = value
         if not isinstance(self.data, dict):
             raise WalletFileException("Malformed wallet file (not dict)")
+        self._replay_journal(journal)
 
         if not self._manual_upgrades and self.requires_split():
             raise WalletFileException("This wallet has multiple accounts and must be split")
 
         if not self.requires_upgrade():
+            self._journal_needs_snapshot = False
             self._after_upgrade_tasks()
         elif not self._manual_upgrades:
             self.upgrade()
 
+    def _replay_journal(self, journal: Optional[Sequence[str]]):
+        if not journal:
+            return
+        for i, record in enumerate(journal):
+            try:
+                ops = json.loads(record)
+                apply_journal_record(self.data, ops)
+            except Exception as e:
+                raise WalletFileException(f'Cannot replay wallet journal'
+                                          f' record {i}: {repr(e)}') from e
+        self.logger.info(f'replayed {len(journal)} journal records')
+
     def check_unfinished_multisig(self):
         wallet_type = self.data.get('wallet_type')
         if not wallet_type:
@@ -182,6 +213,7 @@ class WalletDB(JsonDB):
         if self._called_after_upgrade_tasks:
             # we need strict ordering between upgrade() and after_upgrade_tasks()
             raise Exception("'after_upgrade_tasks' must NOT be called before 'upgrade'")
+        self._journal_needs_snapshot = True
         self._convert_imported()
         self._convert_wallet_type()
         self._convert_account()
@@ -830,12 +862,16 @@ class WalletDB(JsonDB):
     def get_txi_addresses(self, tx_hash: str) -> List[str]:
         """Returns list of is_mine addresses that appear as inputs in tx."""
         assert isinstance(tx_hash, str)
+        if self._tx_store:
+            return self._tx_store.get_txi_addresses(tx_hash)
         return list(self.txi.get(tx_hash, {}).keys())
 
     @locked
     def get_txo_addresses(self, tx_hash: str) -> List[str]:
         """Returns list of is_mine addresses that appear as outputs in tx."""
         assert isinstance(tx_hash, str)
+        if self._tx_store:
+            return self._tx_store.get_txo_addresses(tx_hash)
         return list(self.txo.get(tx_hash, {}).keys())
 
     @locked
@@ -843,6 +879,8 @@ class WalletDB(JsonDB):
         """Returns an iterable of (prev_outpoint, value)."""
         assert isinstance(tx_hash, str)
         assert isinstance(address, str)
+        if self._tx_store:
+            return self._tx_store.get_txi_addr(tx_hash, address)
         d = self.txi.get(tx_hash, {}).get(address, {})
         return list(d.items())
 
@@ -851,6 +889,8 @@ class WalletDB(JsonDB):
         """Returns a dict: output_index -> (value, is_coinbase)."""
         assert isinstance(tx_hash, str)
         assert isinstance(address, str)
+        if self._tx_store:
+            return self._tx_store.get_txo_addr(tx_hash, address)
         d = self.txo.get(tx_hash, {}).get(address, {})
         return {int(n): (v, cb) for (n, (v, cb)) in d.items()}
 
@@ -860,6 +900,9 @@ class WalletDB(JsonDB):
         assert isinstance(addr, str)
         assert isinstance(ser, str)
         assert isinstance(v, int)
+        if self._tx_store:
+            self._tx_store.add_txi_addr(tx_hash, addr, ser, v)
+            return
         if tx_hash not in self.txi:
             self.txi[tx_hash] = {}
         d = self.txi[tx_hash]
@@ -875,6 +918,9 @@ class WalletDB(JsonDB):
         assert isinstance(n, str)
         assert isinstance(v, int)
         assert isinstance(is_coinbase, bool)
+        if self._tx_store:
+            self._tx_store.add_txo_addr(tx_hash, addr, n, v, is_coinbase)
+            return
         if tx_hash not in self.txo:
             self.txo[tx_hash] = {}
         d = self.txo[tx_hash]
@@ -884,24 +930,36 @@ class WalletDB(JsonDB):
 
     @locked
     def list_txi(self) -> Sequence[str]:
+        if self._tx_store:
+            return self._tx_store.list_txi()
         return list(self.txi.keys())
 
     @locked
     def list_txo(self) -> Sequence[str]:
+        if self._tx_store:
+            return self._tx_store.list_txo()
         return list(self.txo.keys())
 
     @modifier
     def remove_txi(self, tx_hash: str) -> None:
         assert isinstance(tx_hash, str)
+        if self._tx_store:
+            self._tx_store.remove_txi(tx_hash)
+            return
         self.txi.pop(tx_hash, None)
 
     @modifier
     def remove_txo(self, tx_hash: str) -> None:
         assert isinstance(tx_hash, str)
+        if self._tx_store:
+            self._tx_store.remove_txo(tx_hash)
+            return
         self.txo.pop(tx_hash, None)
 
     @locked
     def list_spent_outpoints(self) -> Sequence[Tuple[str, str]]:
+        if self._tx_store:
+            return self._tx_store.list_spent_outpoints()
         return [(h, n)
                 for h in self.spent_outpoints.keys()
                 for n in self.get_spent_outpoints(h)
@@ -910,18 +968,25 @@ class WalletDB(JsonDB):
     @locked
     def get_spent_outpoints(self, prevout_hash: str) -> Sequence[str]:
         assert isinstance(prevout_hash, str)
+        if self._tx_store:
+            return self._tx_store.get_spent_outpoints(prevout_hash)
         return list(self.spent_outpoints.get(prevout_hash, {}).keys())
 
     @locked
     def get_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str]) -> Optional[str]:
         assert isinstance(prevout_hash, str)
         prevout_n = str(prevout_n)
+        if self._tx_store:
+            return self._tx_store.get_spent_outpoint(prevout_hash, prevout_n)
         return self.spent_outpoints.get(prevout_hash, {}).get(prevout_n)
 
     @modifier
     def remove_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str]) -> None:
         assert isinstance(prevout_hash, str)
         prevout_n = str(prevout_n)
+        if self._tx_store:
+            self._tx_store.remove_spent_outpoint(prevout_hash, prevout_n)
+            return
         self.spent_outpoints[prevout_hash].pop(prevout_n, None)
         if not self.spent_outpoints[prevout_hash]:
             self.spent_outpoints.pop(prevout_hash)
@@ -931,6 +996,9 @@ class WalletDB(JsonDB):
         assert isinstance(prevout_hash, str)
         assert isinstance(tx_hash, str)
         prevout_n = str(prevout_n)
+        if self._tx_store:
+            self._tx_store.set_spent_outpoint(prevout_hash, prevout_n, tx_hash)
+            return
         if prevout_hash not in self.spent_outpoints:
             self.spent_outpoints[prevout_hash] = {}
         self.spent_outpoints[prevout_hash][prevout_n] = tx_hash
@@ -940,23 +1008,35 @@ class WalletDB(JsonDB):
         assert isinstance(scripthash, str)
         assert isinstance(prevout, TxOutpoint)
         assert isinstance(value, int)
+        if self._tx_store:
+            self._tx_store.add_prevout_by_scripthash(scripthash, prevout.to_str(), value)
+            return
         if scripthash not in self._prevouts_by_scripthash:
             self._prevouts_by_scripthash[scripthash] = set()
         self._prevouts_by_scripthash[scripthash].add((prevout.to_str(), value))
+        # set is changed in place, not tracked by StoredDict
+        self.mark_dirty(['prevouts_by_scripthash', scripthash])
 
     @modifier
     def remove_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
         assert isinstance(scripthash, str)
         assert isinstance(prevout, TxOutpoint)
         assert isinstance(value, int)
+        if self._tx_store:
+            self._tx_store.remove_prevout_by_scripthash(scripthash, prevout.to_str(), value)
+            return
         self._prevouts_by_scripthash[scripthash].discard((prevout.to_str(), value))
+        self.mark_dirty(['prevouts_by_scripthash', scripthash])
         if not self._prevouts_by_scripthash[scripthash]:
             self._prevouts_by_scripthash.pop(scripthash)
 
     @locked
     def get_prevouts_by_scripthash(self, scripthash: str) -> Set[Tuple[TxOutpoint, int]]:
         assert isinstance(scripthash, str)
-        prevouts_and_values = self._prevouts_by_scripthash.get(scripthash, set())
+        if self._tx_store:
+            prevouts_and_values = self._tx_store.get_prevouts_by_scripthash(scripthash)
+        else:
+            prevouts_and_values = self._prevouts_by_scripthash.get(scripthash, set())
         return {(TxOutpoint.from_str(prevout), value) for prevout, value in prevouts_and_values}
 
     @modifier
@@ -971,13 +1051,18 @@ class WalletDB(JsonDB):
         if tx_hash != tx.txid():
             raise Exception(f"trying to add tx to db with inconsistent txid: {tx_hash} != {tx.txid()}")
         # don't allow overwriting complete tx with partial tx
-        tx_we_already_have = self.transactions.get(tx_hash, None)
+        tx_we_already_have = self.get_transaction(tx_hash)
         if tx_we_already_have is None or isinstance(tx_we_already_have, PartialTransaction):
-            self.transactions[tx_hash] = tx
+            if self._tx_store:
+                self._tx_store.add_transaction(tx_hash, tx)
+            else:
+                self.transactions[tx_hash] = tx
 
     @modifier
     def remove_transaction(self, tx_hash: str) -> Optional[Transaction]:
         assert isinstance(tx_hash, str)
+        if self._tx_store:
+            return self._tx_store.remove_transaction(tx_hash)
         return self.transactions.pop(tx_hash, None)
 
     @locked
@@ -985,35 +1070,60 @@ class WalletDB(JsonDB):
         if tx_hash is None:
             return None
         assert isinstance(tx_hash, str)
+        if self._tx_store:
+            return self._tx_store.get_transaction(tx_hash)
         return self.transactions.get(tx_hash)
 
+    @locked
+    def has_transaction(self, tx_hash: str) -> bool:
+        assert isinstance(tx_hash, str)
+        if self._tx_store:
+            return self._tx_store.has_transaction(tx_hash)
+        return tx_hash in self.transactions
+
     @locked
     def list_transactions(self) -> Sequence[str]:
+        if self._tx_store:
+            return self._tx_store.list_transactions()
         return list(self.transactions.keys())
 
     @locked
     def get_history(self) -> Sequence[str]:
+        if self._tx_store:
+            return self._tx_store.list_history_addresses()
         return list(self.history.keys()) + list(self.ps_ks_hist.keys())
 
     def is_addr_in_history(self, addr: str) -> bool:
         # does not mean history is non-empty!
         assert isinstance(addr, str)
+        if self._tx_store:
+            return self._tx_store.is_addr_in_history(addr)
         return addr in self.history or addr in self.ps_ks_hist
 
     @locked
     def get_addr_history(self, addr: str) -> Sequence[Tuple[str, int]]:
         assert isinstance(addr, str)
         if self.get_address_index(addr, ps_ks=True):
-            return self.ps_ks_hist.get(addr, [])
+            ps_ks = True
         elif self.get_address_index(addr):
-            return self.history.get(addr, [])
+            ps_ks = False
         else:
             return []
+        if self._tx_store:
+            return self._tx_store.get_addr_history(addr, ps_ks)
+        if ps_ks:
+            return self.ps_ks_hist.get(addr, [])
+        else:
+            return self.history.get(addr, [])
 
     @modifier
-    def set_addr_history(self, addr: str, hist) -> None:
+    def set_addr_history(self, addr: str, hist, *, ps_ks: bool = None) -> None:
         assert isinstance(addr, str)
-        if self.get_address_index(addr, ps_ks=True):
+        if ps_ks is None:
+            ps_ks = bool(self.get_address_index(addr, ps_ks=True))
+        if self._tx_store:
+            self._tx_store.set_addr_history(addr, hist, ps_ks)
+        elif ps_ks:
             self.ps_ks_hist[addr] = hist
         else:
             self.history[addr] = hist
@@ -1021,7 +1131,10 @@ class WalletDB(JsonDB):
     @modifier
     def remove_addr_history(self, addr: str) -> None:
         assert isinstance(addr, str)
-        if self.get_address_index(addr, ps_ks=True):
+        ps_ks = bool(self.get_address_index(addr, ps_ks=True))
+        if self._tx_store:
+            self._tx_store.remove_addr_history(addr, ps_ks)
+        elif ps_ks:
             self.ps_ks_hist.pop(addr, None)
         else:
             self.history.pop(addr, None)
@@ -1122,11 +1235,15 @@ class WalletDB(JsonDB):
 
     @modifier
     def add_ps_collateral(self, outpoint, ps_collateral):
+        self._index_ps_outpoint(PS_ROLE_COLLATERAL, outpoint,
+                                self.ps_collaterals.get(outpoint), ps_collateral)
         self.ps_collaterals[outpoint] = ps_collateral
 
     @modifier
     def pop_ps_collateral(self, outpoint):
-        return self.ps_collaterals.pop(outpoint, None)
+        v = self.ps_collaterals.pop(outpoint, None)
+        self._index_ps_outpoint(PS_ROLE_COLLATERAL, outpoint, v, None)
+        return v
 
     @locked
     def get_ps_collateral(self, outpoint=None):
@@ -1167,10 +1284,15 @@ class WalletDB(JsonDB):
         if addr in self.ps_reserved:
             raise WalletFileException(f'Address {addr} already in ps_reserved')
         self.ps_reserved[addr] = data
+        self._index_ps_reserved(addr, None, data)
 
     @modifier  # do not use directly, use PSManager method of the same name
     def _pop_ps_reserved(self, addr):
-        return self.ps_reserved.pop(addr, None)
+        if addr not in self.ps_reserved:
+            return None
+        data = self.ps_reserved.pop(addr)
+        self._index_ps_reserved(addr, data, None, removed=True)
+        return data
 
     @locked
     def get_ps_reserved(self, addr=None):
@@ -1182,29 +1304,33 @@ class WalletDB(JsonDB):
     @locked
     def select_ps_reserved(self, for_change=False, data=None):
         imp_addrs = getattr(self, 'imported_addresses', None)
-        imp_addrs = list(imp_addrs.keys()) if imp_addrs else []
-        if for_change:
-            w_addrs = imp_addrs if imp_addrs else self.change_addresses
-            sub_addrs = w_addrs + self.ps_ks_change_addrs
-        else:
-            w_addrs = imp_addrs if imp_addrs else self.receiving_addresses
-            sub_addrs = w_addrs + self.ps_ks_receiving_addrs
-        res = []
-        for addr, addr_data in self.ps_reserved.items():
-            if addr not in sub_addrs:
-                continue
-            if addr_data != data:
-                continue
-            res.append(addr)
-        return res
+        is_change = 1 if for_change else 0
+
+        def is_sub_addr(addr):
+            if imp_addrs:
+                if addr in imp_addrs:
+                    return True
+            else:
+                idx = self._addr_to_addr_index.get(addr)
+                if idx is not None and idx[0] == is_change:
+                    return True
+            idx = self._ps_ks_addr_to_addr_index.get(addr)
+            return idx is not None and idx[0] == is_change
+
+        addrs = self._ps_reserved_by_data.get(self._ps_reserved_key(data), {})
+        return [addr for addr in addrs if is_sub_addr(addr)]
 
     @modifier  # do not use directly, use PSManager method of the same name
     def _add_ps_denom(self, outpoint, denom):
+        self._index_ps_outpoint(PS_ROLE_DENOM, outpoint,
+                                self.ps_denoms.get(outpoint), denom)
         self.ps_denoms[outpoint] = denom
 
     @modifier  # do not use directly, use PSManager method of the same name
     def _pop_ps_denom(self, outpoint):
-        return self.ps_denoms.pop(outpoint, None)
+        v = self.ps_denoms.pop(outpoint, None)
+        self._index_ps_outpoint(PS_ROLE_DENOM, outpoint, v, None)
+        return v
 
     @locked
     def get_ps_denom(self, outpoint):
@@ -1218,8 +1344,16 @@ class WalletDB(JsonDB):
             min_rounds = 0
         if max_rounds is None:
             max_rounds = 1e9
-        return {k: v for k, v in self.ps_denoms.items()
-                if max_rounds >= v[2] >= min_rounds}
+        res = {}
+        for round_n, bucket in self._ps_denoms_by_rounds.items():
+            if max_rounds >= round_n >= min_rounds:
+                res.update(bucket)
+        return res
+
+    @locked
+    def get_ps_addr_roles(self, addr) -> Set[str]:
+        '''Return PS roles (PS_ROLE_* constants) of addr'''
+        return set(self._ps_addr_roles.get(addr, ()))
 
     @modifier  # do not use directly, use PSManager method of the same name
     def _add_ps_spending_denom(self, outpoint, uuid):
@@ -1239,11 +1373,15 @@ class WalletDB(JsonDB):
 
     @modifier
     def add_ps_spent_denom(self, outpoint, spent):
+        self._index_ps_outpoint(PS_ROLE_SPENT_DENOM, outpoint,
+                                self.ps_spent_denoms.get(outpoint), spent)
         self.ps_spent_denoms[outpoint] = spent
 
     @modifier
     def pop_ps_spent_denom(self, outpoint):
-        return self.ps_spent_denoms.pop(outpoint, None)
+        v = self.ps_spent_denoms.pop(outpoint, None)
+        self._index_ps_outpoint(PS_ROLE_SPENT_DENOM, outpoint, v, None)
+        return v
 
     @locked
     def get_ps_spent_denom(self, outpoint):
@@ -1255,11 +1393,15 @@ class WalletDB(JsonDB):
 
     @modifier
     def add_ps_other(self, outpoint, unknown):
+        self._index_ps_outpoint(PS_ROLE_OTHER, outpoint,
+                                self.ps_others.get(outpoint), unknown)
         self.ps_others[outpoint] = unknown
 
     @modifier
     def pop_ps_other(self, outpoint):
-        return self.ps_others.pop(outpoint, None)
+        v = self.ps_others.pop(outpoint, None)
+        self._index_ps_outpoint(PS_ROLE_OTHER, outpoint, v, None)
+        return v
 
     @locked
     def get_ps_other(self, outpoint):
@@ -1271,11 +1413,15 @@ class WalletDB(JsonDB):
 
     @modifier
     def add_ps_spent_other(self, outpoint, spent):
+        self._index_ps_outpoint(PS_ROLE_SPENT_OTHER, outpoint,
+                                self.ps_spent_others.get(outpoint), spent)
         self.ps_spent_others[outpoint] = spent
 
     @modifier
     def pop_ps_spent_other(self, outpoint):
-        return self.ps_spent_others.pop(outpoint, None)
+        v = self.ps_spent_others.pop(outpoint, None)
+        self._index_ps_outpoint(PS_ROLE_SPENT_OTHER, outpoint, v, None)
+        return v
 
     @locked
     def get_ps_spent_other(self, outpoint):
@@ -1287,11 +1433,15 @@ class WalletDB(JsonDB):
 
     @modifier
     def add_ps_spent_collateral(self, outpoint, spent_collateral):
+        self._index_ps_outpoint(PS_ROLE_SPENT_COLLATERAL, outpoint,
+                                self.ps_spent_collaterals.get(outpoint), spent_collateral)
         self.ps_spent_collaterals[outpoint] = spent_collateral
 
     @modifier
     def pop_ps_spent_collateral(self, outpoint):
-        return self.ps_spent_collaterals.pop(outpoint, None)
+        v = self.ps_spent_collaterals.pop(outpoint, None)
+        self._index_ps_outpoint(PS_ROLE_SPENT_COLLATERAL, outpoint, v, None)
+        return v
 
     @locked
     def get_ps_spent_collateral(self, outpoint):
@@ -1330,51 +1480,20 @@ class WalletDB(JsonDB):
         Limited by min_rounds (<0 for ps[_spent]_collaterals, ps_spent_denoms,
         ps_reserved, 0 for created denominations, 1 for 1 mix, and so forth).
         '''
-        ps_addr_list = []
-        denoms = self.get_ps_denoms(min_rounds=min_rounds).values()
-        if denoms:
-            ps_addr_list.extend(map(lambda x: x[0], denoms))
-
         if min_rounds is not None and min_rounds >= 0:
-            return set(ps_addr_list)
-
-        spent_denoms = self.get_ps_spent_denoms().values()
-        if spent_denoms:
-            ps_addr_list.extend(map(lambda x: x[0], spent_denoms))
-
-        collaterals = self.get_ps_collaterals().values()
-        if collaterals:
-            ps_addr_list.extend(map(lambda x: x[0], collaterals))
-
-        spent_collaterals = self.get_ps_spent_collaterals().values()
-        if spent_collaterals:
-            ps_addr_list.extend(map(lambda x: x[0], spent_collaterals))
-
-        others = self.get_ps_others().values()
-        if others:
-            ps_addr_list.extend(map(lambda x: x[0], others))
-
-        spent_others = self.get_ps_spent_others().values()
-        if spent_others:
-            ps_addr_list.extend(map(lambda x: x[0], spent_others))
-
-        ps_addr_list.extend(self.ps_reserved.keys())
-        return set(ps_addr_list)
+            return {v[0] for v in self.get_ps_denoms(min_rounds=min_rounds).values()}
+        if min_rounds is None:
+            return set(self._ps_addr_roles.keys())
+        # denoms with negative rounds are not in the index of addresses
+        res = {addr for addr, roles in self._ps_addr_roles.items()
+               if roles.keys() != {PS_ROLE_DENOM}}
+        res.update(v[0] for v in self.get_ps_denoms(min_rounds=min_rounds).values())
+        return res
 
     @locked
     def get_unspent_ps_addresses(self):
-        ps_addr_list = []
-        collaterals = self.get_ps_collaterals().values()
-        if collaterals:
-            ps_addr_list.extend(map(lambda x: x[0], collaterals))
-        denoms = self.get_ps_denoms().values()
-        if denoms:
-            ps_addr_list.extend(map(lambda x: x[0], denoms))
-        others = self.get_ps_others().values()
-        if others:
-            ps_addr_list.extend(map(lambda x: x[0], others))
-        ps_addr_list.extend(self.ps_reserved.keys())
-        return set(ps_addr_list)
+        return {addr for addr, roles in self._ps_addr_roles.items()
+                if not roles.keys() <= PS_SPENT_ROLES}
 
     @locked
     def list_verified_tx(self) -> Sequence[str]:
@@ -1398,6 +1517,13 @@ class WalletDB(JsonDB):
         assert isinstance(info, TxMinedInfo)
         self.verified_tx[txid] = (info.height, info.timestamp, info.txpos, info.header_hash)
 
+    @modifier
+    def add_verified_txs(self, infos: Dict[str, TxMinedInfo]):
+        for txid, info in infos.items():
+            assert isinstance(txid, str)
+            assert isinstance(info, TxMinedInfo)
+            self.verified_tx[txid] = (info.height, info.timestamp, info.txpos, info.header_hash)
+
     @modifier
     def remove_verified_tx(self, txid: str):
         assert isinstance(txid, str)
@@ -1458,6 +1584,8 @@ class WalletDB(JsonDB):
     @locked
     def get_num_ismine_inputs_of_tx(self, txid: str) -> int:
         assert isinstance(txid, str)
+        if self._tx_store:
+            return self._tx_store.get_num_ismine_inputs_of_tx(txid)
         txins = self.txi.get(txid, {})
         return sum([len(tupls) for addr, tupls in txins.items()])
 
@@ -1512,10 +1640,14 @@ class WalletDB(JsonDB):
         if ps_ks:
             self._ps_ks_addr_to_addr_index[addr] = \
                 (True, len(self.ps_ks_change_addrs))
+            self.mark_list_append(['ps_ks_addrs', 'change'],
+                                  len(self.ps_ks_change_addrs))
             self.ps_ks_change_addrs.append(addr)
         else:
             self._addr_to_addr_index[addr] = \
                 (True, len(self.change_addresses))
+            self.mark_list_append(['addresses', 'change'],
+                                  len(self.change_addresses))
             self.change_addresses.append(addr)
 
     @modifier
@@ -1524,10 +1656,14 @@ class WalletDB(JsonDB):
         if ps_ks:
             self._ps_ks_addr_to_addr_index[addr] = \
                 (False, len(self.ps_ks_receiving_addrs))
+            self.mark_list_append(['ps_ks_addrs', 'receiving'],
+                                  len(self.ps_ks_receiving_addrs))
             self.ps_ks_receiving_addrs.append(addr)
         else:
             self._addr_to_addr_index[addr] = \
                 (False, len(self.receiving_addresses))
+            self.mark_list_append(['addresses', 'receiving'],
+                                  len(self.receiving_addresses))
             self.receiving_addresses.append(addr)
 
     @locked
@@ -1594,17 +1730,16 @@ class WalletDB(JsonDB):
 
     @profiler
     def _load_transactions(self):
-        self.data = StoredDict(self.data, self, [])
+        # converting to StoredDict does not change data, do not track it
+        self._track_changes = False
+        try:
+            self.data = StoredDict(self.data, self, [])
+        finally:
+            self._track_changes = True
         # references in self.data
         # TODO make all these private
-        # txid -> address -> prev_outpoint -> value
-        self.txi = self.get_dict('txi')                          # type: Dict[str, Dict[str, Dict[str, int]]]
-        # txid -> address -> output_index -> (value, is_coinbase)
-        self.txo = self.get_dict('txo')                          # type: Dict[str, Dict[str, Dict[str, Tuple[int, bool]]]]
-        self.transactions = self.get_dict('transactions')        # type: Dict[str, Transaction]
-        self.spent_outpoints = self.get_dict('spent_outpoints')  # txid -> output_index -> next_txid
-        self.history = self.get_dict('addr_history')             # address -> list of (txid, height)
-        self.ps_ks_hist = self.get_dict('ps_ks_addr_hist')  # address -> list of (txid, height)
+        if not self.uses_sqlite_tx_store():
+            self._load_tx_maps()
         self.verified_tx = self.get_dict('verified_tx3')         # txid -> (height, timestamp, txpos, header_hash)
         self.islocks = self.get_dict('islocks')  # txid -> (height, timestamp)
         self.ps_txs = self.get_dict('ps_txs')  # txid -> (tx_type, completed)
@@ -1621,6 +1756,85 @@ class WalletDB(JsonDB):
         self.ps_spent_collaterals = self.get_dict('ps_spent_collaterals')  # outpoint -> (addr, val)
         self.ps_origin_addrs = self.get_dict('ps_origin_addrs')  # txid -> [addr, ...] new denoms/new collateral inputs
         self.tx_fees = self.get_dict('tx_fees')                  # type: Dict[str, TxFeesValue]
+        self._build_ps_indexes()
+
+    def _build_ps_indexes(self):
+        '''Build in-memory secondary indexes of ps_* dicts,
+        kept up to date by the methods modifying these dicts'''
+        # address -> PS role -> number of ps_* entries with that address
+        self._ps_addr_roles = {}  # type: Dict[str, Dict[str, int]]
+        # round_n -> outpoint -> (addr, val, round_n)
+        self._ps_denoms_by_rounds = {}  # type: Dict[int, Dict[str, Tuple[str, int, int]]]
+        # data -> addresses in ps_reserved order
+        self._ps_reserved_by_data = {}  # type: Dict[Any, Dict[str, None]]
+        for role, d in self._ps_outpoint_dicts_by_role().items():
+            for outpoint, v in d.items():
+                self._index_ps_outpoint(role, outpoint, None, v)
+        for addr, data in self.ps_reserved.items():
+            self._index_ps_reserved(addr, None, data)
+
+    def _ps_outpoint_dicts_by_role(self):
+        return {
+            PS_ROLE_DENOM: self.ps_denoms,
+            PS_ROLE_SPENT_DENOM: self.ps_spent_denoms,
+            PS_ROLE_COLLATERAL: self.ps_collaterals,
+            PS_ROLE_SPENT_COLLATERAL: self.ps_spent_collaterals,
+            PS_ROLE_OTHER: self.ps_others,
+            PS_ROLE_SPENT_OTHER: self.ps_spent_others,
+        }
+
+    def _index_ps_addr_role(self, addr, role, add: bool):
+        roles = self._ps_addr_roles.setdefault(addr, {})
+        cnt = roles.get(role, 0) + (1 if add else -1)
+        if cnt > 0:
+            roles[role] = cnt
+        else:
+            roles.pop(role, None)
+            if not roles:
+                self._ps_addr_roles.pop(addr, None)
+
+    def _index_ps_outpoint(self, role, outpoint, old_v, new_v):
+        '''Update indexes after ps_* dict of role changed
+        outpoint value from old_v to new_v (None if absent)'''
+        if old_v is not None:
+            self._index_ps_addr_role(old_v[0], role, False)
+            if role == PS_ROLE_DENOM:
+                bucket = self._ps_denoms_by_rounds.get(old_v[2], {})
+                bucket.pop(outpoint, None)
+                if not bucket:
+                    self._ps_denoms_by_rounds.pop(old_v[2], None)
+        if new_v is not None:
+            self._index_ps_addr_role(new_v[0], role, True)
+            if role == PS_ROLE_DENOM:
+                bucket = self._ps_denoms_by_rounds.setdefault(new_v[2], {})
+                bucket[outpoint] = new_v
+
+    @staticmethod
+    def _ps_reserved_key(data):
+        return tuple(data) if isinstance(data, list) else data
+
+    def _index_ps_reserved(self, addr, old_data, new_data, *, removed=False):
+        if old_data is not None or removed:
+            key = self._ps_reserved_key(old_data)
+            addrs = self._ps_reserved_by_data.get(key, {})
+            addrs.pop(addr, None)
+            if not addrs:
+                self._ps_reserved_by_data.pop(key, None)
+            self._index_ps_addr_role(addr, PS_ROLE_RESERVED, False)
+        if not removed:
+            key = self._ps_reserved_key(new_data)
+            self._ps_reserved_by_data.setdefault(key, {})[addr] = None
+            self._index_ps_addr_role(addr, PS_ROLE_RESERVED, True)
+
+    def _load_tx_maps(self):
+        # txid -> address -> prev_outpoint -> value
+        self.txi = self.get_dict('txi')                          # type: Dict[str, Dict[str, Dict[str, int]]]
+        # txid -> address -> output_index -> (value, is_coinbase)
+        self.txo = self.get_dict('txo')                          # type: Dict[str, Dict[str, Dict[str, Tuple[int, bool]]]]
+        self.transactions = self.get_dict('transactions')        # type: Dict[str, Transaction]
+        self.spent_outpoints = self.get_dict('spent_outpoints')  # txid -> output_index -> next_txid
+        self.history = self.get_dict('addr_history')             # address -> list of (txid, height)
+        self.ps_ks_hist = self.get_dict('ps_ks_addr_hist')  # address -> list of (txid, height)
         # scripthash -> set of (outpoint, value)
         self._prevouts_by_scripthash = self.get_dict('prevouts_by_scripthash')  # type: Dict[str, Set[Tuple[str, int]]]
         # remove unreferenced tx
@@ -1636,17 +1850,84 @@ class WalletDB(JsonDB):
                     self.logger.info("removing unreferenced spent outpoint")
                     d.pop(prevout_n)
 
+    def uses_sqlite_tx_store(self) -> bool:
+        return self.get('tx_store') == 'sqlite'
+
+    @locked
+    def open_sqlite_tx_store(self, path: str) -> None:
+        """Open tables of db converted with convert_tx_store_to_sqlite.
+        Must be called before the db is used by wallet."""
+        assert self.uses_sqlite_tx_store()
+        if self._tx_store:
+            return
+        if not os.path.exists(path):
+            raise WalletFileException(f'Transactions database not found: {path}')
+        self._tx_store = SqliteTxStore(path)
+        for tx_hash in self._tx_store.remove_unreferenced_transactions():
+            self.logger.info(f"removing unreferenced tx: {tx_hash}")
+        if self._tx_store.remove_unreferenced_spent_outpoints():
+            self.logger.info("removing unreferenced spent outpoints")
+
+    @modifier
+    def convert_tx_store_to_sqlite(self, path: str) -> None:
+        """Move txi, txo, transactions, history, spent_outpoints and
+        prevouts_by_scripthash to sqlite db at path"""
+        if self.uses_sqlite_tx_store():
+            raise WalletFileException('Transactions are already stored in sqlite db')
+        if os.path.exists(path):
+            raise WalletFileException(f'File already exists: {path}')
+        tx_store = SqliteTxStore(path)
+        tx_store.import_from_json({k: self.data.get(k, {})
+                                   for k in SQLITE_TX_STORE_KEYS})
+        for k in SQLITE_TX_STORE_KEYS:
+            self.data.pop(k, None)
+        for attr_name in ['txi', 'txo', 'transactions', 'spent_outpoints',
+                          'history', 'ps_ks_hist', '_prevouts_by_scripthash']:
+            delattr(self, attr_name)
+        self._tx_store = tx_store
+        self.put('tx_store', 'sqlite')
+        self._journal_needs_snapshot = True
+
+    @locked
+    def dump_with_tx_store(self) -> str:
+        """Serializes the DB, including data stored in sqlite db"""
+        if not self._tx_store:
+            return self.dump()
+        data = dict(self.data)
+        data.pop('tx_store', None)
+        data.update(self._tx_store.export_to_json())
+        return json.dumps(data, indent=4, sort_keys=True, cls=JsonDBJsonEncoder)
+
+    @modifier
+    def convert_tx_store_to_json(self) -> None:
+        """Move data from sqlite db back to the wallet file. The sqlite db
+        file is left untouched, it can be removed after the db is written"""
+        if not self.uses_sqlite_tx_store():
+            raise WalletFileException('Transactions are already stored in wallet file')
+        assert self._tx_store, 'sqlite db is not opened'
+        data = self._tx_store.export_to_json()
+        self._tx_store.close()
+        self._tx_store = None
+        for k, v in data.items():
+            self.data[k] = v
+        self.put('tx_store', None)
+        self._load_tx_maps()
+        self._journal_needs_snapshot = True
+
     @modifier
     def clear_history(self):
-        self.txi.clear()
-        self.txo.clear()
-        self.spent_outpoints.clear()
-        self.transactions.clear()
-        self.history.clear()
-        self.ps_ks_hist.clear()
+        if self._tx_store:
+            self._tx_store.clear()
+        else:
+            self.txi.clear()
+            self.txo.clear()
+            self.spent_outpoints.clear()
+            self.transactions.clear()
+            self.history.clear()
+            self.ps_ks_hist.clear()
+            self._prevouts_by_scripthash.clear()
         self.verified_tx.clear()
         self.tx_fees.clear()
-        self._prevouts_by_scripthash.clear()
         self.clear_ps_data()
 
     @modifier
@@ -1667,6 +1948,7 @@ class WalletDB(JsonDB):
         self.ps_spent_denoms.clear()
         self.ps_others.clear()
         self.ps_spent_others.clear()
+        self._build_ps_indexes()
 
     def _convert_dict(self, path, key, v):
         if key == 'transactions':
@@ -1706,10 +1988,25 @@ class WalletDB(JsonDB):
             return
         if not self.modified():
             return
+        if self._tx_store:
+            self._tx_store.commit()
+        if self._can_append_to_journal(storage):
+            ops = self.pop_journal_ops()
+            if ops:
+                storage.append(json.dumps(ops, cls=JsonDBJsonEncoder))
+            self.set_modified(False)
+            return
         json_str = self.dump(human_readable=not storage.is_encrypted())
         storage.write(json_str)
+        self.clear_journal_ops()
+        self._journal_needs_snapshot = False
         self.set_modified(False)
 
+    def _can_append_to_journal(self, storage: 'WalletStorage') -> bool:
+        return (storage.use_journal
+                and not self._journal_needs_snapshot
+                and storage.can_append())
+
     def is_ready_to_be_used_by_wallet(self):
         return not self.requires_upgrade() and self._called_after_upgrade_tasks
 
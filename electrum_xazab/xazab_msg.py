@@ -27,7 +27,7 @@
 from collections import namedtuple
 from enum import IntEnum
 from ipaddress import ip_address
-from struct import pack
+from struct import pack, unpack_from, calcsize, error as StructError
 
 from .crypto import sha256d
 from .bitcoin import hash160_to_p2pkh, b58_address_to_hash160
@@ -326,49 +326,97 @@ class XazabInventory(namedtuple('XazabInventory', 'type hash')):
 
 
 class XazabCmd:
-    '''Class representing Xazab network message packed with msg header cmd'''
-
-    def __init__(self, cmd, payload=None):
-        lcmd = cmd.lower()
+    '''Class representing Xazab network message packed with msg header cmd
+
+    The payload is kept raw and decoded on first access to payload attr,
+    so msgs which are dropped after checking some header-level fields
+    (inv_items, islock_txid, dsq_ready) are never decoded fully.
+    '''
+
+    def __init__(self, cmd, payload=None, on_decode_error=None):
+        self.cmd = cmd.lower()
+        self.raw_payload = payload
+        self._payload = None
+        self._decoded = False
+        # called with (xazab_cmd, exception) if payload decoding fails,
+        # used to drop the peer which sent the malformed msg
+        self.on_decode_error = on_decode_error
+
+    @property
+    def payload(self):
+        if not self._decoded:
+            try:
+                self._payload = self._decode_payload()
+            except Exception as e:
+                if self.on_decode_error is not None:
+                    self.on_decode_error(self, e)
+                raise XazabMsgError(f'{self.cmd} msg: payload decoding'
+                                    f' failed: {repr(e)}') from e
+            self._decoded = True
+        return self._payload
+
+    def _decode_payload(self):
+        msg_cls = PAYLOAD_CLASSES.get(self.cmd)
+        if msg_cls is None:
+            return self.raw_payload
         vds = BCDataStream()
-        vds.clear_and_set_bytes(payload)
-        if lcmd == 'version':
-            self.payload = XazabVersionMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'ping':
-            self.payload = XazabPingMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'pong':
-            self.payload = XazabPongMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'addr':
-            self.payload = XazabAddrMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'inv':
-            self.payload = XazabInvMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'spork':
-            self.payload = XazabSporkMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'islock':
-            self.payload = XazabISLockMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'mnlistdiff':
-            self.payload = XazabMNListDiffMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'qfcommit':
-            self.payload = XazabQFCommitMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'senddsq':
-            self.payload = XazabSendDsqMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'dsa':
-            self.payload = XazabDsaMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'dsc':
-            self.payload = XazabDscMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'dsf':
-            self.payload = XazabDsfMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'dsi':
-            self.payload = XazabDsiMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'dsq':
-            self.payload = XazabDsqMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'dss':
-            self.payload = XazabDssMsg.read_vds(vds, alone_data=True)
-        elif lcmd == 'dssu':
-            self.payload = XazabDssuMsg.read_vds(vds, alone_data=True)
-        else:
-            self.payload = payload
-        self.cmd = lcmd
+        vds.clear_and_set_bytes(self._raw_view())
+        return msg_cls.read_vds(vds, alone_data=True)
+
+    def _raw_view(self):
+        if self.raw_payload is None:
+            return None
+        return memoryview(self.raw_payload)
+
+    def _read_compact_size(self, raw, offset):
+        '''Return compact size read at offset and offset after it'''
+        try:
+            size = raw[offset]
+            if size < 253:
+                return size, offset + 1
+            fmt = {253: '<H', 254: '<I', 255: '<Q'}[size]
+            return unpack_from(fmt, raw, offset + 1)[0], offset + 1 + calcsize(fmt)
+        except (IndexError, StructError) as e:
+            raise SerializationError('attempt to read past end of buffer') from e
+
+    def inv_items(self):
+        '''Yield (type, hash) of inv/getdata entries without full decode'''
+        assert self.cmd in ('inv', 'getdata'), f'no inventory in {self.cmd}'
+        raw = self._raw_view()
+        if raw is None:
+            raise SerializationError('empty inventory msg')
+        inv_cnt, offset = self._read_compact_size(raw, 0)
+        if inv_cnt > MAX_INV_ENTRIES:
+            raise XazabMsgError(f'{self.cmd} msg: too long inventory')
+        if len(raw) != offset + inv_cnt * 36:
+            raise SerializationError(f'{self.cmd} msg: wrong payload size')
+        for inv_i in range(inv_cnt):
+            inv_type = unpack_from('<I', raw, offset)[0]
+            yield inv_type, raw[offset+4:offset+36].tobytes()
+            offset += 36
+
+    @property
+    def islock_txid(self) -> bytes:
+        '''txid of islock msg without full decode'''
+        assert self.cmd == 'islock', f'no islock txid in {self.cmd}'
+        raw = self._raw_view()
+        if raw is None:
+            raise SerializationError('empty islock msg')
+        in_cnt, offset = self._read_compact_size(raw, 0)
+        offset += in_cnt * 36
+        if len(raw) < offset + 32:
+            raise SerializationError('attempt to read past end of buffer')
+        return raw[offset:offset+32].tobytes()
+
+    @property
+    def dsq_ready(self) -> bool:
+        '''fReady of dsq msg without full decode'''
+        assert self.cmd == 'dsq', f'no fReady in {self.cmd}'
+        raw = self._raw_view()
+        offset = 4 + 36 + 8  # nDenom, masternodeOutPoint, nTime
+        if raw is None or len(raw) <= offset:
+            raise SerializationError('attempt to read past end of buffer')
+        return bool(raw[offset])
 
     def __str__(self):
         if not self.payload:
@@ -1304,3 +1352,25 @@ class XazabDscMsg(XazabMsgBase):
             pack('<i', self.sessionID) +                # sessionID
             pack('<i', self.messageID)                  # messageID
         )
+
+
+# msg classes to decode XazabCmd payloads by command
+PAYLOAD_CLASSES = {
+    'version': XazabVersionMsg,
+    'ping': XazabPingMsg,
+    'pong': XazabPongMsg,
+    'addr': XazabAddrMsg,
+    'inv': XazabInvMsg,
+    'spork': XazabSporkMsg,
+    'islock': XazabISLockMsg,
+    'mnlistdiff': XazabMNListDiffMsg,
+    'qfcommit': XazabQFCommitMsg,
+    'senddsq': XazabSendDsqMsg,
+    'dsa': XazabDsaMsg,
+    'dsc': XazabDscMsg,
+    'dsf': XazabDsfMsg,
+    'dsi': XazabDsiMsg,
+    'dsq': XazabDsqMsg,
+    'dss': XazabDssMsg,
+    'dssu': XazabDssuMsg,
+}
@@ -26,6 +26,7 @@
 
 import asyncio
 import gzip
+import heapq
 import json
 import os
 import queue
@@ -44,8 +45,7 @@ from .constants import CHUNK_SIZE
 from .blockchain import MissingHeader
 from .xazab_peer import XazabPeer
 from .xazab_msg import SporkID, LLMQType
-from .xazab_ps_net import PSDenoms, PRIVATESEND_QUEUE_TIMEOUT
-from .xazab_tx import str_ip
+from .xazab_ps_net import PSMixCoordinator
 from .i18n import _
 from .logging import Logger
 from .simple_config import SimpleConfig
@@ -67,6 +67,8 @@ ALLOWED_HOSTNAME_RE = re.compile(r'(?!-)[A-Z\d-]{1,63}(?<!-)$', re.IGNORECASE)
 INSTANCE = None
 
 IS_LLMQ_TYPE = LLMQType.LLMQ_50_60
+RECENT_ISLOCKS_KEEP_SEC = 900  # 2.5 minutes * 6 = 900
+ISLOCKS_AGGR_VERIFY_MAX = 32  # max islocks verified by one aggregated sig
 
 
 def is_valid_hostname(hostname):
@@ -162,6 +164,146 @@ class XazabSporks:
         return res
 
 
+class XazabMsgStats:
+    '''Counters and handling latency histograms of received msgs by command'''
+
+    # upper bounds of latency histogram buckets in ms, the last is unbounded
+    LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.received = defaultdict(int)
+            self.ignored = defaultdict(int)
+            self.queue_full = defaultdict(int)
+            self.handled = defaultdict(int)
+            self.latency_sum = defaultdict(float)
+            self.latency_max = defaultdict(float)
+            self.latency_hist = defaultdict(lambda: [0] * (len(self.LATENCY_BUCKETS) + 1))
+
+    def on_msg_received(self, cmd, ignored=False):
+        with self.lock:
+            self.received[cmd] += 1
+            if ignored:
+                self.ignored[cmd] += 1
+
+    def on_queue_full(self, cmd):
+        with self.lock:
+            self.queue_full[cmd] += 1
+
+    def on_msg_handled(self, cmd, latency):
+        '''latency is seconds from receiving msg to end of its handling'''
+        ms = latency * 1000
+        with self.lock:
+            self.handled[cmd] += 1
+            self.latency_sum[cmd] += ms
+            self.latency_max[cmd] = max(self.latency_max[cmd], ms)
+            hist = self.latency_hist[cmd]
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if ms <= bound:
+                    hist[i] += 1
+                    break
+            else:
+                hist[-1] += 1
+
+    def as_dict(self):
+        res = {}
+        with self.lock:
+            for cmd, received in self.received.items():
+                handled = self.handled.get(cmd, 0)
+                hist = self.latency_hist.get(cmd)
+                latency_sum = self.latency_sum.get(cmd, 0)
+                res[cmd] = {
+                    'received': received,
+                    'ignored': self.ignored.get(cmd, 0),
+                    'queue_full': self.queue_full.get(cmd, 0),
+                    'handled': handled,
+                    'latency_avg_ms': (round(latency_sum / handled, 3)
+                                       if handled else None),
+                    'latency_max_ms': round(self.latency_max.get(cmd, 0), 3),
+                    'latency_hist_ms': dict(zip([f'<={b}' for b in self.LATENCY_BUCKETS]
+                                                + [f'>{self.LATENCY_BUCKETS[-1]}'],
+                                                hist or [])),
+                }
+        return res
+
+
+class XazabRecentISLocks:
+    '''Recent verified islocks indexed by txid, expired by time'''
+
+    def __init__(self, keep_sec=RECENT_ISLOCKS_KEEP_SEC):
+        self.keep_sec = keep_sec
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # txid -> deque of (time, islock, quorum, request_id)
+            self.by_txid = {}
+            self.expiry = []  # heap of (time, txid)
+            self.added = 0
+            self.expired = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.expiry)
+
+    def add(self, txid, islock, quorum, request_id, t=None):
+        t = time.time() if t is None else t
+        with self.lock:
+            entries = self.by_txid.get(txid)
+            if entries is None:
+                entries = self.by_txid[txid] = deque()
+            entries.append((t, islock, quorum, request_id))
+            heapq.heappush(self.expiry, (t, txid))
+            self.added += 1
+
+    def has_islock(self, txid):
+        with self.lock:
+            self._expire(time.time())
+            if txid in self.by_txid:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def get(self, txid):
+        '''Return list of (time, islock, quorum, request_id) for txid'''
+        with self.lock:
+            return list(self.by_txid.get(txid, []))
+
+    def expire(self, now=None):
+        with self.lock:
+            self._expire(time.time() if now is None else now)
+
+    def _expire(self, now):
+        keep_from = now - self.keep_sec
+        expiry = self.expiry
+        by_txid = self.by_txid
+        while expiry and expiry[0][0] < keep_from:
+            t, txid = heapq.heappop(expiry)
+            entries = by_txid[txid]
+            entries.popleft()  # entries of txid are added in time order
+            if not entries:
+                del by_txid[txid]
+            self.expired += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'islocks': len(self.expiry),
+                'txids': len(self.by_txid),
+                'added': self.added,
+                'expired': self.expired,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
 class XazabNet(Logger):
     '''The XazabNet class manages a set of connections to remote peers
     each connected peer is handled by an XazabPeer() object.
@@ -222,13 +364,18 @@ class XazabNet(Logger):
 
         # Recent islocks data
         self.recent_islock_invs = deque([], 200)
-        self.recent_islocks_lock = threading.Lock()
-        self.recent_islocks_clear = time.time()
-        self.recent_islocks = list()
-
-        # Recent broadcasted dsq data
-        self.recent_dsq = deque([], 100)
-        self.recent_dsq_hashes = deque([], 50)  # added from network broadcasts
+        self.recent_islocks = XazabRecentISLocks()  # verified islocks
+        # islocks for txids not known to wallets, verified on demand
+        self.unverified_islocks = XazabRecentISLocks()
+        # islocks waiting for batch verification
+        self.pending_islocks_lock = threading.Lock()
+        self.pending_islocks = list()
+        self.verify_islocks_scheduled = False
+        # wallets checks if islock txid is wanted for eager verification
+        self.islock_wanted_checks = list()
+
+        # PrivateSend mixing of all wallets, recent broadcasted dsq data
+        self.mix_coordinator = PSMixCoordinator(self)
 
         # Activity data
         self.read_bytes = 0
@@ -237,6 +384,9 @@ class XazabNet(Logger):
         self.write_time = 0
         self.set_spork_time = 0
 
+        # Received msgs counters and handling latency
+        self.msg_stats = XazabMsgStats()
+
         # Dump network messages. Set at runtime from the console.
         self.debug = False
 
@@ -339,81 +489,115 @@ class XazabNet(Logger):
         else:
             return 'xazab_net_off.png'
 
-    def append_to_recent_islocks(self, islock):
-        request_id = islock.calc_request_id()
-        mn_list = self.network.mn_list
-        quorum = mn_list.calc_responsible_quorum(IS_LLMQ_TYPE, request_id)
-        if quorum is None:
-            self.logger.info('no forum found to verify islock')
-            return
-        txid = bh2u(islock.txid[::-1])
-        with self.recent_islocks_lock:
-            self.recent_islocks.append((txid,
-                                        time.time(),
-                                        islock,
-                                        quorum,
-                                        request_id))
-        self.clear_recent_islocks()
-        util.trigger_callback('xazab-islock', txid)
+    def register_islock_wanted_check(self, check):
+        with self.pending_islocks_lock:
+            self.islock_wanted_checks.append(check)
 
-    def verify_on_recent_islocks(self, txid):
-        found = list(filter(lambda x: x[0] == txid, self.recent_islocks))
-        found_cnt = len(found)
-        self.logger.info(f'found {found_cnt} islocks in recent for {txid}')
-        for txid, t, islock, quorum, request_id in found:
-            v_ok = self.verify_islock(islock, quorum, request_id)
-            if v_ok:
-                self.logger.info(f'verify islock ok: {txid}')
-                return True
-            else:
-                self.logger.info(f'verify islock failed: {txid}')
-        return False
+    def unregister_islock_wanted_check(self, check):
+        with self.pending_islocks_lock:
+            if check in self.islock_wanted_checks:
+                self.islock_wanted_checks.remove(check)
 
-    def clear_recent_islocks(self, keep_sec=900):  # 2.5 minutes * 6 = 900
-        now = time.time()
-        if now - self.recent_islocks_clear < keep_sec/15:  # clean each 60 secs
-            return
-        with self.recent_islocks_lock:
-            self.recent_islocks = list(filter(lambda x: now - x[1] < keep_sec,
-                                              self.recent_islocks))
-            self.recent_islocks_clear = now
+    def is_islock_wanted(self, txid):
+        with self.pending_islocks_lock:
+            checks = list(self.islock_wanted_checks)
+        return any(check(txid) for check in checks)
 
-    def add_recent_dsq(self, dsq):
-        nDenom = dsq.nDenom
-        if nDenom not in list(PSDenoms):
-            return
-        dsq_hash = f'{nDenom}:{dsq.masternodeOutPoint}:{dsq.nTime}'
-        if dsq_hash in self.recent_dsq_hashes:
+    def append_to_recent_islocks(self, islock):
+        txid = bh2u(islock.txid[::-1])
+        if not self.is_islock_wanted(txid):
+            # verified later in verify_on_recent_islocks if tx is added
+            self.unverified_islocks.add(txid, islock, None, None)
+            self.unverified_islocks.expire()
             return
-        self.recent_dsq_hashes.append(dsq_hash)
-        self.recent_dsq.appendleft(dsq)
-        self.logger.info(f'added recent dsq, queue length:'
-                         f' {len(self.recent_dsq)}')
+        with self.pending_islocks_lock:
+            self.pending_islocks.append(islock)
+            if self.verify_islocks_scheduled:
+                return
+            self.verify_islocks_scheduled = True
+        coro = self.verify_pending_islocks()
+        asyncio.run_coroutine_threadsafe(coro, self.loop)
 
-    def is_suitable_dsq(self, dsq, recent_mixes_mns):
+    async def verify_pending_islocks(self):
+        '''Verify islocks gathered while previous batch was verified'''
+        try:
+            while True:
+                with self.pending_islocks_lock:
+                    pending = self.pending_islocks
+                    self.pending_islocks = []
+                    if not pending:
+                        self.verify_islocks_scheduled = False
+                        return
+                verified = await self.loop.run_in_executor(
+                    None, self.verify_islocks_batch, pending)
+                for txid in verified:
+                    util.trigger_callback('xazab-islock', txid)
+        except BaseException:
+            with self.pending_islocks_lock:
+                self.verify_islocks_scheduled = False
+            raise
+
+    def verify_islocks_batch(self, islocks):
+        '''Verify islocks grouped by responsible quorum, add verified ones
+        to recent islocks, return list of verified txids'''
+        mn_list = self.network.mn_list
         now = time.time()
-        if now - dsq.nTime > PRIVATESEND_QUEUE_TIMEOUT:
-            self.logger.info(f'is_suitable_dsq: to late to use'
-                             f' {dsq.masternodeOutPoint}')
-            return False
-        outpoint = str(dsq.masternodeOutPoint)
-        sml_entry = self.network.mn_list.get_mn_by_outpoint(outpoint)
-        if not sml_entry:
-            self.logger.info(f'is_suitable_dsq: dsq with unknown'
-                             f' outpoint {dsq.masternodeOutPoint}')
-            return False
-        peer_str = f'{str_ip(sml_entry.ipAddress)}:{sml_entry.port}'
-        if peer_str in recent_mixes_mns:
-            self.logger.info(f'is_suitable_dsq: recently used'
-                             f' for mixing {peer_str}')
-            return False
-        return True
+        by_quorum = defaultdict(list)
+        for islock in islocks:
+            request_id = islock.calc_request_id()
+            quorum = mn_list.calc_responsible_quorum(IS_LLMQ_TYPE, request_id)
+            if quorum is None:
+                self.logger.info('no forum found to verify islock')
+                continue
+            txid = bh2u(islock.txid[::-1])
+            entry = (txid, now, islock, quorum, request_id)
+            by_quorum[quorum.quorumPublicKey].append(entry)
+
+        verified = []
+        for quorum_entries in by_quorum.values():
+            for i in range(0, len(quorum_entries), ISLOCKS_AGGR_VERIFY_MAX):
+                entries = quorum_entries[i:i+ISLOCKS_AGGR_VERIFY_MAX]
+                if len(entries) > 1 and self.verify_islocks_aggregated(entries):
+                    verified.extend(entries)
+                    continue
+                # on aggregated sig failure find out failed islocks
+                for entry in entries:
+                    txid, t, islock, quorum, request_id = entry
+                    try:
+                        v_ok = self.verify_islock(islock, quorum, request_id)
+                    except Exception as e:
+                        self.logger.info(f'verify islock error: {repr(e)}')
+                        v_ok = False
+                    if v_ok:
+                        verified.append(entry)
+                    else:
+                        self.logger.info(f'verify islock failed: {txid}')
+        recent_islocks = self.recent_islocks
+        for txid, t, islock, quorum, request_id in verified:
+            recent_islocks.add(txid, islock, quorum, request_id, t)
+        recent_islocks.expire()
+        return [entry[0] for entry in verified]
+
+    def get_recent_islocks_stats(self):
+        return self.recent_islocks.as_dict()
+
+    def verify_on_recent_islocks(self, txid):
+        v_ok = self.recent_islocks.has_islock(txid)
+        if not v_ok:
+            islocks = [e[1] for e in self.unverified_islocks.get(txid)]
+            if islocks:
+                v_ok = txid in self.verify_islocks_batch(islocks)
+        if v_ok:
+            self.logger.info(f'verify islock ok: {txid}')
+        return v_ok
+
+    def add_recent_dsq(self, dsq):
+        if self.mix_coordinator.add_dsq(dsq):
+            util.trigger_callback('xazab-dsq', dsq)
 
-    def get_recent_dsq(self, recent_mixes_mns):
-        while len(self.recent_dsq) > 0:
-            dsq = self.recent_dsq.popleft()
-            if self.is_suitable_dsq(dsq, recent_mixes_mns):
-                return dsq
+    def get_mix_stats(self):
+        '''PrivateSend mixing sessions stats of all wallets'''
+        return self.mix_coordinator.as_dict()
 
     @log_exceptions
     async def set_parameters(self):
@@ -475,12 +659,17 @@ class XazabNet(Logger):
             self.logger.info(f'exc during main_taskgroup cancellation: '
                              f'{repr(e)}')
         self.main_taskgroup = None  # type: TaskGroup
+        self.mix_coordinator.close_idle_peers()
         self.peeers = {}  # type: Dict[str, XazabPeer]
         self.connecting.clear()
         self.peers_queue = None
         if not full_shutdown:
             util.trigger_callback('xazab-net-updated', 'disabled')
 
+    def get_msg_stats(self):
+        '''Received msgs stats by command from all peers'''
+        return self.msg_stats.as_dict()
+
     def run_from_another_thread(self, coro):
         assert self._loop_thread != threading.current_thread(), NET_THREAD_MSG
         fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
@@ -751,6 +940,29 @@ class XazabNet(Logger):
         else:
             return bfh(block_hash)[::-1]
 
+    @staticmethod
+    def verify_islocks_aggregated(entries):
+        '''Verify aggregated signature of islocks signed by one quorum'''
+        pubk = bls.PublicKey.from_bytes(entries[0][3].quorumPublicKey)
+        sigs = []
+        msg_hashes = set()
+        for txid, t, islock, quorum, request_id in entries:
+            msg_hash = islock.msg_hash(quorum, request_id)
+            if msg_hash in msg_hashes:  # same msg is verified separately
+                return False
+            msg_hashes.add(msg_hash)
+            try:
+                sig = bls.Signature.from_bytes(islock.sig)
+            except Exception:
+                return False
+            aggr_info = bls.AggregationInfo.from_msg_hash(pubk, msg_hash)
+            sig.set_aggregation_info(aggr_info)
+            sigs.append(sig)
+        try:
+            return bls.BLS.verify(bls.BLS.aggregate_sigs(sigs))
+        except Exception:
+            return False
+
     @staticmethod
     def verify_islock(islock, quorum, request_id):
         msg_hash = islock.msg_hash(quorum, request_id)
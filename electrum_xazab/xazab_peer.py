@@ -36,7 +36,8 @@ from .bitcoin import public_key_to_p2pkh
 from .crypto import sha256d
 from .xazab_msg import (SporkID, XazabType, XazabCmd, XazabVersionMsg,
                        XazabPingMsg, XazabPongMsg, XazabGetDataMsg,
-                       XazabGetMNListDMsg, XazabSendDsqMsg)
+                       XazabGetMNListDMsg, XazabSendDsqMsg,
+                       XazabInventory)
 from .ecc import ECPubkey
 from .interface import GracefulDisconnect
 from .logging import Logger
@@ -50,6 +51,24 @@ XAZAB_PROTO_VERSION = 70216
 LOCAL_IP_ADDR = ipaddress.ip_address('127.0.0.1')
 PAYLOAD_LIMIT = 32*2**20  # 32MiB
 READ_LIMIT = 64*2**10     # 64KiB
+# Received msgs are put to the queue of its command and handled by one task
+# per queue as soon as they arrive. Msgs in one queue are handled in order
+# of arrival, while slow handlers do not hold up other queues. When a queue
+# is full reading from the peer waits for free space in it.
+MSG_QUEUES = {
+    'ping': 'control',
+    'pong': 'control',
+    'addr': 'control',
+    'mnlistdiff': 'control',
+    'spork': 'spork',
+    'inv': 'inv',
+    'islock': 'islock',
+    'dsq': 'ds',
+    'dssu': 'ds',
+    'dsf': 'ds',
+    'dsc': 'ds',
+}
+MSG_QUEUE_SIZE = 100
 
 
 def deserialize_peer(peer_str: str) -> Tuple[str, str]:
@@ -110,6 +129,22 @@ class XazabPeer(Logger):
         self.write_bytes = 0
         self.write_time = 0
 
+        # Received msgs dispatch table and queues
+        self.msg_handlers = {
+            'ping': self.on_ping,
+            'pong': self.on_pong,
+            'spork': self.on_spork,
+            'inv': self.on_inv,
+            'addr': self.on_addr,
+            'mnlistdiff': self.on_mnlistdiff,
+            'islock': self.on_islock,
+            'dsq': self.on_dsq,
+            'dssu': self.on_mix_session_msg,
+            'dsf': self.on_mix_session_msg,
+            'dsc': self.on_mix_session_msg,
+        }
+        self.msg_queues = {}  # queue name -> asyncio.Queue
+
         self.ban_msg = None
         self.ban_till = None
 
@@ -177,7 +212,10 @@ class XazabPeer(Logger):
             if not res:
                 continue
             if res.cmd == 'version':
-                self.version = res.payload
+                try:
+                    self.version = res.payload
+                except Exception as e:
+                    raise GracefulDisconnect(e) from e
                 version_received = True
                 await self.send_msg('verack')
             elif res.cmd == 'verack':
@@ -190,6 +228,10 @@ class XazabPeer(Logger):
         self.logger.info(f'connection established')
         try:
             async with self.group as group:
+                for queue_name in sorted(set(MSG_QUEUES.values())):
+                    msg_queue = asyncio.Queue(MSG_QUEUE_SIZE)
+                    self.msg_queues[queue_name] = msg_queue
+                    await group.spawn(self.handle_msgs(msg_queue))
                 await group.spawn(self.process_msgs)
                 await group.spawn(self.process_ping)
                 await group.spawn(self.monitor_connection)
@@ -201,84 +243,103 @@ class XazabPeer(Logger):
             raise GracefulDisconnect(e, log_level=logging.ERROR) from e
 
     async def process_msgs(self):
+        msg_stats = self.xazab_net.msg_stats
         while True:
             res = await self.read_next_msg()
-            if res:
-                xazab_net = self.xazab_net
-                cmd = res.cmd
+            if not res:
+                continue
+            cmd = res.cmd
+            msg_queue = self.msg_queues.get(MSG_QUEUES.get(cmd))
+            if msg_queue is None:
+                msg_stats.on_msg_received(cmd, ignored=True)
+                continue
+            msg_stats.on_msg_received(cmd)
+            if msg_queue.full():
+                msg_stats.on_queue_full(cmd)
+            await msg_queue.put((time.monotonic(), res))
+
+    async def handle_msgs(self, msg_queue: asyncio.Queue):
+        msg_stats = self.xazab_net.msg_stats
+        while True:
+            received_at, res = await msg_queue.get()
+            await self.msg_handlers[res.cmd](res)
+            msg_stats.on_msg_handled(res.cmd, time.monotonic() - received_at)
+
+    async def on_ping(self, res):
+        msg = XazabPongMsg(res.payload.nonce)
+        await self.send_msg('pong', msg.serialize())
+
+    async def on_pong(self, res):
+        now = time.time()
+        if res.payload.nonce == self.ping_nonce:
+            self.ping_time = round((now - self.ping_start) * 1000)
+            self.ping_nonce = None
+            self.ping_start = None
+        else:
+            self.logger.info(f'pong with unknonw nonce')
+
+    async def on_spork(self, res):
+        xazab_net = self.xazab_net
+        spork_msg = res.payload
+        spork_id = spork_msg.nSporkID
+        if not SporkID.has_value(spork_id):
+            self.logger.info(f'unknown spork id: {spork_id}')
+            return
+
+        def verify_spork():
+            return self.verify_spork(spork_msg)
+        verify_ok = await self.loop.run_in_executor(None, verify_spork)
+        if not verify_ok:
+            raise GracefulDisconnect('verify_spork failed')
+        sporks = xazab_net.sporks
+        sporks.set_spork(spork_id, spork_msg.nValue, self.peer)
+        xazab_net.set_spork_time = time.time()
+
+    async def on_inv(self, res):
+        out_inventory = []
+        for inv_type, inv_hash in res.inv_items():
+            if self.mix_session:
+                if inv_type == XazabType.MSG_DSTX:
+                    out_inventory.append(XazabInventory(inv_type, inv_hash))
+            elif inv_type == XazabType.MSG_ISLOCK:
+                recent_invs = self.xazab_net.recent_islock_invs
+                if inv_hash not in recent_invs:
+                    recent_invs.append(inv_hash)
+                    out_inventory.append(XazabInventory(inv_type, inv_hash))
+        if out_inventory:
+            msg = XazabGetDataMsg(out_inventory)
+            await self.send_msg('getdata', msg.serialize())
+
+    async def on_addr(self, res):
+        addresses = [f'{a.ip}:{a.port}' for a in res.payload.addresses]
+        found_peers = self.xazab_net.found_peers
+        found_peers = found_peers.union(addresses)
+
+    async def on_mnlistdiff(self, res):
+        try:
+            self.mnlistdiffs.put_nowait(res.payload)
+        except asyncio.QueueFull:
+            self.logger.info('excess mnlistdiff msg')
+
+    async def on_islock(self, res):
+        self.xazab_net.append_to_recent_islocks(res.payload)
+
+    async def on_dsq(self, res):
+        if self.mix_session:
+            if res.dsq_ready:  # session must ignore other dsq
                 payload = res.payload
-                if cmd == 'ping':
-                    msg = XazabPongMsg(payload.nonce)
-                    await self.send_msg('pong', msg.serialize())
-                elif cmd == 'pong':
-                    now = time.time()
-                    if payload.nonce == self.ping_nonce:
-                        self.ping_time = round((now - self.ping_start) * 1000)
-                        self.ping_nonce = None
-                        self.ping_start = None
-                    else:
-                        self.logger.info(f'pong with unknonw nonce')
-                elif cmd == 'spork':
-                    spork_msg = payload
-                    spork_id = spork_msg.nSporkID
-                    if not SporkID.has_value(spork_id):
-                        self.logger.info(f'unknown spork id: {spork_id}')
-                        continue
-
-                    def verify_spork():
-                        return self.verify_spork(spork_msg)
-                    verify_ok = await self.loop.run_in_executor(None,
-                                                                verify_spork)
-                    if not verify_ok:
-                        raise GracefulDisconnect('verify_spork failed')
-                    sporks = xazab_net.sporks
-                    sporks.set_spork(spork_id, spork_msg.nValue, self.peer)
-                    xazab_net.set_spork_time = time.time()
-                elif cmd == 'inv':
-                    out_inventory = []
-                    for di in payload.inventory:
-                        inv_hash = di.hash
-                        if self.mix_session:
-                            if di.type == XazabType.MSG_DSTX:
-                                out_inventory.append(di)
-                        elif di.type == XazabType.MSG_ISLOCK:
-                            recent_invs = xazab_net.recent_islock_invs
-                            if inv_hash not in recent_invs:
-                                recent_invs.append(inv_hash)
-                                out_inventory.append(di)
-                    if out_inventory:
-                        msg = XazabGetDataMsg(out_inventory)
-                        await self.send_msg('getdata', msg.serialize())
-                elif cmd == 'addr':
-                    addresses = [f'{a.ip}:{a.port}'
-                                 for a in payload.addresses]
-                    found_peers = self.xazab_net.found_peers
-                    found_peers = found_peers.union(addresses)
-                elif cmd == 'mnlistdiff':
-                    try:
-                        self.mnlistdiffs.put_nowait(payload)
-                    except asyncio.QueueFull:
-                        self.logger.info('excess mnlistdiff msg')
-                elif cmd == 'islock':
-                    xazab_net.append_to_recent_islocks(payload)
-                elif cmd == 'dsq':
-                    if self.mix_session:
-                        if payload.fReady:  # session must ignore other dsq
-                            if self.mix_session.verify_ds_msg_sig(payload):
-                                await self.mix_session.msg_queue.put(res)
-                            else:
-                                exc = Exception(f'dsq vchSig verification'
-                                                f' failed {res}')
-                                await self.mix_session.msg_queue.put(exc)
-                    else:
-                        xazab_net.add_recent_dsq(payload)
-                elif cmd == 'dssu' and self.mix_session:
+                if self.mix_session.verify_ds_msg_sig(payload):
                     await self.mix_session.msg_queue.put(res)
-                elif cmd == 'dsf' and self.mix_session:
-                    await self.mix_session.msg_queue.put(res)
-                elif cmd == 'dsc' and self.mix_session:
-                    await self.mix_session.msg_queue.put(res)
-            await asyncio.sleep(0.1)
+                else:
+                    exc = Exception(f'dsq vchSig verification'
+                                    f' failed {res}')
+                    await self.mix_session.msg_queue.put(exc)
+        else:
+            self.xazab_net.add_recent_dsq(res.payload)
+
+    async def on_mix_session_msg(self, res):
+        if self.mix_session:
+            await self.mix_session.msg_queue.put(res)
 
     async def monitor_connection(self):
         net_timeout = self.xazab_net.network.get_network_timeout_seconds()
@@ -290,6 +351,9 @@ class XazabPeer(Logger):
             if read_timeout > net_timeout:
                 raise GracefulDisconnect('read timeout')
 
+    def is_open(self):
+        return self._is_open
+
     def is_active(self, num_seconds=1):
         '''Peer is sending/receiving data last num_seconds'''
         now = time.time()
@@ -433,7 +497,8 @@ class XazabPeer(Logger):
                 self.logger.info(f'error reading msg {cmd}, '
                                  f'checksum mismatch')
                 return
-            res = XazabCmd(cmd, payload)
+            res = XazabCmd(cmd, payload,
+                           on_decode_error=self.on_payload_decode_error)
         except asyncio.IncompleteReadError:
             if not self._is_open:
                 return
@@ -444,6 +509,13 @@ class XazabPeer(Logger):
             self.logger.info(f'<-- {res}')
         return res
 
+    def on_payload_decode_error(self, res, e):
+        # payload can be decoded out of the peer tasks (mixing sessions),
+        # so close the connection from the network loop
+        self.logger.info(f'disconnecting due to malformed {res.cmd}'
+                         f' msg: {repr(e)}')
+        self.loop.call_soon_threadsafe(self.close)
+
     def verify_spork(self, spork_msg):
         if spork_msg.nTimeSigned > time.time() + 2 * 3600:
             self.logger.info('Spork signed to far in the future')
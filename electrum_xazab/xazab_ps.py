@@ -18,7 +18,8 @@ from .xazab_ps_util import (PSOptsMixin, PSUtilsMixin, PSGUILogHandler,
                            PSManLogAdapter, PSCoinRounds, PSStates,
                            PS_DENOMS_DICT, COLLATERAL_VAL, MIN_DENOM_VAL,
                            CREATE_COLLATERAL_VAL, CREATE_COLLATERAL_VALS,
-                           PSTxWorkflow, PSDenominateWorkflow, calc_tx_fee)
+                           PSTxWorkflow, PSDenominateWorkflow, calc_tx_fee,
+                           PSScheduler, PSSchedEvents)
 from .xazab_tx import PSTxTypes, SPEC_TX_NAMES, CTxIn
 from .logging import Logger
 from .transaction import Transaction, PartialTxOutput, PartialTransaction
@@ -30,6 +31,22 @@ from .i18n import _
 PS_DENOM_REVERSE_DICT = {int(v): k for k, v in PS_DENOMS_DICT.items()}
 
 
+def draw_mix_inputs_cnt():
+    '''Draw max count of denoms used as inputs of one mixing entry.
+
+    Count is increased while a new random draw from 1..ENTRY_MAX_SIZE
+    is bigger than it, so count n goes on to n+1 with probability
+    (ENTRY_MAX_SIZE - n) / ENTRY_MAX_SIZE. Entries of 2-4 inputs are
+    the most common, full entries rare (the same distribution as
+    selecting denoms one by one with the bound drawn again on each step).
+    '''
+    cnt = 1
+    while (cnt < PRIVATESEND_ENTRY_MAX_SIZE
+           and random.randint(1, PRIVATESEND_ENTRY_MAX_SIZE) > cnt):
+        cnt += 1
+    return cnt
+
+
 class TooManyUtxos(Exception):
     """Thrown when creating new denoms/collateral txs from coins"""
 
@@ -94,6 +111,7 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
 
     def __init__(self, wallet):
         Logger.__init__(self)
+        self.sched = PSScheduler()
         PSDataMixin.__init__(self, wallet)
         PSKeystoreMixin.__init__(self, wallet)
         KeyPairsMixin.__init__(self, wallet)
@@ -243,13 +261,19 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
     @state.setter
     def state(self, state):
         self._state = state
+        self.sched.notify(PSSchedEvents.State)
 
     def on_network_start(self, network):
         self.network = network
         util.register_callback(self.on_wallet_updated, ['wallet_updated'])
         util.register_callback(self.on_network_status, ['status'])
+        util.register_callback(self.on_sched_event,
+                               ['new_transaction', 'verified',
+                                'verified-islock', 'mn-list-diff-updated',
+                                'mn-list-info-updated', 'xazab-dsq'])
         self.xazab_net = network.xazab_net
         self.loop = network.asyncio_loop
+        self.sched.loop = self.loop
         self._loop_thread = network._loop_thread
         asyncio.ensure_future(self.clean_keypairs_on_timeout())
         asyncio.ensure_future(self.cleanup_staled_denominate_wfls())
@@ -261,6 +285,8 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
             self.stop_mixing()
         util.unregister_callback(self.on_wallet_updated)
         util.unregister_callback(self.on_network_status)
+        util.unregister_callback(self.on_sched_event)
+        self.xazab_net.mix_coordinator.unregister(self)
 
     def on_network_status(self, event, *args):
         connected = self.network.is_connected()
@@ -274,12 +300,26 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
                 if self.state == PSStates.Mixing:
                     self.stop_mixing(self.NO_NETWORK_STOP_MSG)
 
+    def on_sched_event(self, event, *args):
+        if event in ['new_transaction', 'verified', 'verified-islock']:
+            if args[0] != self.wallet:
+                return
+            if event == 'new_transaction':
+                self.sched.notify(PSSchedEvents.WalletUpdated)
+            else:
+                self.sched.notify(PSSchedEvents.TxVerified)
+        elif event == 'xazab-dsq':
+            self.sched.notify(PSSchedEvents.NewDSQ)
+        else:
+            self.sched.notify(PSSchedEvents.MNList)
+
     async def on_wallet_updated(self, event, *args):
         if not self.enabled:
             return
         w = args[0]
         if w != self.wallet:
             return
+        self.sched.notify(PSSchedEvents.WalletUpdated)
         if w.is_up_to_date():
             self._not_enough_funds = False
             if self.state in [PSStates.Initializing, PSStates.Ready]:
@@ -437,111 +477,189 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
         util.trigger_callback('ps-state-changes', w, None, None)
 
     async def _check_all_mixed(self):
-        while not self.main_taskgroup.closed():
-            await asyncio.sleep(10)
-            if self.all_mixed:
-                await self.stop_mixing_from_async_thread(self.ALL_MIXED_MSG,
-                                                         'inf')
+        waiter = self.sched.add_waiter('check_all_mixed')
+        try:
+            while not self.main_taskgroup.closed():
+                await waiter.wait('not all mixed',
+                                  [PSSchedEvents.PSData,
+                                   PSSchedEvents.WalletUpdated])
+                if self.all_mixed:
+                    coro = self.stop_mixing_from_async_thread(
+                        self.ALL_MIXED_MSG, 'inf')
+                    await waiter.run('stop mixing: all mixed', coro)
+        finally:
+            waiter.close()
 
     async def _check_not_enough_funds(self):
-        while not self.main_taskgroup.closed():
-            if self._not_enough_funds:
-                await asyncio.sleep(30)
-                self._not_enough_funds = False
-            await asyncio.sleep(5)
+        waiter = self.sched.add_waiter('check_not_enough_funds')
+        try:
+            while not self.main_taskgroup.closed():
+                if self._not_enough_funds:
+                    # reset on new funds or after 30 seconds
+                    await waiter.wait('not enough funds',
+                                      [PSSchedEvents.WalletUpdated],
+                                      timeout=30)
+                    self._not_enough_funds = False
+                    self.sched.notify(PSSchedEvents.Funds)
+                else:
+                    await waiter.wait('funds are enough',
+                                      [PSSchedEvents.Funds])
+        finally:
+            waiter.close()
 
-    async def _maintain_pay_collateral_tx(self):
-        kp_wait_state = KPStates.Ready if self.need_password() else None
+    def set_not_enough_funds(self):
+        self._not_enough_funds = True
+        self.sched.notify(PSSchedEvents.Funds)
 
-        while not self.main_taskgroup.closed():
-            wfl = self.pay_collateral_wfl
-            if wfl:
-                if not wfl.completed or not wfl.tx_order:
-                    await self.cleanup_pay_collateral_wfl()
-            elif self.ps_collateral_cnt > 0:
-                if kp_wait_state and self.keypairs_state != kp_wait_state:
-                    self.logger.info('Pay collateral workflow waiting'
-                                     ' for keypairs generation')
-                    await asyncio.sleep(5)
-                    continue
-                if not self.get_confirmed_ps_collateral_data():
-                    await asyncio.sleep(5)
-                    continue
-                await self.prepare_pay_collateral_wfl()
-            await asyncio.sleep(0.25)
+    async def _maintain_pay_collateral_tx(self):
+        wait_keypairs = self.need_password()
+        waiter = self.sched.add_waiter('pay_collateral')
+        try:
+            while not self.main_taskgroup.closed():
+                wfl = self.pay_collateral_wfl
+                if wfl:
+                    if not wfl.completed or not wfl.tx_order:
+                        await waiter.run('cleanup pay collateral workflow',
+                                         self.cleanup_pay_collateral_wfl())
+                    else:
+                        await waiter.wait('pay collateral tx is ready',
+                                          [PSSchedEvents.Workflow])
+                elif self.ps_collateral_cnt > 0:
+                    if wait_keypairs and not self.keypairs_usable:
+                        self.logger.info('Pay collateral workflow waiting'
+                                         ' for keypairs generation')
+                        await waiter.wait('keypairs not ready',
+                                          [PSSchedEvents.Keypairs])
+                        continue
+                    if not self.get_confirmed_ps_collateral_data():
+                        await waiter.wait('no confirmed ps collateral',
+                                          [PSSchedEvents.TxVerified,
+                                           PSSchedEvents.PSData])
+                        continue
+                    await waiter.run('prepare pay collateral workflow',
+                                     self.prepare_pay_collateral_wfl())
+                else:
+                    await waiter.wait('no ps collateral',
+                                      [PSSchedEvents.PSData,
+                                       PSSchedEvents.WalletUpdated])
+        finally:
+            waiter.close()
 
     async def broadcast_new_denoms_new_collateral_wfls(self):
         w = self.wallet
+        waiter = self.sched.add_waiter('broadcast_new_denoms_collateral')
         while True:
             if self.enabled:
                 wfl = self.new_denoms_wfl
                 if wfl and wfl.completed and wfl.next_to_send(w):
-                    await self.broadcast_new_denoms_wfl()
-                await asyncio.sleep(0.25)
+                    await waiter.run('broadcast new denoms workflow',
+                                     self.broadcast_new_denoms_wfl())
+                    continue
                 wfl = self.new_collateral_wfl
                 if wfl and wfl.completed and wfl.next_to_send(w):
-                    await self.broadcast_new_collateral_wfl()
-                await asyncio.sleep(0.25)
+                    await waiter.run('broadcast new collateral workflow',
+                                     self.broadcast_new_collateral_wfl())
+                    continue
+                await waiter.wait('no workflow txs to send',
+                                  [PSSchedEvents.Workflow,
+                                   PSSchedEvents.WalletUpdated])
             else:
-                await asyncio.sleep(1)
+                await waiter.wait('PrivateSend disabled',
+                                  [PSSchedEvents.State,
+                                   PSSchedEvents.Workflow])
 
     async def _maintain_collateral_amount(self):
-        kp_wait_state = KPStates.Ready if self.need_password() else None
-
-        while not self.main_taskgroup.closed():
-            wfl = self.new_collateral_wfl
-            if wfl:
-                if not wfl.completed or not wfl.tx_order:
-                    await self.cleanup_new_collateral_wfl()
-            elif (not self._not_enough_funds
-                    and not self.ps_collateral_cnt
-                    and not self.calc_need_denoms_amounts(use_cache=True)):
-                coins = await self.get_next_coins_for_mixing(for_denoms=False)
-                if not coins:
-                    await asyncio.sleep(5)
-                    continue
-                if not self.check_llmq_ready():
-                    self.logger.info(_('New collateral workflow: {}')
-                                     .format(self.LLMQ_DATA_NOT_READY))
-                    await asyncio.sleep(5)
-                    continue
-                elif kp_wait_state and self.keypairs_state != kp_wait_state:
-                    self.logger.info('New collateral workflow waiting'
-                                     ' for keypairs generation')
-                    await asyncio.sleep(5)
-                    continue
-                await self.create_new_collateral_wfl()
-            await asyncio.sleep(0.25)
+        wait_keypairs = self.need_password()
+        waiter = self.sched.add_waiter('new_collateral')
+        try:
+            while not self.main_taskgroup.closed():
+                wfl = self.new_collateral_wfl
+                if wfl:
+                    if not wfl.completed or not wfl.tx_order:
+                        await waiter.run('cleanup new collateral workflow',
+                                         self.cleanup_new_collateral_wfl())
+                    else:
+                        await waiter.wait('new collateral workflow'
+                                          ' is processing',
+                                          [PSSchedEvents.Workflow])
+                elif (not self._not_enough_funds
+                        and not self.ps_collateral_cnt
+                        and not self.calc_need_denoms_amounts(use_cache=True)):
+                    coins = await self.get_next_coins_for_mixing(
+                        for_denoms=False)
+                    if not coins:
+                        await waiter.wait('no coins for new collateral',
+                                          [PSSchedEvents.WalletUpdated,
+                                           PSSchedEvents.TxVerified])
+                        continue
+                    if not self.check_llmq_ready():
+                        self.logger.info(_('New collateral workflow: {}')
+                                         .format(self.LLMQ_DATA_NOT_READY))
+                        await waiter.wait('LLMQ data not ready',
+                                          [PSSchedEvents.MNList])
+                        continue
+                    elif wait_keypairs and not self.keypairs_usable:
+                        self.logger.info('New collateral workflow waiting'
+                                         ' for keypairs generation')
+                        await waiter.wait('keypairs not ready',
+                                          [PSSchedEvents.Keypairs])
+                        continue
+                    await waiter.run('create new collateral workflow',
+                                     self.create_new_collateral_wfl())
+                else:
+                    await waiter.wait('new collateral not needed',
+                                      [PSSchedEvents.Funds,
+                                       PSSchedEvents.PSData,
+                                       PSSchedEvents.WalletUpdated])
+        finally:
+            waiter.close()
 
     async def _maintain_denoms(self):
-        kp_wait_state = KPStates.Ready if self.need_password() else None
-
-        while not self.main_taskgroup.closed():
-            wfl = self.new_denoms_wfl
-            if wfl:
-                if not wfl.completed or not wfl.tx_order:
-                    await self.cleanup_new_denoms_wfl()
-            elif (not self._not_enough_funds
-                    and self.calc_need_denoms_amounts(use_cache=True)):
-                coins = await self.get_next_coins_for_mixing()
-                if not coins:
-                    await asyncio.sleep(5)
-                    continue
-                if not self.check_llmq_ready():
-                    self.logger.info(_('New denoms workflow: {}')
-                                     .format(self.LLMQ_DATA_NOT_READY))
-                    await asyncio.sleep(5)
-                    continue
-                elif kp_wait_state and self.keypairs_state != kp_wait_state:
-                    self.logger.info('New denoms workflow waiting'
-                                     ' for keypairs generation')
-                    await asyncio.sleep(5)
-                    continue
-                await self.create_new_denoms_wfl()
-            await asyncio.sleep(0.25)
+        wait_keypairs = self.need_password()
+        waiter = self.sched.add_waiter('new_denoms')
+        try:
+            while not self.main_taskgroup.closed():
+                wfl = self.new_denoms_wfl
+                if wfl:
+                    if not wfl.completed or not wfl.tx_order:
+                        await waiter.run('cleanup new denoms workflow',
+                                         self.cleanup_new_denoms_wfl())
+                    else:
+                        await waiter.wait('new denoms workflow'
+                                          ' is processing',
+                                          [PSSchedEvents.Workflow])
+                elif (not self._not_enough_funds
+                        and self.calc_need_denoms_amounts(use_cache=True)):
+                    coins = await self.get_next_coins_for_mixing()
+                    if not coins:
+                        await waiter.wait('no coins for new denoms',
+                                          [PSSchedEvents.WalletUpdated,
+                                           PSSchedEvents.TxVerified])
+                        continue
+                    if not self.check_llmq_ready():
+                        self.logger.info(_('New denoms workflow: {}')
+                                         .format(self.LLMQ_DATA_NOT_READY))
+                        await waiter.wait('LLMQ data not ready',
+                                          [PSSchedEvents.MNList])
+                        continue
+                    elif wait_keypairs and not self.keypairs_usable:
+                        self.logger.info('New denoms workflow waiting'
+                                         ' for keypairs generation')
+                        await waiter.wait('keypairs not ready',
+                                          [PSSchedEvents.Keypairs])
+                        continue
+                    await waiter.run('create new denoms workflow',
+                                     self.create_new_denoms_wfl())
+                else:
+                    await waiter.wait('new denoms not needed',
+                                      [PSSchedEvents.Funds,
+                                       PSSchedEvents.PSData,
+                                       PSSchedEvents.WalletUpdated])
+        finally:
+            waiter.close()
 
     async def _mix_denoms(self):
-        kp_wait_state = KPStates.Ready if self.need_password() else None
+        wait_keypairs = self.need_password()
 
         def _cleanup():
             for uuid in self.denominate_wfl_list:
@@ -551,28 +669,42 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
         await self.loop.run_in_executor(None, _cleanup)
 
         main_taskgroup = self.main_taskgroup
-        while not main_taskgroup.closed():
-            if (self._denoms_to_mix_cache
-                    and self.pay_collateral_wfl
-                    and self.active_denominate_wfl_cnt < self.max_sessions):
-                if not self.check_llmq_ready():
+        waiter = self.sched.add_waiter('denominate')
+        try:
+            while not main_taskgroup.closed():
+                if not self._denoms_to_mix_cache:
+                    await waiter.wait('no denoms to mix',
+                                      [PSSchedEvents.PSData,
+                                       PSSchedEvents.WalletUpdated])
+                elif not self.pay_collateral_wfl:
+                    await waiter.wait('no pay collateral tx',
+                                      [PSSchedEvents.Workflow])
+                elif self.active_denominate_wfl_cnt >= self.max_sessions:
+                    await waiter.wait('max sessions running',
+                                      [PSSchedEvents.Workflow])
+                elif not self.check_llmq_ready():
                     self.logger.info(_('Denominate workflow: {}')
                                      .format(self.LLMQ_DATA_NOT_READY))
-                    await asyncio.sleep(5)
-                    continue
+                    await waiter.wait('LLMQ data not ready',
+                                      [PSSchedEvents.MNList])
                 elif not self.check_protx_info_completeness():
                     self.logger.info(_('Denominate workflow: {}')
                                      .format(self.MNS_DATA_NOT_READY))
-                    await asyncio.sleep(5)
-                    continue
-                elif kp_wait_state and self.keypairs_state != kp_wait_state:
+                    await waiter.wait('masternodes data not ready',
+                                      [PSSchedEvents.MNList])
+                elif wait_keypairs and not self.keypairs_usable:
                     self.logger.info('Denominate workflow waiting'
                                      ' for keypairs generation')
-                    await asyncio.sleep(5)
-                    continue
-                if self.state == PSStates.Mixing:
-                    await main_taskgroup.spawn(self.start_denominate_wfl())
-            await asyncio.sleep(0.25)
+                    await waiter.wait('keypairs not ready',
+                                      [PSSchedEvents.Keypairs])
+                elif self.state == PSStates.Mixing:
+                    coro = main_taskgroup.spawn(self.start_denominate_wfl())
+                    await waiter.run('start denominate workflow', coro)
+                else:
+                    await waiter.wait('mixing is stopping',
+                                      [PSSchedEvents.Workflow])
+        finally:
+            waiter.close()
 
     async def start_mix_session(self, denom_value, dsq, wfl_lid):
         n_denom = PS_DENOMS_DICT[denom_value]
@@ -581,7 +713,13 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
         async with self.mix_sessions_lock:
             if peer_str in self.mix_sessions:
                 raise Exception(f'Session with {peer_str} already exists')
-            await sess.run_peer()
+            coordinator = self.xazab_net.mix_coordinator
+            coordinator.on_session_started(self, sess)
+            try:
+                await sess.run_peer()
+            except BaseException:
+                coordinator.on_session_finished(self, sess)
+                raise
             self.mix_sessions[peer_str] = sess
             return sess
 
@@ -592,6 +730,7 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
                 self.logger.debug(f'Peer {peer_str} not found in mix_session')
                 return
             sess.close_peer()
+            self.xazab_net.mix_coordinator.on_session_finished(self, sess)
             return sess
 
     # Workflow methods for pay collateral transaction
@@ -922,7 +1061,7 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
             elif type_e == SignWithKeypairsFailed:
                 msg = self.SIGN_WIHT_KP_FAILED_MSG
             elif type_e == NotEnoughFunds:
-                self._not_enough_funds = True
+                self.set_not_enough_funds()
             if msg:
                 await self.stop_mixing_from_async_thread(msg)
 
@@ -1332,7 +1471,7 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
                 elif type_e == SignWithKeypairsFailed:
                     msg = self.SIGN_WIHT_KP_FAILED_MSG
                 elif type_e == NotEnoughFunds:
-                    self._not_enough_funds = True
+                    self.set_not_enough_funds()
                 if msg:
                     await self.stop_mixing_from_async_thread(msg)
                 break
@@ -1577,17 +1716,27 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
             session = None
             if random.random() > 0.33:
                 self.logger.debug('try to get masternode from recent dsq')
-                recent_mns = self.recent_mixes_mns
-                while self.state == PSStates.Mixing:
-                    dsq = self.xazab_net.get_recent_dsq(recent_mns)
-                    if dsq is not None:
-                        self.logger.debug(f'get dsq from recent dsq queue'
-                                          f' {dsq.masternodeOutPoint}')
-                        dval = PS_DENOM_REVERSE_DICT[dsq.nDenom]
-                        wfl = await self.loop.run_in_executor(None,
-                                                              _start, dval)
-                        break
-                    await asyncio.sleep(0.5)
+                coordinator = self.xazab_net.mix_coordinator
+                waiter = self.sched.add_waiter('recent_dsq')
+                try:
+                    while self.state == PSStates.Mixing:
+                        with self.denoms_lock:
+                            pool = self._denoms_to_mix_cache
+                            denoms = set(PS_DENOMS_DICT[v]
+                                         for v in pool.get_denom_values())
+                        dsq = coordinator.get_dsq(self, denoms)
+                        if dsq is not None:
+                            self.logger.debug(f'get dsq from recent dsq queue'
+                                              f' {dsq.masternodeOutPoint}')
+                            dval = PS_DENOM_REVERSE_DICT[dsq.nDenom]
+                            wfl = await self.loop.run_in_executor(None,
+                                                                  _start, dval)
+                            break
+                        await waiter.wait('no suitable recent dsq',
+                                          [PSSchedEvents.NewDSQ])
+                finally:
+                    coordinator.stop_waiting(self)
+                    waiter.close()
             else:
                 self.logger.debug('try to create new queue'
                                   ' on random masternode')
@@ -1629,7 +1778,8 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
                 else:
                     raise Exception(f'Unsolisited cmd: {cmd} after dsi sent')
 
-            signed_inputs = self._sign_inputs(final_tx, wfl.inputs)
+            signed_inputs = await self.loop.run_in_executor(
+                None, self._sign_inputs, final_tx, wfl.inputs)
             await session.send_dss(signed_inputs)
             while True:
                 cmd, res = await session.read_next_msg(wfl)
@@ -1647,6 +1797,7 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
                                 self.logger.debug(f'denominate workflow:'
                                                   f' {wfl.lid} not found')
                     saved = await self.loop.run_in_executor(None, _on_dsc)
+                    session.completed = True
                     if saved:
                         wfl = saved
                         self.wallet.save_db()
@@ -1684,51 +1835,23 @@ class PSManager(Logger, PSKeystoreMixin, PSDataMixin, PSOptsMixin,
                               ' _denoms_to_mix_cache is empty')
             return None, None
 
-        if denom_value is not None:
-            denoms = self.denoms_to_mix(denom_value=denom_value)
-        else:
-            denoms = self.denoms_to_mix()
-        outpoints = list(denoms.keys())
-
         w = self.wallet
-        icnt = 0
-        txids = []
-        inputs = []
-        while icnt < random.randint(1, PRIVATESEND_ENTRY_MAX_SIZE):
-            if not outpoints:
-                break
-
-            outpoint = outpoints.pop(random.randint(0, len(outpoints)-1))
-            if not w.db.get_ps_denom(outpoint):  # already spent
-                continue
-
-            if w.db.get_ps_spending_denom(outpoint):  # reserved to spend
-                continue
-
-            txid = outpoint.split(':')[0]
-            if txid in txids:  # skip outputs from same tx
-                continue
 
+        def check_denom(txid, denom):
             height = w.get_tx_height(txid).height
             islock = w.db.get_islock(txid)
             if not islock and height <= 0:  # skip not islocked/confirmed
-                continue
-
-            denom = denoms.pop(outpoint)
-            if denom[2] >= self.mix_rounds:
-                continue
-
+                return False
             if not self.is_ps_ks(denom[0]) and self.is_hw_ks:
-                continue  # skip denoms on hw keystore
-
-            if denom_value is None:
-                denom_value = denom[1]
-            elif denom[1] != denom_value:  # skip other denom values
-                continue
+                return False  # skip denoms on hw keystore
+            return True
 
-            inputs.append(outpoint)
-            txids.append(txid)
-            icnt += 1
+        max_cnt = draw_mix_inputs_cnt()
+        # same locks order as on adding wallet txs ps data
+        with w.lock, self.denoms_lock:
+            inputs, denom_value = \
+                self._denoms_to_mix_cache.select(max_cnt, denom_value,
+                                                 check_denom)
 
         if not inputs:
             self.logger.debug(f'No suitable denoms to mix:'
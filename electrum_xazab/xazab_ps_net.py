@@ -3,9 +3,11 @@
 import asyncio
 import time
 from bls_py import bls
+from collections import Counter, deque
 from enum import IntEnum
 
 from .bitcoin import address_to_script
+from .logging import Logger
 from .xazab_msg import (DSPoolStatusUpdate, DSMessageIDs, ds_msg_str,
                        ds_pool_state_str, XazabDsaMsg, XazabDsiMsg, XazabDssMsg)
 from .xazab_tx import str_ip, CTxIn, CTxOut
@@ -14,6 +16,8 @@ from .util import bfh
 
 PRIVATESEND_QUEUE_TIMEOUT = 30
 PRIVATESEND_SESSION_MSG_TIMEOUT = 40
+PS_MIX_PEER_IDLE_TIMEOUT = 60   # keep connection to masternode for reuse
+PS_MIX_STATS_PERIOD = 3600      # period of sessions stats
 
 
 class PSDenoms(IntEnum):
@@ -24,6 +28,197 @@ class PSDenoms(IntEnum):
     D0_001 = 16
 
 
+class PSMixCoordinator(Logger):
+    '''Daemon level coordinator of PrivateSend mixing of all wallets.
+    Owns recent dsq queue and connections to mixing masternodes'''
+
+    LOGGING_SHORTCUT = 'D'
+
+    def __init__(self, xazab_net):
+        Logger.__init__(self)
+        self.xazab_net = xazab_net
+        self.start_time = time.time()
+
+        # Recent broadcasted dsq data
+        self.recent_dsq = deque([], 100)
+        self.recent_dsq_hashes = deque([], 50)  # added from network broadcasts
+
+        # psman -> (waiting since, recent_mixes_mns, suitable nDenoms)
+        self.waiting = {}
+        self.last_served = {}   # psman -> time of last dsq assignment
+        self.active_mns = {}    # peer_str -> psman of running session
+        self.idle_peers = {}    # peer_str -> (XazabPeer, idle since)
+
+        # (start time, finish time, wallet name, completed) of sessions
+        self.sessions = deque()
+        self.dsq_cnt = Counter()    # added, assigned, expired
+        self.peers_cnt = Counter()  # opened, reused
+
+    def add_dsq(self, dsq):
+        nDenom = dsq.nDenom
+        if nDenom not in list(PSDenoms):
+            return False
+        dsq_hash = f'{nDenom}:{dsq.masternodeOutPoint}:{dsq.nTime}'
+        if dsq_hash in self.recent_dsq_hashes:
+            return False
+        self.recent_dsq_hashes.append(dsq_hash)
+        self.recent_dsq.appendleft(dsq)
+        self.dsq_cnt['added'] += 1
+        self.logger.info(f'added recent dsq, queue length:'
+                         f' {len(self.recent_dsq)}')
+        return True
+
+    def is_dsq_expired(self, dsq):
+        if time.time() - dsq.nTime > PRIVATESEND_QUEUE_TIMEOUT:
+            return True
+        outpoint = str(dsq.masternodeOutPoint)
+        return not self.xazab_net.network.mn_list.get_mn_by_outpoint(outpoint)
+
+    def get_dsq_peer_str(self, dsq):
+        outpoint = str(dsq.masternodeOutPoint)
+        sml_entry = self.xazab_net.network.mn_list.get_mn_by_outpoint(outpoint)
+        return f'{str_ip(sml_entry.ipAddress)}:{sml_entry.port}'
+
+    def is_suitable_dsq(self, dsq, recent_mixes_mns, denoms=None):
+        '''Check not expired dsq can be used by wallet, denoms is a set
+        of nDenom values the wallet has to mix'''
+        if denoms is not None and dsq.nDenom not in denoms:
+            return False
+        peer_str = self.get_dsq_peer_str(dsq)
+        if peer_str in recent_mixes_mns:
+            return False
+        if peer_str in self.active_mns:  # other wallet mixing on this MN
+            return False
+        return True
+
+    def get_dsq(self, psman, denoms=None):
+        '''Assign suitable dsq to wallet. Wallets which have waited for dsq
+        longer and were served earlier get suitable dsq first'''
+        now = time.time()
+        recent_mns = psman.recent_mixes_mns
+        since = self.waiting.get(psman, (now, None, None))[0]
+        self.waiting[psman] = (since, recent_mns, denoms)
+        self._expire_dsq()
+        for dsq in self.recent_dsq:
+            if not self.is_suitable_dsq(dsq, recent_mns, denoms):
+                continue
+            if self._is_reserved_for_others(psman, dsq):
+                continue
+            self.recent_dsq.remove(dsq)
+            self.stop_waiting(psman)
+            self.last_served[psman] = now
+            self.dsq_cnt['assigned'] += 1
+            return dsq
+
+    def _expire_dsq(self):
+        for dsq in list(self.recent_dsq):
+            if self.is_dsq_expired(dsq):
+                self.recent_dsq.remove(dsq)
+                self.dsq_cnt['expired'] += 1
+
+    def _is_reserved_for_others(self, psman, dsq):
+        def wait_order(w):
+            return (self.last_served.get(w, 0), self.waiting[w][0])
+        psman_order = wait_order(psman)
+        for w, (since, recent_mns, denoms) in self.waiting.items():
+            if w is psman or wait_order(w) >= psman_order:
+                continue
+            if self.is_suitable_dsq(dsq, recent_mns, denoms):
+                return True
+        return False
+
+    def stop_waiting(self, psman):
+        self.waiting.pop(psman, None)
+
+    def unregister(self, psman):
+        '''Forget wallet stopped with the network, not to keep it alive'''
+        self.stop_waiting(psman)
+        self.last_served.pop(psman, None)
+
+    def is_mn_active(self, peer_str):
+        return peer_str in self.active_mns
+
+    def on_session_started(self, psman, session):
+        self.active_mns[session.peer_str] = psman
+
+    def on_session_finished(self, psman, session):
+        if self.active_mns.get(session.peer_str) is psman:
+            del self.active_mns[session.peer_str]
+        now = time.time()
+        self.sessions.append((session.start_time, now,
+                              psman.wallet.diagnostic_name(),
+                              session.completed))
+        self._expire_sessions(now)
+
+    def _expire_sessions(self, now):
+        while self.sessions and now - self.sessions[0][1] > PS_MIX_STATS_PERIOD:
+            self.sessions.popleft()
+
+    async def get_mixing_peer(self, peer_str, sml_entry, mix_session):
+        '''Reuse idle connection to masternode or open new one'''
+        xazab_peer, idle_since = self.idle_peers.pop(peer_str, (None, None))
+        if (xazab_peer and xazab_peer.is_open()
+                and time.time() - idle_since < PS_MIX_PEER_IDLE_TIMEOUT):
+            xazab_peer.mix_session = mix_session
+            self.peers_cnt['reused'] += 1
+            return xazab_peer
+        elif xazab_peer:
+            xazab_peer.close()
+        xazab_peer = await self.xazab_net.run_mixing_peer(peer_str, sml_entry,
+                                                         mix_session)
+        if xazab_peer:
+            self.peers_cnt['opened'] += 1
+        return xazab_peer
+
+    def release_mixing_peer(self, xazab_peer, reuse=False):
+        '''Keep connection after completed session for other wallets'''
+        peer_str = xazab_peer.peer
+        if not reuse or not xazab_peer.is_open() or peer_str in self.idle_peers:
+            xazab_peer.close()
+            return
+        xazab_peer.mix_session = None
+        self.idle_peers[peer_str] = (xazab_peer, time.time())
+        self.xazab_net.loop.call_later(PS_MIX_PEER_IDLE_TIMEOUT,
+                                       self._close_idle_peer, xazab_peer)
+
+    def _close_idle_peer(self, xazab_peer):
+        peer_str = xazab_peer.peer
+        if self.idle_peers.get(peer_str, (None,))[0] is xazab_peer:
+            del self.idle_peers[peer_str]
+            xazab_peer.close()
+
+    def close_idle_peers(self):
+        for xazab_peer, idle_since in self.idle_peers.values():
+            xazab_peer.close()
+        self.idle_peers.clear()
+
+    def as_dict(self):
+        now = time.time()
+        self._expire_sessions(now)
+        wallets = {}
+        completed = 0
+        for start, finish, wallet_name, sess_completed in list(self.sessions):
+            w = wallets.setdefault(wallet_name, {'sessions': 0,
+                                                 'completed': 0})
+            w['sessions'] += 1
+            if sess_completed:
+                w['completed'] += 1
+                completed += 1
+        period = min(PS_MIX_STATS_PERIOD, max(now - self.start_time, 1))
+        return {
+            'recent_dsq': len(self.recent_dsq),
+            'dsq': dict(self.dsq_cnt),
+            'wallets_waiting_dsq': len(self.waiting),
+            'active_sessions': len(self.active_mns),
+            'idle_peers': len(self.idle_peers),
+            'peers': dict(self.peers_cnt),
+            'sessions': len(self.sessions),
+            'completed_sessions': completed,
+            'sessions_per_hour': round(completed * 3600 / period, 2),
+            'wallets': wallets,
+        }
+
+
 class PSMixSession:
 
     def __init__(self, psman, denom_value, denom, dsq, wfl_lid):
@@ -34,6 +229,7 @@ class PSMixSession:
 
         network = psman.wallet.network
         self.xazab_net = network.xazab_net
+        self.coordinator = self.xazab_net.mix_coordinator
         self.mn_list = network.mn_list
 
         self.xazab_peer = None
@@ -47,7 +243,9 @@ class PSMixSession:
             while True:
                 try_cnt += 1
                 self.sml_entry = self.mn_list.get_random_mn()
-                if self.peer_str not in psman.recent_mixes_mns:
+                peer_str = self.peer_str
+                if (peer_str not in psman.recent_mixes_mns
+                        and not self.coordinator.is_mn_active(peer_str)):
                     break
                 if try_cnt >= 10:
                     raise Exception('Can not select random'
@@ -65,6 +263,7 @@ class PSMixSession:
         self.fReady = False
         self.nTime = 0
         self.start_time = time.time()
+        self.completed = False  # dsc received, connection can be reused
 
     @property
     def peer_str(self):
@@ -73,9 +272,9 @@ class PSMixSession:
     async def run_peer(self):
         if self.xazab_peer:
             raise Exception('Session already have running XazabPeer')
-        self.xazab_peer = await self.xazab_net.run_mixing_peer(self.peer_str,
-                                                             self.sml_entry,
-                                                             self)
+        self.xazab_peer = await self.coordinator.get_mixing_peer(self.peer_str,
+                                                               self.sml_entry,
+                                                               self)
         if not self.xazab_peer:
             raise Exception(f'Peer {self.peer_str} connection failed')
         self.logger.info(f'Started mixing session for {self.wfl_lid},'
@@ -85,7 +284,8 @@ class PSMixSession:
     def close_peer(self):
         if not self.xazab_peer:
             return
-        self.xazab_peer.close()
+        self.coordinator.release_mixing_peer(self.xazab_peer,
+                                             reuse=self.completed)
         self.logger.info(f'Stopped mixing session for {self.wfl_lid},'
                          f' peer: {self.peer_str}')
 
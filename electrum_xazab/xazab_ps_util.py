@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import bisect
 import copy
+import random
 import re
 import time
 import logging
+from collections import Counter, defaultdict, deque
+from collections.abc import Mapping
 from decimal import Decimal
 from enum import IntEnum
+from typing import NamedTuple, Optional
 
 from . import constants, util
 from .bitcoin import is_address, COIN
@@ -437,6 +442,258 @@ class PSGUILogHandler(logging.Handler):
             self.psman.postpone_notification('ps-log-changes', self.psman)
 
 
+class PSSchedEvents(IntEnum):
+    '''Events waking up PrivateSend mixing loops'''
+    WalletUpdated = 0   # wallet synchronized, new wallet transactions
+    TxVerified = 1      # wallet transaction mined or islocked
+    MNList = 2          # masternodes list/LLMQ data updated
+    NewDSQ = 3          # new dsq message received from network
+    Keypairs = 4        # keypairs cache state changed
+    Workflow = 5        # mixing workflow created, changed or finished
+    PSData = 6          # ps denoms/collaterals data changed
+    Funds = 7           # not enough funds state changed
+    State = 8           # PrivateSend state changed (enabled, mixing, ...)
+
+
+# PSManager postponed notifications which are also scheduler events
+PS_NOTIFICATION_SCHED_EVENTS = {
+    'ps-keypairs-changes': PSSchedEvents.Keypairs,
+    'ps-wfl-changes': PSSchedEvents.Workflow,
+    'ps-data-changes': PSSchedEvents.PSData,
+    'ps-reserved-changes': PSSchedEvents.PSData,
+}
+
+PS_SCHED_MAX_WAIT = 60          # wake up after this secs if no events came
+PS_SCHED_ACTION_INTERVAL = 0.25  # min secs between actions of one loop
+PS_SCHED_TRACE_SIZE = 500
+
+
+class PSSchedTraceItem(NamedTuple):
+    time: float
+    loop: str
+    decision: str
+    woken_by: Optional[str]     # event name or 'timeout', None for actions
+    waited: Optional[float]
+
+
+class PSSchedWaiter:
+    '''Wait conditions of one mixing loop. Events are kept from the
+    previous wakeup, so none are lost while the loop runs its checks'''
+
+    def __init__(self, sched, name):
+        self.sched = sched
+        self.name = name
+        self.pending = set()
+        self.waiting_for = None
+        self.event = asyncio.Event()
+
+    def on_event(self, event):
+        self.pending.add(event)
+        if self.waiting_for and event in self.waiting_for:
+            self.event.set()
+
+    async def wait(self, reason, events, timeout=PS_SCHED_MAX_WAIT):
+        '''Wait for one of events, reason is saved in the trace'''
+        events = set(events)
+        start = time.time()
+        if not self.pending & events:
+            self.waiting_for = events
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiting_for = None
+        woken_by = self.pending & events
+        self.pending.clear()
+        woken_by = (','.join(sorted(e.name for e in woken_by))
+                    if woken_by else 'timeout')
+        self.sched.add_trace(self.name, reason, woken_by, time.time() - start)
+
+    async def run(self, decision, coro):
+        '''Run loop action, next action of the loop can start
+        after PS_SCHED_ACTION_INTERVAL'''
+        self.sched.add_trace(self.name, decision)
+        try:
+            return await coro
+        finally:
+            await asyncio.sleep(PS_SCHED_ACTION_INTERVAL)
+
+    def close(self):
+        self.sched.remove_waiter(self)
+
+
+class PSScheduler:
+    '''Wakes up PrivateSend mixing loops on events instead of polling,
+    keeps trace of scheduling decisions'''
+
+    def __init__(self, trace_size=PS_SCHED_TRACE_SIZE):
+        self.loop = None
+        self.waiters = []
+        self.trace = deque([], trace_size)
+        self.events_cnt = Counter()
+        self.decisions_cnt = Counter()
+        self.wait_time = Counter()
+
+    def add_waiter(self, name):
+        waiter = PSSchedWaiter(self, name)
+        self.waiters.append(waiter)
+        return waiter
+
+    def remove_waiter(self, waiter):
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+
+    def notify(self, event):
+        '''Can be called from any thread'''
+        loop = self.loop
+        if loop is None or not self.waiters:
+            return
+        try:
+            loop.call_soon_threadsafe(self._notify, event)
+        except RuntimeError:  # loop closed
+            pass
+
+    def _notify(self, event):
+        self.events_cnt[event.name] += 1
+        for waiter in self.waiters:
+            waiter.on_event(event)
+
+    def add_trace(self, loop_name, decision, woken_by=None, waited=None):
+        self.trace.append(PSSchedTraceItem(time.time(), loop_name, decision,
+                                           woken_by, waited))
+        self.decisions_cnt[f'{loop_name}: {decision}'] += 1
+        if waited is not None:
+            self.wait_time[loop_name] += waited
+
+    def get_trace(self):
+        return [item._asdict() for item in self.trace]
+
+    def as_dict(self):
+        return {
+            'loops': sorted(set(w.name for w in self.waiters)),
+            'events': dict(self.events_cnt),
+            'decisions': dict(self.decisions_cnt),
+            'wait_time': {k: round(v, 3) for k, v in self.wait_time.items()},
+            'trace': self.get_trace(),
+        }
+
+
+class PSDenomsPool(Mapping):
+    '''Denoms not reserved for spending, bucketed by denom value and rounds.
+    Read only mapping view of pool has denoms with rounds < max_rounds'''
+
+    def __init__(self, max_rounds, denoms=None):
+        self.max_rounds = max_rounds
+        self._denoms = {}                   # outpoint -> denom
+        self._buckets = defaultdict(list)   # (value, rounds) -> outpoints
+        self._pos = {}                      # outpoint -> pos in bucket
+        if denoms:
+            for outpoint, denom in denoms.items():
+                self.add(outpoint, denom)
+
+    def __getitem__(self, outpoint):
+        denom = self._denoms[outpoint]
+        if denom[2] >= self.max_rounds:
+            raise KeyError(outpoint)
+        return denom
+
+    def __iter__(self):
+        for bucket in self._get_buckets():
+            yield from bucket
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._get_buckets())
+
+    def __repr__(self):
+        return f'<PSDenomsPool max_rounds={self.max_rounds} len={len(self)}>'
+
+    def add(self, outpoint, denom):
+        if outpoint in self._denoms:
+            self.remove(outpoint)
+        bucket = self._buckets[(denom[1], denom[2])]
+        self._denoms[outpoint] = denom
+        self._pos[outpoint] = len(bucket)
+        bucket.append(outpoint)
+
+    def remove(self, outpoint):
+        denom = self._denoms.pop(outpoint, None)
+        if denom is None:
+            return
+        key = (denom[1], denom[2])
+        bucket = self._buckets[key]
+        pos = self._pos.pop(outpoint)
+        last = bucket.pop()
+        if last != outpoint:  # move last outpoint to the freed position
+            bucket[pos] = last
+            self._pos[last] = pos
+        if not bucket:
+            del self._buckets[key]
+        return denom
+
+    def clear(self):
+        self._denoms.clear()
+        self._buckets.clear()
+        self._pos.clear()
+
+    def get_denom_values(self):
+        return set(value for (value, rounds), bucket in self._buckets.items()
+                   if rounds < self.max_rounds)
+
+    def _get_buckets(self, denom_value=None):
+        return [bucket for (value, rounds), bucket in self._buckets.items()
+                if rounds < self.max_rounds
+                and (denom_value is None or value == denom_value)]
+
+    @staticmethod
+    def _random_order(buckets):
+        '''Yield outpoints from buckets in random order, each step is
+        a step of Fisher-Yates shuffle over virtually joined buckets'''
+        ends = []
+        total = 0
+        for bucket in buckets:
+            total += len(bucket)
+            ends.append(total)
+        swaps = {}
+        for i in range(total):
+            j = random.randrange(i, total)
+            idx = swaps.get(j, j)
+            swaps[j] = swaps.get(i, i)
+            b = bisect.bisect_right(ends, idx)
+            yield buckets[b][idx - (ends[b-1] if b else 0)]
+
+    def select(self, max_cnt, denom_value=None, check=None):
+        '''Select random denoms of one value from distinct txids,
+        check(txid, denom) can filter out unsuitable denoms'''
+        res = []
+        txids = set()
+
+        def _select(buckets):
+            for outpoint in self._random_order(buckets):
+                if len(res) >= max_cnt:
+                    return
+                txid = outpoint.split(':')[0]
+                if txid in txids:  # skip outputs from same tx
+                    continue
+                denom = self._denoms[outpoint]
+                if check is not None and not check(txid, denom):
+                    continue
+                res.append(outpoint)
+                txids.add(txid)
+                if denom_value is None:
+                    return denom[1]
+
+        if max_cnt <= 0:
+            return res, denom_value
+        if denom_value is None:
+            denom_value = _select(self._get_buckets())
+            if denom_value is None:
+                return res, None
+        _select(self._get_buckets(denom_value))
+        return res, denom_value
+
+
 class PSOptsMixin:
     '''PrivateSend user options functionality'''
 
@@ -533,7 +790,7 @@ class PSOptsMixin:
         rounds = min(self.max_mix_rounds, int(rounds))
         self.wallet.db.set_ps_data('mix_rounds', rounds)
         with self.denoms_lock:
-            self._denoms_to_mix_cache = self.denoms_to_mix()
+            self._denoms_to_mix_cache.max_rounds = rounds
 
     @property
     def min_mix_rounds(self):
@@ -977,6 +1234,9 @@ class PSUtilsMixin:
 
     def postpone_notification(self, event, *args):
         self.postponed_notifications[event] = args
+        sched_event = PS_NOTIFICATION_SCHED_EVENTS.get(event)
+        if sched_event is not None:
+            self.sched.notify(sched_event)
 
     async def trigger_postponed_notifications(self):
         while True:
@@ -1037,6 +1297,9 @@ class PSUtilsMixin:
                     util.trigger_callback('ps-state-changes', w, None, None)
                     self.logger.info('Clearing PrivateSend wallet data')
                     w.db.clear_ps_data()
+                    with self.denoms_lock:
+                        self._ps_denoms_amount_cache = 0
+                        self._denoms_to_mix_cache.clear()
                     self.state = PSStates.Ready
                     self.logger.info('All PrivateSend wallet data cleared')
             return msg
@@ -6,10 +6,12 @@ import random
 import threading
 import time
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from enum import IntEnum
 from math import floor, ceil
 
-from .bip32 import convert_bip32_intpath_to_strpath
+from .bip32 import convert_bip32_intpath_to_strpath, derive_child_keypairs
 from .bitcoin import pubkey_to_address
 from .xazab_tx import STANDARD_TX, PSTxTypes, SPEC_TX_NAMES
 from .xazab_msg import PRIVATESEND_ENTRY_MAX_SIZE
@@ -17,10 +19,10 @@ from .xazab_ps_util import (PSTxWorkflow, PSDenominateWorkflow, PSStates,
                            PS_DENOMS_VALS, COLLATERAL_VAL, MIN_DENOM_VAL,
                            CREATE_COLLATERAL_VAL, CREATE_COLLATERAL_VALS,
                            PSCoinRounds, to_duffs, PS_VALS, PS_SAVED_TX_TYPES,
-                           calc_tx_fee)
+                           calc_tx_fee, PSSchedEvents, PSDenomsPool)
 from .i18n import _
 from .invoices import PR_EXPIRED
-from .keystore import load_keystore, from_seed
+from .keystore import load_keystore, from_seed, BIP32_KeyStore
 from .transaction import PartialTxOutput
 from .util import NotEnoughFunds, InvalidPassword, NoDynamicFeeEstimates
 
@@ -37,6 +39,9 @@ KP_ALL_TYPES = [KP_INCOMING, KP_SPENDABLE,
                 KP_PS_SPENDABLE, KP_PS_COINS, KP_PS_CHANGE]
 KP_MAX_INCOMING_TXS = 5             # max count of txs to split on denoms
                                     # need to calc keypairs count to cache
+KP_FIRST_BATCH_SIZE = 100           # ps coins keys cached before mixing start
+KP_BATCH_SIZE = 1000                # keys derived in one batch after that
+KP_PARALLEL_MIN_KEYS = 200          # min batch size to use worker processes
 
 
 # Keypairs cache states
@@ -85,11 +90,24 @@ class KeyPairsMixin:
         self.keypairs_state_lock = threading.Lock()
         self._keypairs_state = KPStates.Empty
         self._keypairs_cache = {}
+        # set when keys to start mixing are cached while still caching
+        self._keypairs_usable = False
+        self._kp_executor = None
+        self._kp_workers = 0
+        self._kp_cache_start_time = None
 
     @property
     def keypairs_state(self):
         return self._keypairs_state
 
+    @property
+    def keypairs_usable(self):
+        '''Keypairs to start mixing workflows are cached, the cache
+        can be still filled with keys for next mixing rounds'''
+        kp_state = self.keypairs_state
+        return (kp_state == KPStates.Ready
+                or kp_state == KPStates.Caching and self._keypairs_usable)
+
     @keypairs_state.setter
     def keypairs_state(self, keypairs_state):
         self._keypairs_state = keypairs_state
@@ -122,16 +140,21 @@ class KeyPairsMixin:
         _make_cache = self._cache_keypairs
         if password is None:
             return
-        while True:
-            if self.keypairs_state == KPStates.NeedCache:
-                try:
-                    await self.loop.run_in_executor(None, _make_cache,
-                                                    password)
-                except Exception as e:
-                    self.logger.info(f'_make_keypairs_cache: {str(e)}')
-                    self._cleanup_unfinished_keypairs_cache()
-                return
-            await asyncio.sleep(1)
+        waiter = self.sched.add_waiter('keypairs_cache')
+        try:
+            while True:
+                if self.keypairs_state == KPStates.NeedCache:
+                    try:
+                        await self.loop.run_in_executor(None, _make_cache,
+                                                        password)
+                    except Exception as e:
+                        self.logger.info(f'_make_keypairs_cache: {str(e)}')
+                        self._cleanup_unfinished_keypairs_cache()
+                    return
+                await waiter.wait('keypairs cache not needed',
+                                  [PSSchedEvents.Keypairs])
+        finally:
+            waiter.close()
 
     def calc_need_sign_cnt(self, new_denoms_cnt):
         w = self.wallet
@@ -260,13 +283,31 @@ class KeyPairsMixin:
 
     def _cache_keypairs(self, password):
         self.logger.info('Making Keyparis Cache')
+        self._kp_cache_start_time = time.time()
         with self.keypairs_state_lock:
+            self._keypairs_usable = False
             self.keypairs_state = KPStates.Caching
 
         for cache_type in KP_ALL_TYPES:
             if cache_type not in self._keypairs_cache:
                 self._keypairs_cache[cache_type] = {}
 
+        try:
+            if not self._fill_keypairs_cache(password):
+                return
+        finally:
+            if self._kp_executor:
+                self._kp_executor.shutdown()
+                self._kp_executor = None
+
+        with self.keypairs_state_lock:
+            self.keypairs_state = KPStates.Ready
+        cached = sum([len(c) for c in self._keypairs_cache.values()])
+        build_time = time.time() - self._kp_cache_start_time
+        self.logger.info(f'Keyparis Cache Done: {cached} keys'
+                         f' in {build_time:.2f}s')
+
+    def _fill_keypairs_cache(self, password):
         if not self._cache_kp_spendable(password):
             return
 
@@ -300,10 +341,111 @@ class KeyPairsMixin:
                                                            kp_chg_left)
             if kp_left is None:
                 return
+        return True
 
+    def _set_keypairs_usable(self):
+        if self._keypairs_usable:
+            return
         with self.keypairs_state_lock:
-            self.keypairs_state = KPStates.Ready
-        self.logger.info('Keyparis Cache Done')
+            if self.keypairs_state != KPStates.Caching:
+                return
+            self._keypairs_usable = True
+        build_time = time.time() - self._kp_cache_start_time
+        self.logger.info(f'Keyparis Cache: keys to start mixing'
+                         f' cached in {build_time:.2f}s')
+        self.postpone_notification('ps-keypairs-changes', self.wallet)
+
+    def _get_kp_executor(self):
+        '''Process pool to derive keys of ps coins/ps change addresses,
+        exists only while caching, as workers get decrypted branch keys'''
+        if self._kp_executor:
+            return self._kp_executor
+        workers = self.config.get_ps_keypairs_workers()
+        if workers <= 1:
+            return
+        try:
+            self._kp_executor = ProcessPoolExecutor(max_workers=workers)
+            self._kp_workers = workers
+            self.logger.info(f'Deriving keypairs in {workers} processes')
+        except (ImportError, NotImplementedError, OSError) as e:
+            self.logger.info(f'Keypairs are derived in one thread: {repr(e)}')
+        return self._kp_executor
+
+    def _derive_branch_keys(self, privkey, chaincode, indices):
+        executor = None
+        if len(indices) >= KP_PARALLEL_MIN_KEYS:
+            executor = self._get_kp_executor()
+        if executor:
+            part_size = -(-len(indices) // self._kp_workers)
+            parts_indices = [indices[i:i+part_size]
+                             for i in range(0, len(indices), part_size)]
+            try:
+                res = []
+                for part in executor.map(derive_child_keypairs,
+                                         [privkey] * len(parts_indices),
+                                         [chaincode] * len(parts_indices),
+                                         parts_indices):
+                    res.extend(part)
+                return res
+            except BrokenProcessPool as e:
+                self.logger.warning(f'Keypairs derivation pool failed,'
+                                    f' derive in one thread: {repr(e)}')
+                self._kp_executor.shutdown(wait=False)
+                self._kp_executor = None
+        return derive_child_keypairs(privkey, chaincode, indices)
+
+    def _derive_branch_keypairs(self, for_change, indices, password,
+                                force_main_ks=False):
+        '''Derive keypairs for branch addresses at indices,
+        returns list of (addr, pubkey, sec)'''
+        w = self.wallet
+        if self.ps_keystore and not force_main_ks:
+            ks = self.ps_keystore
+            txin_type = self.ps_ks_txin_type
+        else:
+            ks = w.keystore
+            txin_type = w.txin_type
+        res = []
+        if isinstance(ks, BIP32_KeyStore):
+            privkey, chaincode = ks.get_private_branch(for_change, password)
+            for sec, pubkey in self._derive_branch_keys(privkey, chaincode,
+                                                        indices):
+                pubkey = pubkey.hex()
+                addr = pubkey_to_address(txin_type, pubkey)
+                res.append((addr, pubkey, (sec, True)))
+        else:
+            pubkeys = ks.derive_pubkeys(for_change, indices)
+            secs = ks.get_private_keys([[for_change, i] for i in indices],
+                                       password)
+            for pubkey, sec in zip(pubkeys, secs):
+                pubkey = pubkey.hex()
+                addr = pubkey_to_address(txin_type, pubkey)
+                res.append((addr, pubkey, sec))
+        return res
+
+    def _get_addrs_keypairs(self, addrs, password):
+        '''Get keypairs for wallet addresses, returns dict addr: (pubkey, sec).
+        Keystores secrets decrypted once for all addresses'''
+        w = self.wallet
+        ks_sequences = {}
+        for addr in addrs:
+            sequence = None
+            if self.ps_keystore:
+                sequence = self.get_address_index(addr)
+            if sequence:
+                ks = self.ps_keystore
+            else:
+                ks = w.keystore
+                sequence = w.get_address_index(addr)
+            ks_sequences.setdefault(ks, []).append((addr, sequence))
+        res = {}
+        for ks, addr_sequences in ks_sequences.items():
+            secs = ks.get_private_keys([seq for addr, seq in addr_sequences],
+                                       password)
+            for (addr, sequence), sec in zip(addr_sequences, secs):
+                pubkey = ks.derive_pubkey(*sequence).hex()
+                res[addr] = (pubkey, sec)
+        return res
 
     def _cache_kp_incoming(self, password):
         w = self.wallet
@@ -316,17 +458,16 @@ class KeyPairsMixin:
             if self.state != PSStates.Mixing:
                 self._cleanup_unfinished_keypairs_cache()
                 return
-            sequence = [0, ri]
-            pubkey = w.keystore.derive_pubkey(*sequence).hex()
-            addr = pubkey_to_address(w.txin_type, pubkey)
-            ri += 1
-            if w.is_used(addr):
-                continue
-            if addr in ps_incoming_cache:
-                continue
-            sec = w.keystore.get_private_key(sequence, password)
-            ps_incoming_cache[addr] = (pubkey, sec)
-            cached += 1
+            indices = list(range(ri, ri + KP_MAX_INCOMING_TXS - cached))
+            ri += len(indices)
+            for addr, pubkey, sec in self._derive_branch_keypairs(
+                    0, indices, password, force_main_ks=True):
+                if w.is_used(addr):
+                    continue
+                if addr in ps_incoming_cache:
+                    continue
+                ps_incoming_cache[addr] = (pubkey, sec)
+                cached += 1
         self.logger.info(f'Cached {cached} keys'
                          f' of {KP_INCOMING} type')
         self.postpone_notification('ps-keypairs-changes', self.wallet)
@@ -334,7 +475,6 @@ class KeyPairsMixin:
     def _cache_kp_spendable(self, password):
         '''Cache spendable regular coins keys'''
         w = self.wallet
-        cached = 0
         with w._freeze_lock:
             frozen_addresses = w._frozen_addresses.copy()
         utxos = w.get_utxos(None,
@@ -342,25 +482,15 @@ class KeyPairsMixin:
                             mature_only=True)
         utxos = [utxo for utxo in utxos if not w.is_frozen_coin(utxo)]
         utxos = self.filter_out_hw_ks_coins(utxos)
-        for c in utxos:
-            if self.state != PSStates.Mixing:
-                self._cleanup_unfinished_keypairs_cache()
-                return
-            addr = c.address
-            if addr in self._keypairs_cache[KP_SPENDABLE]:
-                continue
-            sequence = None
-            if self.ps_keystore:
-                sequence = self.get_address_index(addr)
-            if sequence:
-                pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-                sec = self.ps_keystore.get_private_key(sequence, password)
-            else:
-                sequence = w.get_address_index(addr)
-                pubkey = w.keystore.derive_pubkey(*sequence).hex()
-                sec = w.keystore.get_private_key(sequence, password)
-            self._keypairs_cache[KP_SPENDABLE][addr] = (pubkey, sec)
-            cached += 1
+        spendable_cache = self._keypairs_cache[KP_SPENDABLE]
+        addrs = [addr for addr in dict.fromkeys(c.address for c in utxos)
+                 if addr not in spendable_cache]
+        if self.state != PSStates.Mixing:
+            self._cleanup_unfinished_keypairs_cache()
+            return
+        keypairs = self._get_addrs_keypairs(addrs, password)
+        spendable_cache.update(keypairs)
+        cached = len(keypairs)
         if cached:
             self.logger.info(f'Cached {cached} keys of {KP_SPENDABLE} type')
             self.postpone_notification('ps-keypairs-changes', self.wallet)
@@ -369,8 +499,8 @@ class KeyPairsMixin:
     def _cache_kp_ps_spendable(self, password):
         '''Cache spendable ps coins keys (existing denoms/collaterals)'''
         w = self.wallet
-        cached = 0
         ps_spendable_cache = self._keypairs_cache[KP_PS_SPENDABLE]
+        addrs = {}
         for c in self.filter_out_hw_ks_coins(
                 w.get_utxos(None, min_rounds=PSCoinRounds.COLLATERAL)):
             if self.state != PSStates.Mixing:
@@ -385,18 +515,10 @@ class KeyPairsMixin:
                 continue  # skip denoms on hw keystore
             if addr in ps_spendable_cache:
                 continue
-            sequence = None
-            if self.ps_keystore:
-                sequence = self.get_address_index(addr)
-            if sequence:
-                pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-                sec = self.ps_keystore.get_private_key(sequence, password)
-            else:
-                sequence = w.get_address_index(addr)
-                pubkey = w.keystore.derive_pubkey(*sequence).hex()
-                sec = w.keystore.get_private_key(sequence, password)
-            ps_spendable_cache[addr] = (pubkey, sec)
-            cached += 1
+            addrs[addr] = None
+        keypairs = self._get_addrs_keypairs(addrs, password)
+        ps_spendable_cache.update(keypairs)
+        cached = len(keypairs)
         if cached:
             self.logger.info(f'Cached {cached} keys of {KP_PS_SPENDABLE} type')
             self.postpone_notification('ps-keypairs-changes', self.wallet)
@@ -406,7 +528,8 @@ class KeyPairsMixin:
         w = self.wallet
         ps_change_cache = self._keypairs_cache[KP_PS_CHANGE]
         ps_coins_cache = self._keypairs_cache[KP_PS_COINS]
-        cached = 0
+        change_addrs = []
+        coins_addrs = []
         for addr, data in self.wallet.db.get_ps_reserved().items():
             if self.state != PSStates.Mixing:
                 self._cleanup_unfinished_keypairs_cache()
@@ -419,150 +542,99 @@ class KeyPairsMixin:
                 sign_change_cnt -= 1
                 if addr in ps_change_cache:
                     continue
-                sequence = None
-                if self.ps_keystore:
-                    sequence = self.get_address_index(addr)
-                if sequence:
-                    pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-                    sec = self.ps_keystore.get_private_key(sequence, password)
-                else:
-                    sequence = w.get_address_index(addr)
-                    pubkey = w.keystore.derive_pubkey(*sequence).hex()
-                    sec = w.keystore.get_private_key(sequence, password)
-                ps_change_cache[addr] = (pubkey, sec)
-                cached += 1
+                change_addrs.append(addr)
             else:
                 sign_cnt -= 1
                 if addr in ps_coins_cache:
                     continue
-                sequence = None
-                if self.ps_keystore:
-                    sequence = self.get_address_index(addr)
-                if sequence:
-                    pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-                    sec = self.ps_keystore.get_private_key(sequence, password)
-                else:
-                    sequence = w.get_address_index(addr)
-                    pubkey = w.keystore.derive_pubkey(*sequence).hex()
-                    sec = w.keystore.get_private_key(sequence, password)
-                ps_coins_cache[addr] = (pubkey, sec)
-                cached += 1
+                coins_addrs.append(addr)
+        keypairs = self._get_addrs_keypairs(change_addrs + coins_addrs,
+                                            password)
+        for addr in change_addrs:
+            ps_change_cache[addr] = keypairs[addr]
+        for addr in coins_addrs:
+            ps_coins_cache[addr] = keypairs[addr]
+        cached = len(keypairs)
         if cached:
             self.logger.info(f'Cached {cached} keys for ps_reserved addresses')
             self.postpone_notification('ps-keypairs-changes', self.wallet)
         return sign_cnt, sign_change_cnt
 
-    def _cache_kp_ps_change(self, password, sign_cnt, sign_change_cnt):
-        if sign_change_cnt > 0:
-            w = self.wallet
-            first_change_index = self.first_unused_index(for_change=True)
-            ps_change_cache = self._keypairs_cache[KP_PS_CHANGE]
-            cached = 0
-            ci = first_change_index
-            while sign_change_cnt > 0:
-                if self.state != PSStates.Mixing:
-                    self._cleanup_unfinished_keypairs_cache()
-                    return None, None
-                sequence = [1, ci]
-                if self.ps_keystore:
-                    pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-                    addr = pubkey_to_address(self.ps_ks_txin_type, pubkey)
+    def _cache_kp_branch(self, password, cache_type, need_cnt):
+        '''Cache keys for need_cnt unused ps coins/ps change addresses,
+        deriving keys in batches, filling cache progressively'''
+        w = self.wallet
+        for_change = (cache_type == KP_PS_CHANGE)
+        cache = self._keypairs_cache[cache_type]
+        cached = 0
+        index = self.first_unused_index(for_change=for_change)
+        while need_cnt > 0:
+            if self.state != PSStates.Mixing:
+                if self._keypairs_usable:
+                    self._keep_unfinished_keypairs_cache()
                 else:
-                    pubkey = w.keystore.derive_pubkey(*sequence).hex()
-                    addr = pubkey_to_address(w.txin_type, pubkey)
-                ci += 1
+                    self._cleanup_unfinished_keypairs_cache()
+                return
+            batch_size = (KP_BATCH_SIZE if self._keypairs_usable
+                          else KP_FIRST_BATCH_SIZE)
+            indices = list(range(index, index + min(need_cnt, batch_size)))
+            index += len(indices)
+            keypairs = {}
+            for addr, pubkey, sec in self._derive_branch_keypairs(
+                    int(for_change), indices, password):
                 if w.is_used(addr):
                     continue
-                sign_change_cnt -= 1
-                if addr in ps_change_cache:
+                need_cnt -= 1
+                if addr in cache:
                     continue
-                if self.ps_keystore:
-                    sec = self.ps_keystore.get_private_key(sequence, password)
-                else:
-                    sec = w.keystore.get_private_key(sequence, password)
-                ps_change_cache[addr] = (pubkey, sec)
-                cached += 1
-                if not cached % 100:
-                    self.logger.info(f'Cached {cached} keys'
-                                     f' of {KP_PS_CHANGE} type')
-            if cached:
-                self.logger.info(f'Cached {cached} keys'
-                                 f' of {KP_PS_CHANGE} type')
-                self.postpone_notification('ps-keypairs-changes', self.wallet)
+                keypairs[addr] = (pubkey, sec)
+            # workflows can already sign with cache (get_keypairs)
+            with self.keypairs_state_lock:
+                cache.update(keypairs)
+            cached += len(keypairs)
+            self.logger.info(f'Cached {cached} keys of {cache_type} type')
+            self.postpone_notification('ps-keypairs-changes', self.wallet)
+            if cache_type == KP_PS_COINS:
+                self._set_keypairs_usable()
+        return need_cnt
+
+    def _cache_kp_ps_change(self, password, sign_cnt, sign_change_cnt):
+        if sign_change_cnt > 0:
+            sign_change_cnt = self._cache_kp_branch(password, KP_PS_CHANGE,
+                                                    sign_change_cnt)
+            if sign_change_cnt is None:
+                return None, None
         return sign_cnt, sign_change_cnt
 
     def _cache_kp_ps_coins(self, password, sign_cnt, sign_change_cnt):
         if sign_cnt > 0:
-            w = self.wallet
-            first_recv_index = self.first_unused_index(for_change=False)
-            ps_coins_cache = self._keypairs_cache[KP_PS_COINS]
-            cached = 0
-            ri = first_recv_index
-            while sign_cnt > 0:
-                if self.state != PSStates.Mixing:
-                    self._cleanup_unfinished_keypairs_cache()
-                    return None, None
-                sequence = [0, ri]
-                if self.ps_keystore:
-                    pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-                    addr = pubkey_to_address(self.ps_ks_txin_type, pubkey)
-                else:
-                    pubkey = w.keystore.derive_pubkey(*sequence).hex()
-                    addr = pubkey_to_address(w.txin_type, pubkey)
-                ri += 1
-                if w.is_used(addr):
-                    continue
-                sign_cnt -= 1
-                if addr in ps_coins_cache:
-                    continue
-                if self.ps_keystore:
-                    sec = self.ps_keystore.get_private_key(sequence, password)
-                else:
-                    sec = w.keystore.get_private_key(sequence, password)
-                ps_coins_cache[addr] = (pubkey, sec)
-                cached += 1
-                if not cached % 100:
-                    self.logger.info(f'Cached {cached} keys'
-                                     f' of {KP_PS_COINS} type')
-            if cached:
-                self.logger.info(f'Cached {cached} keys'
-                                 f' of {KP_PS_COINS} type')
-                self.postpone_notification('ps-keypairs-changes', self.wallet)
+            sign_cnt = self._cache_kp_branch(password, KP_PS_COINS, sign_cnt)
+            if sign_cnt is None:
+                return None, None
         return sign_cnt, sign_change_cnt
 
     def _cache_kp_tmp_reserved(self, password):
-        w = self.wallet
         addr = self.get_tmp_reserved_address()
         if not addr:
             return False
-        sequence = None
-        if self.ps_keystore:
-            sequence = self.get_address_index(addr)
-        if sequence:
-            pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-            sec = self.ps_keystore.get_private_key(sequence, password)
-        else:
-            sequence = w.get_address_index(addr)
-            pubkey = w.keystore.derive_pubkey(*sequence).hex()
-            sec = w.keystore.get_private_key(sequence, password)
         spendable_cache = self._keypairs_cache[KP_SPENDABLE]
-        spendable_cache[addr] = (pubkey, sec)
+        keypairs = self._get_addrs_keypairs([addr], password)
+        with self.keypairs_state_lock:
+            spendable_cache.update(keypairs)
         self.logger.info(f'Cached key of {KP_SPENDABLE} type'
                          f' for tmp reserved address')
         self.postpone_notification('ps-keypairs-changes', self.wallet)
         ps_coins_cache = self._keypairs_cache[KP_PS_COINS]
-        if addr in ps_coins_cache:
-            ps_coins_cache.pop(addr, None)
-            return True
-        else:
-            return False
+        with self.keypairs_state_lock:
+            return ps_coins_cache.pop(addr, None) is not None
 
     def _find_addrs_not_in_keypairs(self, addrs):
         addrs = set(addrs)
         keypairs_addrs = set()
-        for cache_type in KP_ALL_TYPES:
-            if cache_type in self._keypairs_cache:
-                keypairs_addrs |= self._keypairs_cache[cache_type].keys()
+        with self.keypairs_state_lock:
+            for cache_type in KP_ALL_TYPES:
+                if cache_type in self._keypairs_cache:
+                    keypairs_addrs |= self._keypairs_cache[cache_type].keys()
         return addrs - keypairs_addrs
 
     def unpack_mine_input_addrs(func):
@@ -584,6 +656,10 @@ class KeyPairsMixin:
 
     @unpack_mine_input_addrs
     def _cleanup_spendable_keypairs(self, txid, tx_type, inputs, outputs):
+        with self.keypairs_state_lock:
+            self._move_spendable_keypairs(inputs, outputs)
+
+    def _move_spendable_keypairs(self, inputs, outputs):
         spendable_cache = self._keypairs_cache.get(KP_SPENDABLE, {})
         # first input addr used for change in new denoms/collateral txs
         first_input_addr = inputs[0][1]
@@ -609,6 +685,10 @@ class KeyPairsMixin:
 
     @unpack_mine_input_addrs
     def _cleanup_ps_keypairs(self, txid, tx_type, inputs, outputs):
+        with self.keypairs_state_lock:
+            self._move_ps_keypairs(txid, tx_type, inputs, outputs)
+
+    def _move_ps_keypairs(self, txid, tx_type, inputs, outputs):
         ps_spendable_cache = self._keypairs_cache.get(KP_PS_SPENDABLE, {})
         ps_coins_cache = self._keypairs_cache.get(KP_PS_COINS, {})
         ps_change_cache = self._keypairs_cache.get(KP_PS_CHANGE, {})
@@ -637,10 +717,18 @@ class KeyPairsMixin:
     def _cleanup_unfinished_keypairs_cache(self):
         with self.keypairs_state_lock:
             self.logger.info('Cleaning unfinished Keyparis Cache')
+            self._keypairs_usable = False
             self._cleanup_all_keypairs_cache()
             self.keypairs_state = KPStates.Empty
             self.logger.info('Cleaned Keyparis Cache')
 
+    def _keep_unfinished_keypairs_cache(self):
+        '''Running mixing sessions sign with already cached keys,
+        the cache is marked unused when mixing is stopped'''
+        with self.keypairs_state_lock:
+            self.logger.info('Keeping unfinished Keyparis Cache')
+            self.keypairs_state = KPStates.Ready
+
     def _cleanup_all_keypairs_cache(self):
         if not self._keypairs_cache:
             return
@@ -653,32 +741,19 @@ class KeyPairsMixin:
 
     def get_keypairs(self):
         keypairs = {}
-        for cache_type in KP_ALL_TYPES:
-            if cache_type not in self._keypairs_cache:
-                continue
-            for pubkey, sec in self._keypairs_cache[cache_type].values():
-                keypairs[pubkey] = sec
+        # cache can be filled in the executor thread while workflows sign
+        with self.keypairs_state_lock:
+            for cache_type in KP_ALL_TYPES:
+                if cache_type not in self._keypairs_cache:
+                    continue
+                for pubkey, sec in self._keypairs_cache[cache_type].values():
+                    keypairs[pubkey] = sec
         return keypairs
 
     def get_keypairs_for_denominate_tx(self, tx, password):
-        w = self.wallet
-        keypairs = {}
-        for txin in tx.inputs():
-            addr = txin.address
-            if addr is None:
-                continue
-            sequence = None
-            if self.ps_keystore:
-                sequence = self.get_address_index(addr)
-            if sequence:
-                pubkey = self.ps_keystore.derive_pubkey(*sequence).hex()
-                sec = self.ps_keystore.get_private_key(sequence, password)
-            else:
-                sequence = w.get_address_index(addr)
-                pubkey = w.keystore.derive_pubkey(*sequence).hex()
-                sec = w.keystore.get_private_key(sequence, password)
-            keypairs[pubkey] = sec
-        return keypairs
+        addrs = [txin.address for txin in tx.inputs()
+                 if txin.address is not None]
+        return dict(self._get_addrs_keypairs(addrs, password).values())
 
     def sign_transaction(self, tx, password, mine_txins_cnt=None):
         if self._keypairs_cache or mine_txins_cnt:
@@ -713,9 +788,14 @@ class PSDataMixin:
         for addr, value, rounds in denoms.values():
             self._ps_denoms_amount_cache += value
 
-        # _denoms_to_mix_cache recalculated on mix_rounds change and
-        # in add[_mixing]_denom/pop[_mixing]_denom methods
-        self._denoms_to_mix_cache = self.denoms_to_mix()
+        # _denoms_to_mix_cache is a pool of not spending denoms, updated
+        # in add[_spending]_denom/pop[_spending]_denom methods, its max_rounds
+        # changed with mix_rounds
+        spending = wallet.db.get_ps_spending_denoms()
+        self._denoms_to_mix_cache = PSDenomsPool(
+            self.mix_rounds, {outpoint: denom
+                              for outpoint, denom in denoms.items()
+                              if outpoint not in spending})
 
         # sycnhronizer unsubsribed addresses
         self.spent_addrs = set()
@@ -772,14 +852,14 @@ class PSDataMixin:
     def add_ps_denom(self, outpoint, denom):  # denom is (addr, value, rounds)
         self.wallet.db._add_ps_denom(outpoint, denom)
         self._ps_denoms_amount_cache += denom[1]
-        if denom[2] < self.mix_rounds:  # if rounds < mix_rounds
-            self._denoms_to_mix_cache[outpoint] = denom
+        if not self.wallet.db.get_ps_spending_denom(outpoint):
+            self._denoms_to_mix_cache.add(outpoint, denom)
 
     def pop_ps_denom(self, outpoint):
         denom = self.wallet.db._pop_ps_denom(outpoint)
         if denom:
             self._ps_denoms_amount_cache -= denom[1]
-            self._denoms_to_mix_cache.pop(outpoint, None)
+            self._denoms_to_mix_cache.remove(outpoint)
         return denom
 
     def calc_denoms_by_values(self):
@@ -793,13 +873,15 @@ class PSDataMixin:
 
     def add_ps_spending_denom(self, outpoint, wfl_uuid):
         self.wallet.db._add_ps_spending_denom(outpoint, wfl_uuid)
-        self._denoms_to_mix_cache.pop(outpoint, None)
+        self._denoms_to_mix_cache.remove(outpoint)
 
     def pop_ps_spending_denom(self, outpoint):
         db = self.wallet.db
         denom = db.get_ps_denom(outpoint)
-        if denom and denom[2] < self.mix_rounds:  # if rounds < mix_rounds
-            self._denoms_to_mix_cache[outpoint] = denom
+        if denom:
+            self._denoms_to_mix_cache.add(outpoint, denom)
+            # denom is back to pool, wakes up waiting for denoms to mix
+            self.sched.notify(PSSchedEvents.PSData)
         return db._pop_ps_spending_denom(outpoint)
 
     @property